@@ -0,0 +1,601 @@
+"""
+Benchmark suite for object construction, serialization and upload.
+
+Every benchmark runs in its own process, which reports the best time per
+call of a few runs and the growth of the peak resident memory.
+
+Usage::
+
+    python benchmarks/run.py [--quick] [--save] [--check] [NAME ...]
+
+``--save`` stores the results as the baseline in
+``benchmarks/baseline.json``, ``--check`` compares them with the baseline
+and exits with status 1 if a benchmark got slower or uses more memory than
+the tolerance allows. Baselines are only comparable on the same machine.
+
+A benchmark that returns a string records its length, one that returns a
+number of bytes records that number, as ``bytes``.
+"""
+
+import atexit
+import imp
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import timeit
+from array import array
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'tests')]
+
+import eeml
+from eeml import Data, DataPoints, EEML, Environment, RingDataPoints, \
+     metrics, state
+from eeml.aggregate import buckets, lttb
+from eeml.datastream import Cosm, ConnectionPool
+from eeml.formats import FORMATS
+from eeml.parser import fromstring
+from eeml.invalidator import Invalidator
+from eeml.timestamp import TimestampFormatter
+from eeml.unit import Celsius
+from eeml.util import _gzip, _tostring, _FixedOffset, _utc
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'baseline.json')
+# allowed slowdown and memory growth before --check fails
+TOLERANCE = {'seconds': 0.5, 'peak_kb': 0.25, 'bytes': 0.1}
+# memory growth below this is noise
+MIN_PEAK_KB = 2048
+# the shortest time measured at once, fast benchmarks are run repeatedly
+MIN_SECONDS = 0.2
+
+AT = datetime(2012, 9, 12, 11, 0, 0)
+
+BENCHMARKS = []
+
+
+def benchmark(name, quick=True):
+    """
+    Register a benchmark. The decorated function does the setup and returns
+    the function to time.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, quick, setup))
+        return setup
+    return register
+
+
+def document(streams, points=0):
+    """
+    Create a document with streams datastreams and points datapoints in the
+    first one
+    """
+    doc = EEML(Environment(title='benchmark', id_=1))
+    doc.updateData([Data(i, i * 0.5, tags=['bench'], unit=Celsius(), at=AT)
+                    for i in xrange(streams)])
+    if points:
+        step = timedelta(seconds=1)
+        doc.updateData(DataPoints(0, [(i * 0.5, AT + i * step)
+                                      for i in xrange(points)]))
+    return doc
+
+
+def construct(count):
+    unit = Celsius()
+    for i in xrange(count):
+        Data(i, 21.5, unit=unit, at=AT)
+
+
+@benchmark('construct_data_10k')
+def construct_validated():
+    return lambda: construct(10000)
+
+
+@benchmark('construct_data_10k_invalidator')
+def construct_invalidated():
+    eeml.validator = Invalidator()
+    return lambda: construct(10000)
+
+
+@benchmark('construct_data_10k_metrics')
+def construct_measured():
+    metrics.add_hook(metrics.Registry())
+    return lambda: construct(10000)
+
+
+@benchmark('construct_data_10k_deferred')
+def construct_deferred():
+    eeml.defer_validation = True
+    return lambda: construct(10000)
+
+
+def size(obj):
+    """
+    Size of obj and its instance dictionary in bytes, not counting the
+    attribute values
+    """
+    total = sys.getsizeof(obj)
+    if hasattr(obj, '__dict__'):
+        total += sys.getsizeof(obj.__dict__)
+    return total
+
+
+@benchmark('bytes_per_data_with_unit_10k')
+def data_size():
+    def run():
+        # every reading with its own stock unit, like the examples do
+        datas = [Data(i, 21.5, unit=Celsius(), at=AT) for i in xrange(10000)]
+        units = dict((id(data._unit), data._unit) for data in datas)
+        return (sum(size(data) for data in datas) +
+                sum(size(unit) for unit in units.itervalues())) // 10000
+    return run
+
+
+def matrix(streams):
+    """
+    A row of a sensor matrix
+    """
+    return range(streams), [i * 0.5 for i in xrange(streams)]
+
+
+@benchmark('update_data_loop_5000_streams')
+def update_loop():
+    env = Environment()
+    ids, values = matrix(5000)
+    unit = Celsius()
+
+    def run():
+        for id_, value in zip(ids, values):
+            env.updateData(Data(id_, value, ['bench'], unit=unit, at=AT))
+    return run
+
+
+@benchmark('update_from_arrays_5000_streams')
+def update_arrays():
+    env = Environment()
+    ids, values = matrix(5000)
+    return lambda: env.update_from_arrays(ids, values, Celsius(), ['bench'],
+                                          AT)
+
+
+def update_numpy():
+    import numpy
+    env = Environment()
+    ids = numpy.arange(5000)
+    values = numpy.arange(5000) * 0.5
+    return lambda: env.update_from_arrays(ids, values, Celsius(), ['bench'],
+                                          AT)
+
+try:
+    imp.find_module('numpy')
+except ImportError:
+    pass
+else:
+    benchmark('update_from_arrays_5000_streams_numpy')(update_numpy)
+
+
+@benchmark('construct_datapoints_100k')
+def construct_datapoints():
+    step = timedelta(seconds=1)
+    pairs = [(i * 0.5, AT + i * step) for i in xrange(100000)]
+    return lambda: DataPoints(1, list(pairs))
+
+
+@benchmark('construct_array_datapoints_100k')
+def construct_array_datapoints():
+    values = [i * 0.5 for i in xrange(100000)]
+    stamps = [1347447600 + i for i in xrange(100000)]
+    return lambda: DataPoints.from_arrays(1, values, stamps)
+
+
+@benchmark('bytes_per_point_list_100k')
+def list_points_size():
+    step = timedelta(seconds=1)
+
+    def run():
+        pairs = [(i * 0.5, AT + i * step) for i in xrange(100000)]
+        DataPoints(1, pairs)
+        total = sys.getsizeof(pairs)
+        for pair in pairs:
+            total += sys.getsizeof(pair) + sum(map(sys.getsizeof, pair))
+        return total // 100000
+    return run
+
+
+@benchmark('bytes_per_point_array_100k')
+def array_points_size():
+    values = [i * 0.5 for i in xrange(100000)]
+    stamps = [1347447600 + i for i in xrange(100000)]
+
+    def run():
+        points = DataPoints.from_arrays(1, values, stamps)
+        return (sys.getsizeof(points._array) +
+                sys.getsizeof(points._timestamps)) // 100000
+    return run
+
+
+@benchmark('ring_datapoints_append_100k')
+def ring_datapoints():
+    points = RingDataPoints(1, 1000)
+
+    def run():
+        for i in xrange(100000):
+            points.append(i * 0.5, 1347447600 + i)
+    return run
+
+
+def readings(count):
+    values = array('d', (math.sin(i * 0.001) for i in xrange(count)))
+    stamps = array('d', (1347447600 + i * 0.01 for i in xrange(count)))
+    return values, stamps
+
+
+@benchmark('aggregate_mean_60s_1m_readings')
+def aggregate_mean():
+    values, stamps = readings(1000000)
+    return lambda: buckets(values, stamps, 60)
+
+
+@benchmark('aggregate_lttb_1000_of_1m_readings')
+def aggregate_lttb():
+    values, stamps = readings(1000000)
+    return lambda: lttb(values, stamps, 1000)
+
+
+def serializers(streams, points, quick):
+    def tree():
+        doc = document(streams, points)
+        # the backend is imported on first use, keep it out of the peak
+        _tostring(Data(1, 2).toeeml())
+        return lambda: _tostring(doc.toeeml())
+
+    def stream():
+        doc = document(streams, points)
+        datas = doc._environment._data.values()
+
+        def run():
+            # measure serialization, not the fragment cache
+            for data in datas:
+                data._cache = None
+            return ''.join(doc.iter_bytes())
+        return run
+
+    suffix = '{}_streams_{}_points'.format(streams, points)
+    benchmark('toeeml_tostring_' + suffix, quick)(tree)
+    benchmark('iter_bytes_' + suffix, quick)(stream)
+
+for streams in (1, 100, 10000):
+    serializers(streams, 0, True)
+for points in (1000, 100000, 1000000):
+    serializers(1, points, points < 1000000)
+
+
+def formats(name):
+    def streams():
+        doc = document(1000)
+        datas = doc._environment._data.values()
+        fmt = FORMATS[name]
+
+        def run():
+            for data in datas:
+                data._cache = None
+            return ''.join(fmt.iter_bytes(doc))
+        return run
+
+    def points():
+        doc = EEML(Environment(title='benchmark', id_=1))
+        doc.updateData(DataPoints.from_arrays(
+                0, [i * 0.5 for i in xrange(100000)],
+                [1347447600 + i for i in xrange(100000)]))
+        fmt = FORMATS[name]
+        return lambda: ''.join(fmt.iter_bytes(doc))
+
+    benchmark('serialize_{}_1000_streams'.format(name))(streams)
+    benchmark('serialize_{}_100000_array_points'.format(name))(points)
+
+for name in ('xml', 'json', 'csv'):
+    formats(name)
+
+
+def compression(level):
+    def run():
+        step = timedelta(seconds=1)
+        doc = EEML(Environment(title='benchmark', id_=1))
+        for i in xrange(20):
+            doc.updateData(Data(i, 21.5, unit=Celsius(), at=AT))
+            doc.updateData(DataPoints(i, [(20 + (j % 50) * 0.1, AT + j * step)
+                                          for j in xrange(500)]))
+        datas = doc._environment._data.values()
+
+        def body():
+            for data in datas:
+                data._cache = None
+            if level is None:
+                return ''.join(doc.iter_bytes())
+            return _gzip(doc.iter_bytes(), level)
+        return body
+
+    benchmark('put_body_20_streams_500_points_{}'.format(
+            'plain' if level is None else 'gzip_{}'.format(level)))(run)
+
+for level in (None, 1, 6, 9):
+    compression(level)
+
+
+def feeds(count, streams):
+    """
+    Create count documents of streams datastreams
+    """
+    docs = []
+    for feed in xrange(count):
+        doc = EEML(Environment(title='feed {}'.format(feed), id_=feed))
+        doc.updateData([Data(i, feed + i * 0.5, tags=['bench'],
+                             unit=Celsius(), at=AT) for i in xrange(streams)])
+        docs.append(doc)
+    return docs
+
+
+@benchmark('state_dumps_1000_feeds_10_streams')
+def state_dumps():
+    docs = feeds(1000, 10)
+    return lambda: state.dumps(docs)
+
+
+@benchmark('state_loads_1000_feeds_10_streams')
+def state_loads():
+    text = state.dumps(feeds(1000, 10))
+    return lambda: state.loads(text)
+
+
+@benchmark('fromstring_1000_feeds_10_streams')
+def parse_feeds():
+    texts = [''.join(doc.iter_bytes()) for doc in feeds(1000, 10)]
+    # the backend is imported on first use, keep it out of the peak
+    fromstring(texts[0])
+    return lambda: [fromstring(text) for text in texts]
+
+
+@benchmark('state_loads_100000_array_points')
+def state_points():
+    doc = EEML(Environment(title='benchmark', id_=1))
+    doc.updateData(DataPoints.from_arrays(
+            0, [i * 0.5 for i in xrange(100000)],
+            [1347447600 + i for i in xrange(100000)]))
+    text = state.dumps(doc)
+    return lambda: state.loads(text)
+
+
+@benchmark('iter_bytes_cached_10000_streams_1_changed')
+def cached():
+    doc = document(10000)
+    ''.join(doc.iter_bytes())
+
+    def run():
+        doc.updateData(Data(1, 2.5, unit=Celsius()))
+        return ''.join(doc.iter_bytes())
+    return run
+
+
+@benchmark('update_data_10000_streams_100_per_snapshot')
+def snapshots():
+    env = document(10000)._environment
+    readings = [Data(i, 2.5, unit=Celsius()) for i in xrange(100)]
+
+    def run():
+        # the first update after a snapshot copies the data
+        env.snapshot()
+        for data in readings:
+            env.updateData(data)
+    return run
+
+
+@benchmark('iter_bytes_1000_streams_all_updated')
+def updated():
+    doc = document(1000)
+    ''.join(doc.iter_bytes())
+
+    def run():
+        doc.updateData([Data(i, i * 0.25, tags=['bench'], unit=Celsius(),
+                             at=AT) for i in xrange(1000)])
+        return ''.join(doc.iter_bytes())
+    return run
+
+
+def timestamps(kind):
+    if kind == 'epoch':
+        return [1347447600 + i * 0.25 for i in xrange(100000)]
+    step = timedelta(seconds=0.25)
+    tz = _FixedOffset(60) if kind == 'aware' else None
+    return [AT.replace(tzinfo=tz) + i * step for i in xrange(100000)]
+
+for kind in ('naive', 'aware', 'epoch'):
+    def plain(kind=kind):
+        values = timestamps(kind)
+        if kind == 'epoch':
+            return lambda: [datetime.fromtimestamp(at, _utc).isoformat()
+                            for at in values]
+        return lambda: [at.isoformat() for at in values]
+
+    def formatter(kind=kind):
+        values = timestamps(kind)
+        return lambda: TimestampFormatter().format_many(values)
+
+    benchmark('isoformat_100k_' + kind)(plain)
+    benchmark('timestamp_formatter_100k_' + kind)(formatter)
+
+
+def startup(statement, env=None):
+    command = [sys.executable, '-c', statement]
+    environ = dict(os.environ, **(env or {}))
+    return lambda: subprocess.check_call(command, env=environ, cwd=ROOT)
+
+
+@benchmark('startup_python')
+def startup_python():
+    return startup('pass')
+
+
+@benchmark('startup_import_eeml')
+def startup_eeml():
+    return startup('import eeml')
+
+
+@benchmark('startup_import_eeml_datastream')
+def startup_datastream():
+    return startup('import eeml.datastream')
+
+
+@benchmark('startup_toeeml_lxml')
+def startup_lxml():
+    return startup('import eeml; eeml.Data(1, 2).toeeml()',
+                   {'EEML_BACKEND': 'lxml'})
+
+
+@benchmark('startup_toeeml_stdlib')
+def startup_stdlib():
+    return startup('import eeml; eeml.Data(1, 2).toeeml()',
+                   {'EEML_BACKEND': 'stdlib'})
+
+
+def put(streams, changed=None):
+    from stub_server import StubServer
+    server = StubServer()
+    atexit.register(server.stop)
+    cosm = Cosm(1, 'ASDF', use_https=False, pool=ConnectionPool())
+    cosm.host = server.host
+    cosm.update(document(streams)._environment._data.values())
+
+    # after the first put, a put only sends the changed datastreams
+    if changed is None:
+        def run():
+            cosm.put(full=True)
+            del server.requests[:]
+        return run
+
+    cosm.put()
+    updates = [Data(id_, 0.5) for id_ in range(changed)]
+
+    def delta():
+        cosm.update(updates)
+        cosm.put()
+        del server.requests[:]
+    return delta
+
+
+@benchmark('put_1_stream')
+def put_small():
+    return put(1)
+
+
+@benchmark('put_1000_streams')
+def put_large():
+    return put(1000)
+
+
+@benchmark('put_1_of_1000_streams')
+def put_delta():
+    return put(1000, 1)
+
+
+def measure(name, repeat):
+    """
+    Run a benchmark in this process
+    """
+    for bench, quick, setup in BENCHMARKS:
+        if bench == name:
+            break
+    else:
+        raise KeyError(name)
+    run = setup()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    number = 1
+    seconds = timeit.timeit(run, number=number)
+    while seconds < MIN_SECONDS:
+        number *= 10
+        seconds = timeit.timeit(run, number=number)
+    seconds = min([seconds] + timeit.repeat(run, number=number,
+                                            repeat=repeat - 1)) / number
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    result = {'seconds': seconds, 'peak_kb': peak}
+    output = run()
+    if isinstance(output, str):
+        # the payload size of serializers, to compare formats
+        result['bytes'] = len(output)
+    elif isinstance(output, (int, long)):
+        result['bytes'] = output
+    return result
+
+
+def spawn(name, repeat):
+    """
+    Run a benchmark in a new process
+    """
+    output = subprocess.check_output([sys.executable, __file__, '--child',
+                                      name, str(repeat)])
+    return json.loads(output)
+
+
+def regressions(results, baseline):
+    """
+    Compare results with the baseline
+    """
+    found = []
+    for name, result in sorted(results.iteritems()):
+        if name not in baseline:
+            continue
+        for key, tolerance in TOLERANCE.iteritems():
+            if key not in result or key not in baseline[name]:
+                continue
+            old = baseline[name][key]
+            if key == 'peak_kb' and max(old, result[key]) < MIN_PEAK_KB:
+                continue
+            if result[key] > old * (1 + tolerance):
+                found.append('{} {}: {:.4g} > {:.4g}'.format(
+                        name, key, result[key], old))
+    return found
+
+
+def main(args):
+    if args[:1] == ['--child']:
+        print(json.dumps(measure(args[1], int(args[2]))))
+        return 0
+
+    flags = set(arg for arg in args if arg.startswith('--'))
+    names = [arg for arg in args if not arg.startswith('--')]
+    results = {}
+    for name, quick, setup in BENCHMARKS:
+        if names and name not in names:
+            continue
+        if not names and '--quick' in flags and not quick:
+            continue
+        results[name] = result = spawn(name, 3 if quick else 1)
+        print('{:45} {:12.6f} s {:10d} kB{}'.format(
+                name, result['seconds'], result['peak_kb'],
+                ' {:12d} B'.format(result['bytes']) if 'bytes' in result
+                else ''))
+
+    if '--save' in flags:
+        baseline = {}
+        if os.path.exists(BASELINE):
+            with open(BASELINE) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(BASELINE, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True,
+                      separators=(',', ': '))
+            f.write('\n')
+    if '--check' in flags:
+        with open(BASELINE) as f:
+            found = regressions(results, json.load(f))
+        for line in found:
+            print('REGRESSION ' + line)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -12,30 +12,131 @@ __authors__ = "Peter Vizi"
 __license__ = "GPLv3"
 __docformat__ = "restructuredtext en"
 
-from datetime import date, datetime
+import threading
+import time
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import izip, repeat
 
+from eeml import metrics
+from eeml.metrics import timed
 from eeml.namespace import EEML_SCHEMA_VERSION, SCHEMA_LOCATION
+from eeml.timestamp import default_formatter, isoformat
 from eeml.unit import Unit
-from eeml.util import _elem, _addE, _addA, _assertPosInt
+from eeml.util import _elem, _addE, _addA, _assertPosInt, _strE, _strA, \
+     _leaf, _escape, _write, _ROOT_NSDECL, _doubles, _epochUsArray, \
+     _fromEpochUs, _epochUs, _ndarray, _Slotted
 from eeml.validator import Validator
 
 validator = Validator()
 
+# validate the whole document when it is serialized instead of each object
+# in its constructor
+defer_validation = False
+
 def validate(validatorMethodName):
     def fn(realf):
-        def wrapper(*args, **kwargs):
-            realf(*args, **kwargs)
-            vtor = getattr(validator, validatorMethodName)
-            vtor(args[0])
+        # the validator and its method, looked up again only if the
+        # validator is replaced
+        bound = [None, None]
+        labels = (('type', validatorMethodName),)
+
+        def wrapper(self, *args, **kwargs):
+            realf(self, *args, **kwargs)
+            if defer_validation:
+                return
+            if bound[0] is not validator:
+                bound[:] = [validator, getattr(validator, validatorMethodName)]
+            if metrics.enabled:
+                start = metrics.clock()
+                bound[1](self)
+                metrics.observe('eeml_validation_seconds',
+                                metrics.clock() - start, labels)
+                return
+            bound[1](self)
 
         return wrapper
     return fn
 
-class Environment(object):
+class _Formats(_Slotted):
+    """
+    Serialization into the other formats of the Cosm API, see
+    `eeml.formats`
+    """
+
+    __slots__ = ()
+
+    def iter_json(self, ids=None):
+        """
+        Serialize this object as JSON, chunk by chunk.
+
+        :param ids: for documents and environments, only include the data
+            with these ids and leave out the metadata
+        :type ids: `set`
+        :return: the byte chunks
+        :rtype: generator of `str`
+        """
+        from eeml.formats import iter_json
+        return iter_json(self, ids)
+
+    def to_json(self, ids=None):
+        """
+        Serialize this object as JSON, see `iter_json`.
+
+        :rtype: `str`
+        """
+        return ''.join(self.iter_json(ids))
+
+    def iter_csv(self, ids=None):
+        """
+        Serialize the values of this object as CSV rows, chunk by chunk.
+
+        :param ids: for documents and environments, only include the data
+            with these ids
+        :type ids: `set`
+        :return: the byte chunks
+        :rtype: generator of `str`
+        """
+        from eeml.formats import iter_csv
+        return iter_csv(self, ids)
+
+    def to_csv(self, ids=None):
+        """
+        Serialize the values of this object as CSV rows, see `iter_csv`.
+
+        :rtype: `str`
+        """
+        return ''.join(self.iter_csv(ids))
+
+
+class Environment(_Formats):
     """
     The Environment element of the document.
+
+    An environment may be shared between threads. The data is kept in a
+    dict that is copied on write: serializers work on a `snapshot` and never
+    block the threads calling `updateData`, which only wait for other
+    updates and, once after each snapshot, for the dict to be copied.
     """
 
+    __slots__ = ('_title', '_feed', '_status', '_description', '_icon',
+                 '_website', '_email', '_updated', '_creator', '_id',
+                 '_location', '_data', '_private', '_head', '_template',
+                 '_lock', '_shared', '_version', '_headVersion', '_changed')
+
+    _transient = {'_lock': threading.Lock, '_head': lambda: None,
+                  '_template': dict, '_shared': bool}
+
+    # the most serialized tags and unit combinations kept in the template
+    _templateLimit = 256
+
+    # the keywords of `setMetadata` and the attributes they set
+    _metadata = {'title': '_title', 'feed': '_feed', 'status': '_status',
+                 'description': '_description', 'icon': '_icon',
+                 'website': '_website', 'email': '_email',
+                 'updated': '_updated', 'creator': '_creator', 'id_': '_id',
+                 'private': '_private'}
+
     @validate('environment')
     def __init__(self, title=None, feed=None, status=None, description=None,
                  icon=None, website=None, email=None, updated=None,
@@ -79,6 +180,52 @@ class Environment(object):
         self._location = None
         self._data = dict()
         self._private = private
+        self._head = None
+        self._template = {}
+        self._lock = threading.Lock()
+        # the data dict is referenced by a snapshot and must be copied
+        # before it is changed
+        self._shared = False
+        # counts the changes, the version of the last change of the metadata
+        # or the location and of each data, see `_changesSince`
+        self._version = 0
+        self._headVersion = 0
+        self._changed = {}
+
+    def setMetadata(self, **metadata):
+        """
+        Change the metadata of this `Environment`, the serialized metadata
+        kept for the next serialization is dropped. The new values are
+        validated on a copy of the metadata first, so this `Environment` is
+        not changed if they are not valid.
+
+        :raise TypeError: if a keyword is not a parameter of the constructor
+        :raise ValueError: if a value is not valid
+
+        :param metadata: the new values, keywords are the parameters of the
+            constructor, like ``title`` or ``status``
+        """
+        for name in metadata:
+            if name not in self._metadata:
+                raise TypeError("unexpected keyword argument {}".format(name))
+        candidate = Environment.__new__(Environment)
+        for attr in self._metadata.itervalues():
+            setattr(candidate, attr, getattr(self, attr))
+        candidate._assign(metadata)
+        with self._lock:
+            for name, value in metadata.iteritems():
+                setattr(self, self._metadata[name], value)
+            self._head = None
+            self._version += 1
+            self._headVersion = self._version
+
+    @validate('environment')
+    def _assign(self, metadata):
+        """
+        Set the metadata of a copy, to validate it
+        """
+        for name, value in metadata.iteritems():
+            setattr(self, self._metadata[name], value)
 
     def setLocation(self, location):
         """
@@ -90,29 +237,211 @@ class Environment(object):
         :type location: `Location`
         """
         if isinstance(location, Location):
-            self._location = location
+            with self._lock:
+                self._location = location
+                self._head = None
+                self._version += 1
+                self._headVersion = self._version
         else:
             raise ValueError("location must be a Location object, got {}"
                              .format(type(location)))
 
+    def _writable(self):
+        """
+        The data dict, copied first if a snapshot refers to it; call with the
+        lock held
+        """
+        if self._shared:
+            self._data = dict(self._data)
+            self._shared = False
+        return self._data
+
     def updateData(self, data):
         """
-        Update data
+        Update data. A `Data` already in this `Environment` is not changed,
+        `DataPoints` replace it with a copy holding them, so snapshots taken
+        before are not affected.
 
         :param data: the data to add
         :type data: `Data`, list of `Data` or `DataPoints` object
         """
-        if isinstance(data, Data):
-            self._data[data._id] = data
-        elif isinstance(data, DataPoints):
-            if data._id in self._data:
-                self._data[data._id]._datapoints = data
-            else:
-                self._data[data._id] = Data(data._id, None, datapoints=data)
-        elif isinstance(data, list):
-            for dat in data:
-                self.updateData(dat)
+        updates = []
+        _flatten(updates, data)
+        with self._lock:
+            target = self._writable()
+            self._version += 1
+            changed = self._changed
+            for dat in updates:
+                changed[dat._id] = self._version
+                if isinstance(dat, Data):
+                    target[dat._id] = dat
+                elif dat._id in target:
+                    target[dat._id] = target[dat._id]._withDatapoints(dat)
+                else:
+                    target[dat._id] = Data(dat._id, None, datapoints=dat)
+
+    def update_from_arrays(self, ids, values, units=None, tags=(), at=None):
+        """
+        Add or replace many `Data` at once, like `updateData` with a `Data`
+        for each id, for example a row of a sensor matrix. The batch is
+        validated in a few passes over the columns instead of once per
+        object, and the `Data` are created without calling the constructor.
+
+        :raise ValueError: if the lengths differ or a value is not valid
+
+        :param ids: the ids of the datastreams
+        :type ids: sequence of `int` or NumPy array
+        :param values: the current values, in the order of the ids
+        :type values: sequence or NumPy array
+        :param units: a unit shared by every datastream or one per id
+        :type units: `Unit` or sequence of `Unit`
+        :param tags: tags shared by every datastream, or the tags of each
+        :type tags: `list` of `str` or sequence of `list`
+        :param at: a time shared by every value or one per id
+        :type at: `datetime`, or sequence of `datetime` or seconds since
+            the epoch, or NumPy array
+        """
+        ids = _column(ids)
+        count = len(ids)
+        values = _column(values, count, 'values')
+        if units is None or isinstance(units, Unit):
+            distinct = [units]
+            units = repeat(units)
+        else:
+            units = distinct = _column(units, count, 'units')
+        if not isinstance(tags, (list, tuple)):
+            tags = list(tags)
+        if not tags or isinstance(tags[0], basestring):
+            # shared tags are copied, every Data has a list of its own
+            tags = [list(tags) for i in xrange(count)]
+        else:
+            tags = _column(tags, count, 'tags')
+        if at is None or isinstance(at, datetime):
+            ats = [at]
+            at = repeat(at)
+        elif isinstance(at, (int, long, float)):
+            at = _fromEpochUs(_epochUs(at))
+            ats = [at]
+            at = repeat(at)
+        else:
+            if not _ndarray(at):
+                at = list(at)
+            if _ndarray(at) or at and not isinstance(at[0], datetime):
+                try:
+                    at = map(_fromEpochUs, _epochUsArray(at))
+                except TypeError:
+                    raise ValueError("at must be datetimes or seconds since "
+                                     "the epoch")
+            at = ats = _column(at, count, 'times')
+
+        batch = None
+        if not defer_validation:
+            batch = getattr(validator, 'data_batch', None)
+            if batch is not None:
+                _timedBatch(batch, ids, distinct, ats)
+        new = Data.__new__
+        datas = []
+        append = datas.append
+        for id_, value, unit, tag, when in izip(ids, values, units, tags, at):
+            data = new(Data)
+            data._id = id_
+            data._value = value
+            data._tags = tag
+            data._minValue = None
+            data._maxValue = None
+            data._unit = unit
+            data._at = when
+            data._datapoints = None
+            data._cache = None
+            append(data)
+        if batch is None and not defer_validation:
+            _timedBatch(_validateEach, datas)
+        with self._lock:
+            self._writable().update(izip(ids, datas))
+            self._version += 1
+            self._changed.update(izip(ids, repeat(self._version)))
+
+    def update_from_records(self, records, units=None, tags=(),
+                            id_field='id', value_field='value',
+                            at_field='at'):
+        """
+        Add or replace many `Data` from tabular data, see
+        `update_from_arrays`.
+
+        :param records: the records, a NumPy structured array or anything
+            with columns accessible by name, like a `dict` of sequences
+        :param units: see `update_from_arrays`
+        :param tags: see `update_from_arrays`
+        :param id_field: the name of the column of the ids
+        :type id_field: `str`
+        :param value_field: the name of the column of the values
+        :type value_field: `str`
+        :param at_field: the name of the column of the times, optional
+        :type at_field: `str`
+        """
+        names = getattr(getattr(records, 'dtype', None), 'names', None)
+        if names is None:
+            names = records.keys()
+        self.update_from_arrays(
+            records[id_field], records[value_field], units, tags,
+            records[at_field] if at_field in names else None)
+
+    def removeData(self, id_):
+        """
+        Remove the data with an id, if there is one.
+
+        :param id_: the id of the data
+        :type id_: `int`
+        """
+        with self._lock:
+            if id_ in self._data:
+                del self._writable()[id_]
+            self._changed.pop(id_, None)
+
+    def _changesSince(self, version):
+        """
+        What changed after a version, to send only the changes.
 
+        :return: the current version, whether the metadata or the location
+            changed and the ids of the data that changed
+        :rtype: `tuple`
+        """
+        with self._lock:
+            return (self._version, self._headVersion > version,
+                    set(id_ for (id_, changed) in self._changed.iteritems()
+                        if changed > version))
+
+    def _dropDatapoints(self, ids):
+        """
+        Drop the datapoints of the data with ids, which were sent, and
+        remove the data without a value. This is not a change.
+        """
+        with self._lock:
+            target = self._writable()
+            for id_ in ids:
+                data = target.get(id_)
+                if data is None:
+                    continue
+                if data._value is None:
+                    del target[id_]
+                    self._changed.pop(id_, None)
+                else:
+                    target[id_] = data._withDatapoints(None)
+
+    def snapshot(self):
+        """
+        The data of this `Environment` as it is now. The returned dict is
+        shared with this `Environment` until the next update, which copies
+        it, so it must not be changed.
+
+        :return: the data by id
+        :rtype: `dict` of `Data`
+        """
+        with self._lock:
+            self._shared = True
+            return self._data
+
+    @timed('eeml_serialize_seconds', element='environment', method='toeeml')
     def toeeml(self):
         """
         Convert this file into eeml format.
@@ -122,7 +451,7 @@ class Environment(object):
         """
         env = _elem('environment')
         if isinstance(self._updated, (date, datetime,)):
-            _addA(env, self._updated, 'updated', lambda x: x.isoformat())
+            _addA(env, self._updated, 'updated', isoformat)
         elif self._updated is not None:
             _addA(env, self._updated, 'updated')
         _addA(env, self._creator, 'creator')
@@ -137,16 +466,142 @@ class Environment(object):
         _addE(env, self._private, 'private', lambda x: str(x).lower())
         if self._location is not None:
             env.append(self._location.toeeml())
-        for (dataId, data) in self._data.iteritems():
+        for data in self.snapshot().itervalues():
             env.append(data.toeeml())
         return env
 
+    def iter_bytes(self, ids=None):
+        """
+        Serialize this `Environment` without building a DOM tree.
+
+        The metadata and the location are serialized once and reused until
+        they are changed by `setMetadata` or `setLocation`. The serialized
+        tags and units are kept too and shared by every `Data` with the same
+        tags and unit, so mostly the values and datapoints are serialized.
+
+        :param ids: only include the data with these ids and leave out the
+            metadata and the location, everything if `None`
+        :type ids: `set`
+        :return: the byte chunks of the environment element
+        :rtype: generator of `str`
+        """
+        with self._lock:
+            if self._head is None:
+                self._head = self._serializeHead()
+            attrs, head = self._head
+            self._shared = True
+            snapshot = self._data
+        datas = snapshot.itervalues()
+        if ids is not None:
+            head = ''
+            datas = [data for (dataId, data) in snapshot.iteritems()
+                     if dataId in ids]
+        elif not snapshot:
+            datas = ()
+        if not head and not datas:
+            yield _leaf('environment', None, attrs)
+            return
+        yield '<environment{}>'.format(attrs) + head
+        template = self._template
+        timing = metrics.enabled
+        for data in datas:
+            key = (tuple(data._tags), data._unit)
+            static = template.get(key)
+            if static is None:
+                if len(template) >= self._templateLimit:
+                    template.clear()
+                static = template[key] = data._static()
+            chunks = data.iter_bytes(static)
+            if timing:
+                chunks = metrics.timed_chunks(
+                    chunks, 'eeml_serialize_seconds', _DATA_ITER_BYTES)
+            for chunk in chunks:
+                yield chunk
+        yield '</environment>'
+
+    def _serializeHead(self):
+        """
+        Serialize the attributes and the metadata elements
+        """
+        if isinstance(self._updated, (date, datetime,)):
+            attrs = _strA(self._updated, 'updated', isoformat)
+        else:
+            attrs = _strA(self._updated, 'updated')
+        attrs += _strA(self._creator, 'creator')
+        attrs += _strA(self._id, 'id', str)
+        return (attrs, ''.join((
+            _strE(self._title, 'title'),
+            _strE(self._feed, 'feed'),
+            _strE(self._status, 'status'),
+            _strE(self._description, 'description'),
+            _strE(self._icon, 'icon'),
+            _strE(self._website, 'website'),
+            _strE(self._email, 'email'),
+            _strE(self._private, 'private', lambda x: str(x).lower()),
+            ''.join(self._location.iter_bytes())
+            if self._location is not None else '')))
+
+
+@timed('eeml_validation_seconds', type='data_batch')
+def _timedBatch(validate, *args):
+    """
+    Validate a batch of `Environment.update_from_arrays`
+    """
+    validate(*args)
+
+
+def _validateEach(datas):
+    """
+    Validate `Data` and their datapoints one by one, for a validator
+    without ``data_batch`` or ``validate_many``
+    """
+    check = validator.data
+    checkPoints = validator.datapoints
+    for data in datas:
+        check(data)
+        if data._datapoints is not None:
+            checkPoints(data._datapoints)
+
+
+def _column(values, count=None, name=None):
+    """
+    Convert a column of `Environment.update_from_arrays` into a list and
+    check its length
+    """
+    if _ndarray(values):
+        values = values.tolist()
+    else:
+        values = list(values)
+    if count is not None and len(values) != count:
+        raise ValueError("got {} ids but {} {}".format(count, len(values),
+                                                       name))
+    return values
+
 
-class EEML(object):
+def _flatten(result, data):
+    """
+    Collect the `Data` and `DataPoints` in data, which may be nested lists
+    """
+    if isinstance(data, (Data, DataPoints)):
+        result.append(data)
+    elif isinstance(data, list):
+        for dat in data:
+            _flatten(result, dat)
+
+
+_DATA_ITER_BYTES = (('element', 'data'), ('method', 'iter_bytes'))
+
+_ROOT_START = '<eeml{} xsi:schemaLocation="{}" version="{}">'.format(
+    _ROOT_NSDECL, SCHEMA_LOCATION[1], EEML_SCHEMA_VERSION)
+
+
+class EEML(_Formats):
     """
     A class representing an EEML document.
     """
 
+    __slots__ = ('_environment',)
+
     def __init__(self, environment=Environment()):
         """
         Create a new EEML document.
@@ -157,6 +612,7 @@ class EEML(object):
         self._environment = None
         self.setEnvironment(environment)
 
+    @timed('eeml_serialize_seconds', element='document', method='toeeml')
     def toeeml(self):
         """
         Convert this document into an EEML file.
@@ -164,6 +620,9 @@ class EEML(object):
         :return: the EEML document
         :rtype: `Document`
         """
+        if defer_validation:
+            self.validate()
+
         eeml = _elem('eeml')
 
         eeml.attrib[SCHEMA_LOCATION[0]] = SCHEMA_LOCATION[1]    
@@ -173,6 +632,52 @@ class EEML(object):
 
         return eeml
 
+    def iter_bytes(self, ids=None):
+        """
+        Serialize this document chunk by chunk, without building a DOM tree.
+        The concatenated chunks are identical to the unindented output of
+        `etree.tostring` on `toeeml`.
+
+        :param ids: only include the data with these ids, see
+            `Environment.iter_bytes`
+        :type ids: `set`
+        :return: the byte chunks of the document
+        :rtype: generator of `str`
+        """
+        if defer_validation:
+            self.validate()
+        yield _ROOT_START
+        for chunk in self._environment.iter_bytes(ids):
+            yield chunk
+        yield '</eeml>'
+
+    @timed('eeml_validation_seconds', type='document')
+    def validate(self):
+        """
+        Validate every object of this document, done on serialization when
+        `defer_validation` is set.
+
+        :raise ValueError: if an object is not valid
+        """
+        env = self._environment
+        validator.environment(env)
+        if env._location is not None:
+            validator.location(env._location)
+        # a validator without validate_many checks each object
+        getattr(validator, 'validate_many', _validateEach)(
+            env.snapshot().values())
+
+    def write_to(self, fileobj, bufsize=65536):
+        """
+        Serialize this document into a file like object.
+
+        :param fileobj: the target, anything with a ``write`` method
+        :type fileobj: `file`
+        :param bufsize: the approximate size of each write
+        :type bufsize: `int`
+        """
+        _write(self.iter_bytes(), fileobj, bufsize)
+
     def setEnvironment(self, env):
         """
         Add a new Environment
@@ -201,10 +706,16 @@ class EEML(object):
         self._environment.updateData(data)
 
 
-class Location(object):
+class Location(_Slotted):
     """
     A class representing the location tag of the document.
     """
+
+    __slots__ = ('_name', '_lat', '_lon', '_ele', '_exposure', '_domain',
+                 '_disposition', '_cache')
+
+    _transient = {'_cache': lambda: None}
+
     @validate('location')
     def __init__(self, domain, name=None, lat=None, lon=None, ele=None,
                  exposure=None, disposition=None):
@@ -234,7 +745,9 @@ class Location(object):
         self._exposure = exposure
         self._domain = domain
         self._disposition = disposition
+        self._cache = None
 
+    @timed('eeml_serialize_seconds', element='location', method='toeeml')
     def toeeml(self):
         """
         Convert this class into a EEML DOM element.
@@ -255,11 +768,43 @@ class Location(object):
 
         return loc
 
+    def iter_bytes(self):
+        """
+        Serialize this object without building a DOM element.
+
+        :return: the byte chunks of the location element
+        :rtype: generator of `str`
+        """
+
+        if self._cache is None:
+            attrs = (_strA(self._exposure, 'exposure') +
+                     _strA(self._domain, 'domain') +
+                     _strA(self._disposition, 'disposition'))
+            body = (_strE(self._name, 'name') +
+                    _strE(self._lat, 'lat', str) +
+                    _strE(self._lon, 'lon', str) +
+                    _strE(self._ele, 'ele', str))
+            if body:
+                self._cache = '<location{}>{}</location>'.format(attrs, body)
+            else:
+                self._cache = _leaf('location', None, attrs)
+        yield self._cache
+
 
-class Data(object):
+class Data(_Formats):
     """
     The Data element of the document
     """
+
+    __slots__ = ('_id', '_value', '_tags', '_minValue', '_maxValue', '_unit',
+                 '_at', '_datapoints', '_cache')
+
+    _transient = {'_cache': lambda: None}
+
+    # serialized fragments up to this size are kept for the next
+    # serialization
+    _cacheLimit = 65536
+
     @validate('data')
     def __init__(self, id_, value, tags=list(), minValue=None, maxValue=None,
                  unit=None, at=None, datapoints=None):
@@ -290,7 +835,20 @@ class Data(object):
         self._unit = unit
         self._at = at
         self._datapoints = datapoints
+        self._cache = None
+
+    def _withDatapoints(self, datapoints):
+        """
+        A copy of this `Data` with other datapoints
+        """
+        data = Data.__new__(Data)
+        for name in Data.__slots__:
+            setattr(data, name, getattr(self, name))
+        data._datapoints = datapoints
+        data._cache = None
+        return data
 
+    @timed('eeml_serialize_seconds', element='data', method='toeeml')
     def toeeml(self):
         """
         Convert this element into a DOM object.
@@ -309,7 +867,7 @@ class Data(object):
             tmp = _elem('current_value')
             _addA(tmp, self._minValue, 'minValue', str)
             _addA(tmp, self._maxValue, 'maxValue', str)
-            _addA(tmp, self._at, 'at', lambda x: x.isoformat())
+            _addA(tmp, self._at, 'at', isoformat)
             tmp.text = str(self._value)
             data.append(tmp)
 
@@ -321,11 +879,93 @@ class Data(object):
             
         return data
 
+    def iter_bytes(self, static=None):
+        """
+        Serialize this element without building a DOM object. The result is
+        cached unless it is larger than `_cacheLimit`, and reused until the
+        datapoints are replaced or extended. Elements with a `DataPoints`
+        holding a list are not cached, the list may be changed in place.
+
+        :param static: the serialized tags and unit, as returned by
+            `_static`, computed if not given
+        :type static: `tuple`
+        :return: the byte chunks of the data element
+        :rtype: generator of `str`
+        """
+
+        version = 0 if self._datapoints is None else \
+            self._datapoints._version
+        if version is None:
+            for chunk in self._iter_bytes(static):
+                yield chunk
+            return
+        if self._cache is not None and self._cache[0] == version:
+            yield self._cache[1]
+            return
+
+        chunks = []
+        size = 0
+        for chunk in self._iter_bytes(static):
+            yield chunk
+            if chunks is not None:
+                size += len(chunk)
+                if size > self._cacheLimit:
+                    chunks = None
+                else:
+                    chunks.append(chunk)
+        if chunks is not None:
+            self._cache = (version, ''.join(chunks))
+
+    def _static(self):
+        """
+        Serialize the parts of this element that rarely change between
+        updates and are often the same for many datastreams: the tags and
+        the unit.
+        """
 
-class DataPoints(object):
+        return (''.join(_strE(tag, 'tag') for tag in self._tags),
+                ''.join(self._unit.iter_bytes())
+                if self._unit is not None else '')
+
+    def _iter_bytes(self, static=None):
+        """
+        Serialize this element, without caching.
+        """
+
+        attrs = _strA(self._id, 'id', str)
+        body, unit = static or self._static()
+
+        if self._value is not None:
+            body += _leaf('current_value', str(self._value),
+                          _strA(self._minValue, 'minValue', str) +
+                          _strA(self._maxValue, 'maxValue', str) +
+                          _strA(self._at, 'at', isoformat))
+
+        body += unit
+
+        if not body and self._datapoints is None:
+            yield _leaf('data', None, attrs)
+            return
+
+        yield '<data{}>'.format(attrs) + body
+        if self._datapoints is not None:
+            for chunk in self._datapoints.iter_bytes():
+                yield chunk
+        yield '</data>'
+
+
+class DataPoints(_Formats):
     """
     The DataPoints element of the document
     """
+
+    __slots__ = ('_id', '_values')
+
+    # incremented by in place modifications, invalidates cached fragments;
+    # None if they are not counted, the values are a list the caller may
+    # change, so fragments are not cached
+    _version = None
+
     @validate('datapoints')
     def __init__(self, id_, values=list()):
         """
@@ -340,7 +980,8 @@ class DataPoints(object):
         """
         self._id = id_
         self._values = values
-    
+
+    @timed('eeml_serialize_seconds', element='datapoints', method='toeeml')
     def toeeml(self):
         """
         Convert this element into a DOM object.
@@ -355,11 +996,334 @@ class DataPoints(object):
             tmp = _elem('value')
             tmp.text = str(pair[0])
             if len(pair) > 1:
-                tmp.attrib['at'] = pair[1].isoformat()
+                tmp.attrib['at'] = isoformat(pair[1])
             data.append(tmp)
             
         return data
 
+    def iter_bytes(self, batch=1024):
+        """
+        Serialize this element without building a DOM object.
+
+        :param batch: the number of values serialized into one chunk
+        :type batch: `int`
+        :return: the byte chunks of the datapoints element
+        :rtype: generator of `str`
+        """
+
+        values = self._values
+        if not values:
+            yield '<datapoints/>'
+            return
+
+        yield '<datapoints>'
+        chunk = []
+        for pair in values:
+            if len(pair) > 1:
+                chunk.append('<value at="{}">{}</value>'.format(
+                        isoformat(pair[1]), _escape(str(pair[0]))))
+            else:
+                chunk.append('<value>{}</value>'.format(_escape(str(pair[0]))))
+            if len(chunk) == batch:
+                yield ''.join(chunk)
+                chunk = []
+        chunk.append('</datapoints>')
+        yield ''.join(chunk)
+
+    @classmethod
+    def from_arrays(cls, id_, values, timestamps=None):
+        """
+        Create a compact `DataPoints` backed by arrays instead of a list of
+        tuples, see `ArrayDataPoints`.
+
+        :param id_: the id of the Data object this DataPoints belongs to
+        :type id_: positive `int`
+        :param values: the values
+        :type values: sequence of `float`, `array` or NumPy array
+        :param timestamps: the times of the values, same length as values
+        :type timestamps: sequence of `datetime` or seconds since the epoch
+        :return: the new datapoints
+        :rtype: `ArrayDataPoints`
+        """
+        return ArrayDataPoints(id_, values, timestamps)
+
+
+class ArrayDataPoints(DataPoints):
+    """
+    A DataPoints storing its values in an `array` of doubles and the times
+    as microseconds since the epoch in a parallel array, it takes about 16
+    bytes per point instead of a tuple, a float and a datetime.
+
+    Values are serialized as floats and times as UTC.
+    """
+
+    __slots__ = ('_array', '_timestamps', '_version')
+
+    @validate('datapoints')
+    def __init__(self, id_, values=(), timestamps=None):
+        """
+        :param id_: the id of the Data object this DataPoints belongs to
+        :type id_: positive `int`
+        :param values: the values
+        :type values: sequence of `float`, `array` or NumPy array
+        :param timestamps: the times of the values, same length as values
+        :type timestamps: sequence of `datetime` or seconds since the epoch
+        """
+        self._id = id_
+        self._array = _doubles(values)
+        self._timestamps = None
+        self._version = 0
+        if timestamps is not None:
+            self._timestamps = _epochUsArray(timestamps)
+            if len(self._timestamps) != len(self._array):
+                raise ValueError("got {} values but {} timestamps".format(
+                        len(self._array), len(self._timestamps)))
+
+    def __len__(self):
+        return len(self._array)
+
+    @property
+    def _values(self):
+        """
+        The datapoints as (value, date) pairs, like in `DataPoints`
+        """
+        if self._timestamps is None:
+            return [(value,) for value in self._array]
+        return [(value, _fromEpochUs(us)) for (value, us)
+                in zip(self._array, self._timestamps)]
+
+    def extend(self, values, timestamps=None):
+        """
+        Append many values at once.
+
+        :param values: the values
+        :type values: sequence of `float`, `array` or NumPy array
+        :param timestamps: the times of the values, required if this object
+            has timestamps
+        :type timestamps: sequence of `datetime` or seconds since the epoch
+        """
+        values = _doubles(values)
+        if self._timestamps is not None:
+            if timestamps is None:
+                raise ValueError("timestamps are required")
+            timestamps = _epochUsArray(timestamps)
+            if len(timestamps) != len(values):
+                raise ValueError("got {} values but {} timestamps".format(
+                        len(values), len(timestamps)))
+            self._timestamps.extend(timestamps)
+        elif timestamps is not None:
+            raise ValueError("this DataPoints has no timestamps")
+        self._array.extend(values)
+        self._version += 1
+
+    def append(self, value, at=None):
+        """
+        Append a single value.
+
+        :param value: the value
+        :type value: `float`
+        :param at: the time of the value
+        :type at: `datetime` or seconds since the epoch
+        """
+        self.extend((value,), None if at is None else (at,))
+
+    def iter_bytes(self, batch=1024):
+        """
+        Serialize this element without building a DOM object.
+
+        :param batch: the number of values serialized into one chunk
+        :type batch: `int`
+        :return: the byte chunks of the datapoints element
+        :rtype: generator of `str`
+        """
+
+        array, timestamps = self._arrays()
+        if not array:
+            yield '<datapoints/>'
+            return
+
+        yield '<datapoints>'
+        for start in xrange(0, len(array), batch):
+            values = map(str, array[start:start + batch])
+            if timestamps is None:
+                yield ''.join(['<value>%s</value>' % value
+                               for value in values])
+            else:
+                ats = default_formatter.format_epoch_us_many(
+                    timestamps[start:start + batch])
+                yield ''.join(['<value at="%s">%s</value>' % pair
+                               for pair in zip(ats, values)])
+        yield '</datapoints>'
+
+    def _arrays(self):
+        """
+        The values and the timestamps to serialize
+        """
+        return self._array, self._timestamps
+
+
+class RingDataPoints(ArrayDataPoints):
+    """
+    An `ArrayDataPoints` keeping only the latest values in a ring buffer
+    allocated once, for collectors running for a long time. Appending a
+    value takes constant time, the oldest value is dropped when the buffer
+    is full or when it is older than the window.
+
+    A `Cosm` putting a document with a ring buffer drops the values from it
+    once they were put successfully, and sends the datastream on delta puts
+    while it has values. The values of documents only stored in the spool
+    are kept, so they may be sent twice.
+
+    Values are always timestamped, by default with the time of `append`. A
+    ring buffer may be shared between threads.
+    """
+
+    __slots__ = ('_start', '_count', '_appended', '_window', '_lock')
+
+    _transient = {'_lock': threading.Lock}
+
+    @validate('datapoints')
+    def __init__(self, id_, capacity, window=None):
+        """
+        :raise ValueError: if capacity is not a positive integer or window
+            is not positive
+
+        :param id_: the id of the Data object this DataPoints belongs to
+        :type id_: positive `int`
+        :param capacity: the most values kept
+        :type capacity: `int`
+        :param window: keep only the values at most this old, compared to
+            the newest one
+        :type window: `timedelta` or seconds
+        """
+        if not isinstance(capacity, (int, long)) or capacity < 1:
+            raise ValueError("capacity must be a positive integer, got {!r}"
+                             .format(capacity))
+        if isinstance(window, timedelta):
+            window = window.total_seconds()
+        if window is not None and (
+                not isinstance(window, (int, long, float)) or window <= 0):
+            raise ValueError("window must be positive, got {!r}"
+                             .format(window))
+        self._id = id_
+        self._array = array('d', [0.0]) * capacity
+        self._timestamps = array('d', [0.0]) * capacity
+        self._start = 0
+        self._count = 0
+        self._appended = 0
+        self._version = 0
+        self._window = None if window is None else window * 1000000
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def _values(self):
+        """
+        The datapoints as (value, date) pairs, like in `DataPoints`
+        """
+        array, timestamps = self._arrays()
+        return [(value, _fromEpochUs(us)) for (value, us)
+                in zip(array, timestamps)]
+
+    def extend(self, values, timestamps=None):
+        """
+        Append many values at once, dropping the oldest ones if needed.
+
+        :param values: the values
+        :type values: sequence of `float`, `array` or NumPy array
+        :param timestamps: the times of the values, now if not given
+        :type timestamps: sequence of `datetime` or seconds since the epoch
+        """
+        values = _doubles(values)
+        if timestamps is None:
+            timestamps = array('d', [_epochUs(time.time())]) * len(values)
+        else:
+            timestamps = _epochUsArray(timestamps)
+            if len(timestamps) != len(values):
+                raise ValueError("got {} values but {} timestamps".format(
+                        len(values), len(timestamps)))
+        with self._lock:
+            for value, us in zip(values, timestamps):
+                self._add(value, us)
+
+    def append(self, value, at=None):
+        """
+        Append a single value, dropping the oldest one if needed.
+
+        :param value: the value
+        :type value: `float`
+        :param at: the time of the value, now if not given
+        :type at: `datetime` or seconds since the epoch
+        """
+        us = _epochUs(time.time() if at is None else at)
+        with self._lock:
+            self._add(float(value), us)
+
+    def _add(self, value, us):
+        """
+        Append a value, the lock must be held
+        """
+        capacity = len(self._array)
+        start = self._start
+        count = self._count
+        end = start + count
+        if end >= capacity:
+            end -= capacity
+        self._array[end] = value
+        self._timestamps[end] = us
+        if count == capacity:
+            start = end + 1 if end + 1 < capacity else 0
+        else:
+            count += 1
+        if self._window is not None:
+            oldest = us - self._window
+            while self._timestamps[start] < oldest:
+                start = start + 1 if start + 1 < capacity else 0
+                count -= 1
+        self._start = start
+        self._count = count
+        self._appended += 1
+        self._version += 1
+
+    def mark(self):
+        """
+        Mark the values appended so far, to `acknowledge` them later.
+
+        :return: the mark
+        :rtype: `int`
+        """
+        return self._appended
+
+    def acknowledge(self, mark):
+        """
+        Drop the values appended before mark was taken.
+
+        :param mark: a mark returned by `mark`
+        :type mark: `int`
+        """
+        with self._lock:
+            keep = min(self._count, self._appended - mark)
+            if keep < self._count:
+                self._start = (self._start + self._count - keep) % \
+                    len(self._array)
+                self._count = keep
+                self._version += 1
+
+    def _arrays(self):
+        """
+        Copy the values and the timestamps in order, from the oldest
+        """
+        with self._lock:
+            start = self._start
+            end = start + self._count
+            if end <= len(self._array):
+                return self._array[start:end], self._timestamps[start:end]
+            end -= len(self._array)
+            return (self._array[start:] + self._array[:end],
+                    self._timestamps[start:] + self._timestamps[:end])
+
 def create_eeml(env, loc, data):
     """
     Create an `EEML` document from the parameters.
@@ -377,3 +1341,5 @@ def create_eeml(env, loc, data):
     eeml.setEnvironment(env)
     env.updateData(data)
     return eeml
+
+from eeml.parser import parse, fromstring
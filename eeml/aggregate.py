@@ -0,0 +1,327 @@
+"""
+Reduce high rate readings before they are serialized: aggregate them into
+fixed time buckets or downsample them for plotting, so the size of a
+document depends on the number of buckets and not on the sample rate.
+
+NumPy is used when it is installed, it is imported the first time a
+reduction needs it.
+"""
+
+import threading
+from array import array
+from datetime import timedelta
+from itertools import groupby
+
+from eeml import Data, ArrayDataPoints
+from eeml.util import _doubles, _epochUsArray, _fromEpochUs
+
+MEAN = 'mean'
+MIN = 'min'
+MAX = 'max'
+LAST = 'last'
+LTTB = 'lttb'
+
+_BUCKETED = (MEAN, MIN, MAX, LAST)
+
+
+def _numpy():
+    """
+    The numpy module, None if it is not installed
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _sorted(values, timestamps):
+    """
+    Sort the values and the microseconds since the epoch by time, unless
+    they are sorted already
+    """
+    numpy = _numpy()
+    if numpy is not None:
+        times = numpy.frombuffer(timestamps, 'd')
+        if (numpy.diff(times) >= 0).all():
+            return values, timestamps
+        order = times.argsort(kind='mergesort')
+        return (_doubles(numpy.frombuffer(values, 'd')[order]),
+                _doubles(times[order]))
+    if all(a <= b for (a, b) in zip(timestamps, timestamps[1:])):
+        return values, timestamps
+    pairs = sorted(zip(timestamps, values))
+    return (array('d', [value for (us, value) in pairs]),
+            array('d', [us for (us, value) in pairs]))
+
+
+def buckets(values, timestamps, width, how=MEAN):
+    """
+    Aggregate the values into buckets of width time, aligned to the epoch.
+
+    :raise ValueError: if how is not known or the lengths differ
+
+    :param values: the values
+    :type values: sequence of `float`, `array` or NumPy array
+    :param timestamps: the times of the values
+    :type timestamps: sequence of `datetime` or seconds since the epoch
+    :param width: the length of a bucket
+    :type width: `timedelta` or seconds
+    :param how: `MEAN`, `MIN`, `MAX` or `LAST` value of each bucket
+    :type how: `str`
+    :return: the aggregated values and the start times of their buckets as
+        microseconds since the epoch
+    :rtype: `tuple` of two `array`
+    """
+    if how not in _BUCKETED:
+        raise ValueError("Unknown aggregation: {}".format(how))
+    values, timestamps = _sorted(*_arrays(values, timestamps))
+    return _buckets(values, timestamps, width, how)
+
+
+def _buckets(values, timestamps, width, how):
+    """
+    `buckets` of arrays of values and microseconds sorted by time
+    """
+    if isinstance(width, timedelta):
+        width = width.total_seconds()
+    width *= 1000000
+    if not values:
+        return values, timestamps
+
+    numpy = _numpy()
+    if numpy is not None:
+        vals = numpy.frombuffer(values, 'd')
+        keys = numpy.floor(numpy.frombuffer(timestamps, 'd') / width)
+        starts = numpy.concatenate(([0], numpy.flatnonzero(
+                    numpy.diff(keys)) + 1))
+        if how == MEAN:
+            result = numpy.add.reduceat(vals, starts) / numpy.diff(
+                numpy.append(starts, len(vals)))
+        elif how == MIN:
+            result = numpy.minimum.reduceat(vals, starts)
+        elif how == MAX:
+            result = numpy.maximum.reduceat(vals, starts)
+        else:
+            result = vals[numpy.append(starts[1:], len(vals)) - 1]
+        return (_doubles(result), _doubles(keys[starts] * width))
+
+    result = array('d')
+    starts = array('d')
+    for key, group in groupby(zip(timestamps, values),
+                              lambda pair: pair[0] // width):
+        group = [value for (us, value) in group]
+        if how == MEAN:
+            result.append(sum(group) / len(group))
+        elif how == MIN:
+            result.append(min(group))
+        elif how == MAX:
+            result.append(max(group))
+        else:
+            result.append(group[-1])
+        starts.append(key * width)
+    return result, starts
+
+
+def lttb(values, timestamps, threshold):
+    """
+    Downsample the values to threshold points with the Largest Triangle
+    Three Buckets algorithm, which keeps the shape of the series when it is
+    plotted. The first and the last values are always kept.
+
+    :raise ValueError: if the lengths differ
+
+    :param values: the values
+    :type values: sequence of `float`, `array` or NumPy array
+    :param timestamps: the times of the values
+    :type timestamps: sequence of `datetime` or seconds since the epoch
+    :param threshold: the number of values to keep
+    :type threshold: `int`
+    :return: the kept values and their times as microseconds since the
+        epoch
+    :rtype: `tuple` of two `array`
+    """
+    values, timestamps = _sorted(*_arrays(values, timestamps))
+    return _lttb(values, timestamps, threshold)
+
+
+def _lttb(values, timestamps, threshold):
+    """
+    `lttb` of arrays of values and microseconds sorted by time
+    """
+    count = len(values)
+    if threshold >= count or threshold < 3:
+        return values, timestamps
+
+    numpy = _numpy()
+    every = float(count - 2) / (threshold - 2)
+    chosen = [0]
+    a = 0
+    if numpy is not None:
+        ys = numpy.frombuffer(values, 'd')
+        xs = numpy.frombuffer(timestamps, 'd') - timestamps[0]
+    else:
+        ys = values
+        xs = [us - timestamps[0] for us in timestamps]
+    for i in xrange(threshold - 2):
+        start = int((i + 1) * every) + 1
+        end = min(int((i + 2) * every) + 1, count)
+        first = int(i * every) + 1
+        ax = xs[a]
+        ay = ys[a]
+        if numpy is not None:
+            avgX = xs[start:end].mean()
+            avgY = ys[start:end].mean()
+            areas = numpy.abs((ax - avgX) * (ys[first:start] - ay) -
+                              (ax - xs[first:start]) * (avgY - ay))
+            a = first + int(areas.argmax())
+        else:
+            avgX = sum(xs[start:end]) / (end - start)
+            avgY = sum(ys[start:end]) / (end - start)
+            best = -1.0
+            for j in xrange(first, start):
+                area = abs((ax - avgX) * (ys[j] - ay) -
+                           (ax - xs[j]) * (avgY - ay))
+                if area > best:
+                    best = area
+                    a = j
+        chosen.append(a)
+    chosen.append(count - 1)
+    return (array('d', [values[i] for i in chosen]),
+            array('d', [timestamps[i] for i in chosen]))
+
+
+def _arrays(values, timestamps):
+    """
+    Convert values and timestamps to arrays of the same length
+    """
+    values = _doubles(values)
+    numpy = _numpy()
+    if numpy is not None and isinstance(timestamps, array):
+        # converted without going through python floats
+        timestamps = numpy.frombuffer(timestamps, timestamps.typecode)
+    timestamps = _epochUsArray(timestamps)
+    if len(values) != len(timestamps):
+        raise ValueError("got {} values but {} timestamps".format(
+                len(values), len(timestamps)))
+    return values, timestamps
+
+
+class Aggregator(object):
+    """
+    Collect raw readings per datastream and turn them into `Data` objects
+    with a reduced `ArrayDataPoints`.
+
+    The `Data` of a datastream has the last reading as its current value,
+    the minimum and the maximum of all the readings as `minValue` and
+    `maxValue`, and the readings aggregated into buckets or downsampled
+    with `lttb` as its datapoints. An aggregator may be shared between
+    threads.
+    """
+
+    __slots__ = ('_width', '_how', '_threshold', '_streams', '_meta',
+                 '_lock')
+
+    def __init__(self, width=None, how=MEAN, threshold=None):
+        """
+        :raise ValueError: if how is not known or its parameter is missing
+
+        :param width: the length of a bucket, required unless how is `LTTB`
+        :type width: `timedelta` or seconds
+        :param how: `MEAN`, `MIN`, `MAX`, `LAST` or `LTTB`
+        :type how: `str`
+        :param threshold: the number of datapoints kept by `LTTB`
+        :type threshold: `int`
+        """
+        if how == LTTB:
+            if threshold is None:
+                raise ValueError("threshold is required by lttb")
+        elif how not in _BUCKETED:
+            raise ValueError("Unknown aggregation: {}".format(how))
+        elif width is None:
+            raise ValueError("width is required by {}".format(how))
+        self._width = width
+        self._how = how
+        self._threshold = threshold
+        self._streams = {}
+        self._meta = {}
+        self._lock = threading.Lock()
+
+    def describe(self, id_, tags=(), unit=None):
+        """
+        Set the tags and the unit of the `Data` created for a datastream.
+
+        :param id_: the id of the datastream
+        :type id_: positive `int`
+        :param tags: the tags
+        :type tags: `list`
+        :param unit: the unit
+        :type unit: `Unit`
+        """
+        self._meta[id_] = (list(tags), unit)
+
+    def extend(self, id_, values, timestamps):
+        """
+        Add many readings of a datastream.
+
+        :param id_: the id of the datastream
+        :type id_: positive `int`
+        :param values: the values
+        :type values: sequence of `float`, `array` or NumPy array
+        :param timestamps: the times of the values
+        :type timestamps: sequence of `datetime` or seconds since the epoch
+        """
+        values, timestamps = _arrays(values, timestamps)
+        if not len(values):
+            return
+        with self._lock:
+            stream = self._streams.get(id_)
+            if stream is None:
+                self._streams[id_] = (values, timestamps)
+            else:
+                stream[0].extend(values)
+                stream[1].extend(timestamps)
+
+    def add(self, id_, value, at):
+        """
+        Add a reading of a datastream.
+
+        :param id_: the id of the datastream
+        :type id_: positive `int`
+        :param value: the value
+        :type value: `float`
+        :param at: the time of the value
+        :type at: `datetime` or seconds since the epoch
+        """
+        self.extend(id_, (value,), (at,))
+
+    def flush(self):
+        """
+        Reduce the readings collected so far and forget them.
+
+        :return: a `Data` for each datastream with readings
+        :rtype: `list` of `Data`
+        """
+        with self._lock:
+            streams, self._streams = self._streams, {}
+        result = []
+        for id_, (values, timestamps) in sorted(streams.iteritems()):
+            values, timestamps = _sorted(values, timestamps)
+            if self._how == LTTB:
+                reduced = _lttb(values, timestamps, self._threshold)
+            else:
+                reduced = _buckets(values, timestamps, self._width,
+                                   self._how)
+            numpy = _numpy()
+            if numpy is not None:
+                low = numpy.frombuffer(values, 'd').min()
+                high = numpy.frombuffer(values, 'd').max()
+            else:
+                low = min(values)
+                high = max(values)
+            points = ArrayDataPoints(id_, reduced[0])
+            points._timestamps = reduced[1]
+            tags, unit = self._meta.get(id_, ([], None))
+            result.append(Data(id_, values[-1], tags, float(low), float(high),
+                               unit, _fromEpochUs(timestamps[-1]), points))
+        return result
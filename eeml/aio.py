@@ -0,0 +1,96 @@
+"""
+Non-blocking access to Cosm for asyncio applications, requires Python 3 or
+the trollius and futures backports, installed with the ``aio`` extra.
+
+The HTTP requests and the serialization of the documents run in a thread
+pool, so large documents do not block the event loop, and the size of the
+pool bounds the number of concurrent uploads.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from eeml.datastream import Cosm
+
+default_executor = ThreadPoolExecutor(max_workers=8)
+
+
+class AsyncCosm(Cosm):
+    """
+    A `Cosm` whose `put` returns an awaitable instead of blocking.
+    """
+
+    def __init__(self, url, key, env=None, loc=None, dat=list(),
+                 use_https=True, timeout=10, pool=None, retry=None,
+                 spool=None, compresslevel=None, executor=None):
+        """
+        :param executor: the threads running the uploads, `default_executor`
+            if not given
+        :type executor: `concurrent.futures.Executor`
+
+        For the other parameters see `Cosm`.
+        """
+        Cosm.__init__(self, url, key, env, loc, dat, use_https, timeout,
+                      pool, retry, spool, compresslevel)
+        self._executor = default_executor if executor is None else executor
+
+    def put(self, full=False):
+        """
+        Put the information to the website, see `Cosm.put`.
+
+        :raise CosmError: from the awaited future if there was problem with
+            the communication
+
+        :param full: send the whole document
+        :type full: `bool`
+        :return: a future finished when the upload is done
+        :rtype: `asyncio.Future`
+        """
+        return asyncio.get_event_loop().run_in_executor(
+            self._executor, Cosm.put, self, full)
+
+
+def update_many(updates):
+    """
+    Update and put many feeds concurrently.
+
+    :param updates: pairs of `AsyncCosm` and the data to update it with
+    :type updates: iterable of `tuple`
+    :return: a future of the list of results, `None` for successful puts
+        and the exception for failed ones
+    :rtype: `asyncio.Future`
+    """
+    futures = []
+    for cosm, data in updates:
+        cosm.update(data)
+        futures.append(cosm.put())
+    return asyncio.gather(*futures, return_exceptions=True)
+
+
+def read_lines(reader, executor=None):
+    """
+    Run a `LineReader` until its source ends, for applications driven by an
+    event loop. The source is read on a thread of executor, since serial
+    ports and pipes cannot be read without blocking everywhere.
+
+    :param reader: the reader
+    :type reader: `eeml.ingest.LineReader`
+    :param executor: the thread running the reader, a thread of its own if
+        not given, the reader keeps it until the source ends so it should
+        not be a thread of `default_executor`
+    :type executor: `concurrent.futures.Executor`
+    :return: a future finished when the source ends
+    :rtype: `asyncio.Future`
+    """
+    loop = asyncio.get_event_loop()
+    if executor is not None:
+        return loop.run_in_executor(executor, reader.run)
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        return loop.run_in_executor(executor, reader.run)
+    finally:
+        # the thread ends with the reader
+        executor.shutdown(wait=False)
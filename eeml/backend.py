@@ -0,0 +1,78 @@
+"""
+Selection of the ElementTree implementation used by `toeeml`, pretty
+printing and the parser.
+
+The byte streaming serializers, `iter_bytes`, `write_to` and `Cosm.put`,
+work without any, so the backend is only imported the first time a
+document object model is needed. By default lxml is used if it is
+installed and the python standard library otherwise, `use` or the
+``EEML_BACKEND`` environment variable selects one explicitly.
+"""
+
+import os
+
+LXML = 'lxml'
+STDLIB = 'stdlib'
+
+_requested = os.environ.get('EEML_BACKEND') or None
+_loaded = None
+
+
+def use(name=None):
+    """
+    Select the backend, it is imported when it is first needed.
+
+    :raise ValueError: if name is not a known backend
+
+    :param name: `LXML`, `STDLIB` or None to take lxml if it is installed
+    :type name: `str`
+    """
+    global _requested, _loaded
+    if name not in (None, LXML, STDLIB):
+        raise ValueError("Unknown backend: {}".format(name))
+    _requested = name
+    _loaded = None
+
+
+def _load():
+    """
+    Import the selected backend
+    """
+    global _loaded
+    if _loaded is None:
+        module = None
+        if _requested != STDLIB:
+            try:
+                from lxml import etree as module
+            except ImportError:
+                if _requested == LXML:
+                    raise
+        if module is not None:
+            _loaded = (LXML, module)
+        else:
+            try:
+                from xml.etree import cElementTree as module
+            except ImportError:
+                from xml.etree import ElementTree as module
+            _loaded = (STDLIB, module)
+    return _loaded
+
+
+def name():
+    """
+    The name of the backend in use, importing it if needed.
+
+    :return: `LXML` or `STDLIB`
+    :rtype: `str`
+    """
+    return _load()[0]
+
+
+def etree():
+    """
+    The ElementTree module of the backend in use, importing it if needed.
+
+    :return: ``lxml.etree`` or ``xml.etree.cElementTree``
+    :rtype: `module`
+    """
+    return _load()[1]
@@ -5,15 +5,234 @@ These classes used during communication with the servers.
 import eeml
 import httplib
 import re
-from lxml import etree
+import select
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime
 
-URLPATTERN = re.compile("/v[12]/feeds/\d+\.xml")
+from eeml import backend, metrics
+from eeml.util import _gzip, _tostring, _utc
+
+URLPATTERN = re.compile("/v[12]/feeds/\d+\.(xml|json|csv)")
+# the first bytes of gzip compressed data, documents start with '<'
+_GZIP_MAGIC = '\x1f\x8b'
 
 class CosmError(Exception):
     """
     Exception type of COSM communication
     """
-    pass
+
+    def __init__(self, msg, status=None):
+        """
+        :param msg: the error message
+        :type msg: `str`
+        :param status: the HTTP status of the response, if there was one
+        :type status: `int`
+        """
+        Exception.__init__(self, msg)
+        self.status = status
+
+
+def _marks(env):
+    """
+    Mark the values of the ring buffers in env, to drop them once they are
+    put
+    """
+    return [(data._datapoints, data._datapoints.mark())
+            for data in env.snapshot().itervalues()
+            if isinstance(data._datapoints, eeml.RingDataPoints)]
+
+
+def _stamped(pair, now):
+    """
+    A datapoint pair with the time now if it has none
+    """
+    if len(pair) > 1 and pair[1] is not None:
+        return pair
+    return (pair[0], now)
+
+
+def _isTransient(error):
+    """
+    Check if a failed put is worth trying again
+    """
+    if isinstance(error, CosmError):
+        return error.status is None or error.status >= 500 or \
+            error.status == 429
+    return isinstance(error, (socket.error, httplib.HTTPException))
+
+def _errorMessage(reason, body):
+    """
+    Extract the error message from an error response
+    """
+    try:
+        errors = backend.etree().fromstring(body)
+        return "%s: %s" % (errors[0].text, errors[1].text)
+    except:
+        return reason
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP connections shared between `Cosm` objects. Idle
+    connections are kept per host and reused by the next request to the same
+    host, stale ones are dropped and the request is sent again on a new
+    connection.
+    """
+
+    # exceptions meaning that a reused connection was closed by the server
+    _stale = (socket.error, httplib.BadStatusLine, httplib.CannotSendRequest,
+              httplib.ResponseNotReady)
+
+    def __init__(self, maxsize=4, idle_timeout=60):
+        """
+        :param maxsize: the number of idle connections kept per host
+        :type maxsize: `int`
+        :param idle_timeout: seconds after an idle connection is closed
+        :type idle_timeout: `float`
+        """
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self._idle = dict()
+        self._lock = threading.Lock()
+
+    def _get(self, key, timeout):
+        """
+        Return an idle connection to key or None
+        """
+        now = time.time()
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                conn, since = idle.pop()
+                if now - since < self.idle_timeout and self._alive(conn):
+                    conn.sock.settimeout(timeout)
+                    return conn
+                conn.close()
+        return None
+
+    @staticmethod
+    def _alive(conn):
+        """
+        Check that the server did not close an idle connection, which makes
+        its socket readable
+        """
+        try:
+            return (conn.sock is not None and
+                    not select.select([conn.sock], [], [], 0)[0])
+        except (socket.error, select.error, ValueError):
+            return False
+
+    def _release(self, key, conn):
+        """
+        Put conn back to the idle connections of key
+        """
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+                return
+        conn.close()
+
+    def _connect(self, key, timeout):
+        """
+        Open a new connection
+        """
+        host, use_https = key
+        if use_https:
+            return httplib.HTTPSConnection(host, timeout=timeout)
+        return httplib.HTTPConnection(host, timeout=timeout)
+
+    def request(self, host, use_https, method, url, body=None, headers={},
+                timeout=10):
+        """
+        Send a request on a pooled connection and read the response.
+
+        :param host: the host, with optional port
+        :type host: `str`
+        :param use_https: use HTTPS instead of HTTP
+        :type use_https: `bool`
+        :param timeout: socket timeout in seconds
+        :type timeout: `float`
+        :return: the status, the reason and the body of the response
+        :rtype: `tuple`
+        """
+        key = (host, use_https)
+        conn = self._get(key, timeout)
+        if conn is not None:
+            try:
+                return self._send(key, conn, method, url, body, headers)
+            except socket.timeout:
+                raise
+            except self._stale:
+                pass
+        conn = self._connect(key, timeout)
+        if metrics.enabled:
+            _timedConnect(conn, use_https)
+        return self._send(key, conn, method, url, body, headers)
+
+    def _send(self, key, conn, method, url, body, headers):
+        timing = metrics.enabled
+        if timing:
+            start = metrics.clock()
+        try:
+            conn.request(method, url, body, headers)
+            resp = conn.getresponse()
+            data = resp.read()
+        except:
+            conn.close()
+            raise
+        if timing:
+            metrics.observe('eeml_http_response_seconds',
+                            metrics.clock() - start)
+            metrics.increment('eeml_http_responses_total',
+                              (('status', resp.status),))
+        if resp.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        return (resp.status, resp.reason, data)
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self._lock:
+            idle = self._idle
+            self._idle = dict()
+        for conns in idle.itervalues():
+            for conn, since in conns:
+                conn.close()
+
+
+def _timedConnect(conn, use_https):
+    """
+    Open a new connection, observing the time of the TCP connect and of the
+    TLS handshake
+    """
+    tcp = []
+    create = conn._create_connection
+
+    def timedCreate(*args):
+        start = metrics.clock()
+        sock = create(*args)
+        tcp.append(metrics.clock() - start)
+        return sock
+
+    conn._create_connection = timedCreate
+    start = metrics.clock()
+    conn.connect()
+    total = metrics.clock() - start
+    metrics.observe('eeml_http_connect_seconds', tcp[0],
+                    (('scheme', 'https' if use_https else 'http'),))
+    if use_https:
+        metrics.observe('eeml_http_tls_seconds', total - tcp[0])
+
+
+default_pool = ConnectionPool()
+
 
 class Cosm(object):
     """
@@ -22,13 +241,28 @@ class Cosm(object):
 
     host = 'api.cosm.com'
 
+    # the number of spooled documents sent before each put
+    replay_batch = 10
+
     def __init__(self, url, key, env=None, loc=None, dat=list(),
-                 use_https=True, timeout=10):
+                 use_https=True, timeout=10, pool=None, retry=None,
+                 spool=None, compresslevel=None):
         """
-        :param url: the api url either '/v2/feeds/1275.xml' or 1275
+        :param url: the api url either '/v2/feeds/1275.xml' or 1275, the
+            extension selects the format of the documents, ``.xml``,
+            ``.json`` or ``.csv``, see `eeml.formats`
         :type url: `str`
         :param key: your personal api key
         :type key: `str`
+        :param pool: the connections to use, `default_pool` if not given
+        :type pool: `ConnectionPool`
+        :param retry: the delays between attempts of a failed put
+        :type retry: `eeml.spool.Backoff`
+        :param spool: where documents are kept if they could not be put
+        :type spool: `eeml.spool.Spool`
+        :param compresslevel: gzip the documents with this level (1-9),
+            don't compress if `None`
+        :type compresslevel: `int`
         """
         if not env:
             env = eeml.Environment()
@@ -47,10 +281,21 @@ class Cosm(object):
             except TypeError:
                 raise TypeError("The url argument has to be in the form "
                                 "'/v2/feeds/1275.xml' or 1275")
+        from eeml.formats import FORMATS
+        self._format = FORMATS[URLPATTERN.match(self._url).group(1)]
         self._key = key
         self._use_https = use_https
         self._eeml = eeml.create_eeml(env, loc, dat)
         self._http_timeout = timeout
+        self._pool = default_pool if pool is None else pool
+        self._retry = retry
+        self._spool = spool
+        self._compresslevel = compresslevel
+        self._sleep = time.sleep
+        # the version of the environment at the last successful put, the
+        # first put sends everything
+        self._synced = None
+        self._syncedLock = threading.Lock()
 
     def update(self, data):
         """
@@ -61,39 +306,363 @@ class Cosm(object):
         """
         self._eeml.updateData(data)
 
-    def put(self):
+    def put(self, full=False):
         """
         Put the information to the website.
 
+        After the first successful put only the datastreams updated since
+        the last successful put are sent, with the attributes of the
+        environment, and the ones with values in a `RingDataPoints`. Nothing
+        new is sent if there were no updates. The whole document is sent again
+        if the metadata or the location changed. Values put from ring
+        buffers are dropped from them.
+
+        Failed puts are retried as configured by `retry`. If there is a
+        `spool`, documents that still could not be put because of network or
+        server errors are stored in it, and sent before the next puts, at
+        most `replay_batch` at a time. Documents are put in order: while
+        older documents of the feed are left in the spool, a new one is
+        stored behind them instead of being sent.
+
         :raise CosmError: if there was problem with the communication
+
+        :param full: send the whole document
+        :type full: `bool`
         """
-        if self._use_https:
-            conn = httplib.HTTPSConnection(self.host,
-                                           timeout=self._http_timeout)
+        env = self._eeml._environment
+        with self._syncedLock:
+            synced = self._synced
+        version, headChanged, ids = env._changesSince(synced or 0)
+        full = full or headChanged or synced is None
+        marks = _marks(env)
+        if full:
+            chunks = self._format.iter_bytes(self._eeml)
+        else:
+            ids |= set(points._id for (points, mark) in marks
+                       if len(points))
+            if not ids:
+                # nothing new, but the spool is still drained
+                if self._spool is not None:
+                    self._replay()
+                return
+            chunks = self._format.iter_bytes(self._eeml, ids)
+        timing = metrics.enabled
+        if timing:
+            labels = (('format', self._format.name),)
+            start = metrics.clock()
+        if self._compresslevel is None:
+            body = ''.join(chunks)
+        else:
+            body = _gzip(chunks, self._compresslevel)
+        if timing:
+            metrics.observe('eeml_put_serialize_seconds',
+                            metrics.clock() - start, labels)
+            metrics.observe('eeml_payload_bytes', len(body), labels)
+        if self._spool is not None and not self._replay():
+            # sent after the older documents, which would overwrite it
+            self._spool.append(self._url, body)
         else:
-            conn = httplib.HTTPConnection(self.host,
-                                          timeout=self._http_timeout)
-
-        conn.request('PUT', self._url, self.geteeml(False),
-                     {'X-ApiKey': self._key})
-        conn.sock.settimeout(5.0)
-        resp = conn.getresponse()
-        if resp.status != 200:
             try:
-                errors = etree.fromstring(resp.read())
-                msg = "%s: %s" % (errors[0].text, errors[1].text)
-            except:
-                msg = resp.reason
-            raise CosmError(msg)
-        resp.read()
-        conn.close()
+                self._putBody(body, self._retry)
+            except Exception, e:
+                if self._spool is None or not _isTransient(e):
+                    raise
+                self._spool.append(self._url, body)
+            else:
+                for points, mark in marks:
+                    points.acknowledge(mark)
+        with self._syncedLock:
+            self._synced = max(self._synced, version)
+
+    def _replay(self):
+        """
+        Send the oldest spooled documents of this feed, stop at the first
+        failure.
+
+        :return: whether no document of this feed is left in the spool
+        :rtype: `bool`
+        """
+        for id_, body in self._spool.peek(self._url, self.replay_batch):
+            try:
+                self._putBody(body)
+            except CosmError, e:
+                if _isTransient(e):
+                    return False
+                # the server will never accept it
+            except (socket.error, httplib.HTTPException):
+                return False
+            self._spool.remove(id_)
+        return not self._spool.peek(self._url, 1)
+
+    def _putBody(self, body, retry=None):
+        """
+        Put a document, trying again after the delays of retry.
+        """
+        delays = iter(()) if retry is None else retry.delays()
+        headers = {'X-ApiKey': self._key,
+                   'Content-Type': self._format.content_type}
+        if body.startswith(_GZIP_MAGIC):
+            headers['Content-Encoding'] = 'gzip'
+        timing = metrics.enabled
+        if timing:
+            start = metrics.clock()
+        try:
+            while True:
+                try:
+                    status, reason, data = self._pool.request(
+                        self.host, self._use_https, 'PUT', self._url, body,
+                        headers, self._http_timeout)
+                    if status == 200:
+                        return
+                    raise CosmError(_errorMessage(reason, data), status)
+                except Exception, e:
+                    if not _isTransient(e):
+                        raise
+                    delay = next(delays, None)
+                    if delay is None:
+                        raise
+                    if timing:
+                        metrics.increment('eeml_put_retries_total')
+                    self._sleep(delay)
+        except:
+            if timing:
+                metrics.increment('eeml_put_failures_total')
+            raise
+        finally:
+            if timing:
+                metrics.observe('eeml_put_seconds', metrics.clock() - start)
 
     def geteeml(self, pretty_print=True):
         """
         Return the EEML document as a string
         """
-        return etree.tostring(self._eeml.toeeml(), encoding='UTF-8',
-                              pretty_print=pretty_print)
+        if not pretty_print:
+            return ''.join(self._eeml.iter_bytes())
+        return _tostring(self._eeml.toeeml(), pretty_print=pretty_print)
+
+    def write_eeml(self, fileobj):
+        """
+        Write the unindented EEML document into a file like object without
+        keeping the whole document in memory.
+
+        :param fileobj: the target, anything with a ``write`` method
+        :type fileobj: `file`
+        """
+        self._eeml.write_to(fileobj)
+
+class BufferedCosm(Cosm):
+    """
+    A `Cosm` collecting updates in memory and putting them from a background
+    thread. Readings of the same datastream are sent together as datapoints,
+    a put is done when `batch_size` readings are pending or `interval`
+    seconds after the oldest pending one.
+    """
+
+    BLOCK = 'block'
+    DROP_OLDEST = 'drop-oldest'
+
+    def __init__(self, url, key, env=None, loc=None, dat=list(),
+                 use_https=True, timeout=10, pool=None, retry=None,
+                 spool=None, compresslevel=None, batch_size=500, interval=60,
+                 maxsize=10000, policy=BLOCK):
+        """
+        :param batch_size: the number of pending readings triggering a put
+        :type batch_size: `int`
+        :param interval: the maximal age of a pending reading in seconds
+        :type interval: `float`
+        :param maxsize: the maximal number of pending readings
+        :type maxsize: `int`
+        :param policy: what `update` does when `maxsize` readings are
+            pending, wait (``BLOCK``) or drop the oldest (``DROP_OLDEST``)
+        :type policy: `str`
+
+        For the other parameters see `Cosm`.
+        """
+        if policy not in (self.BLOCK, self.DROP_OLDEST):
+            raise ValueError("policy must be '{}' or '{}', got '{}'"
+                             .format(self.BLOCK, self.DROP_OLDEST, policy))
+        Cosm.__init__(self, url, key, env, loc, dat, use_https, timeout, pool,
+                      retry, spool, compresslevel)
+        self._batch_size = batch_size
+        self._interval = interval
+        self._maxsize = maxsize
+        self._policy = policy
+        self._pending = deque()
+        self._since = None
+        self._retry_at = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._put_lock = threading.Lock()
+        self.dropped = 0
+        self.last_error = None
+        self._worker = threading.Thread(target=self._run)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def update(self, data):
+        """
+        Queue readings for the next put, the ones without a time get the
+        time of this call.
+
+        :raise ValueError: if this object is closed
+
+        :param data: the data to be updated
+        :type data: `Data`, `DataPoints` or `list` of them
+        """
+        if isinstance(data, list):
+            for dat in data:
+                self.update(dat)
+            return
+        now = datetime.now(_utc)
+        if isinstance(data, eeml.Data):
+            at = data._at if data._at is not None else now
+            entries = [(data._id, (data._value, at), data)]
+            if data._datapoints is not None:
+                entries.extend((data._id, _stamped(pair, now), None)
+                               for pair in data._datapoints._values)
+        elif isinstance(data, eeml.DataPoints):
+            entries = [(data._id, _stamped(pair, now), None)
+                       for pair in data._values]
+        else:
+            raise ValueError("data must be Data or DataPoints, got {}"
+                             .format(type(data)))
+        with self._cond:
+            self._enqueue(entries)
+
+    def _enqueue(self, entries):
+        """
+        Add readings to the pending ones, the condition must be held.
+        """
+        for entry in entries:
+            while True:
+                if self._closed:
+                    raise ValueError("update on closed BufferedCosm")
+                if len(self._pending) < self._maxsize:
+                    break
+                if self._policy == self.DROP_OLDEST:
+                    self._pending.popleft()
+                    self.dropped += 1
+                else:
+                    self._cond.wait()
+            self._pending.append(entry)
+            if self._since is None:
+                self._since = time.time()
+        self._cond.notify_all()
+
+    def _take(self):
+        """
+        Remove and return all pending readings, the condition must be held.
+        """
+        entries = list(self._pending)
+        self._pending.clear()
+        self._since = None
+        self._cond.notify_all()
+        return entries
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    wait = self._retry_at - time.time()
+                    if wait > 0:
+                        self._cond.wait(wait)
+                        continue
+                    if len(self._pending) >= self._batch_size:
+                        break
+                    if self._since is None:
+                        self._cond.wait()
+                        continue
+                    left = self._since + self._interval - time.time()
+                    if left <= 0:
+                        break
+                    self._cond.wait(left)
+                if self._closed:
+                    return
+                entries = self._take()
+            try:
+                self._send(entries)
+            except Exception, e:
+                self.last_error = e
+                with self._cond:
+                    # keep the readings for the next put, the oldest first
+                    self._pending.extendleft(reversed(entries))
+                    while (self._policy == self.DROP_OLDEST and
+                           len(self._pending) > self._maxsize):
+                        self._pending.popleft()
+                        self.dropped += 1
+                    self._since = time.time()
+                    self._retry_at = self._since + self._interval
+
+    def _send(self, entries, full=False):
+        """
+        Put readings, coalescing the ones of the same datastream.
+        """
+        if not entries and not full:
+            return
+        streams = dict()
+        for id_, pair, data in entries:
+            points, latest = streams.setdefault(id_, ([], None))
+            points.append(pair)
+            if data is not None:
+                streams[id_] = (points, data)
+        with self._put_lock:
+            env = self._eeml._environment
+            for id_, (points, latest) in streams.iteritems():
+                datapoints = eeml.DataPoints(id_, points)
+                if latest is None:
+                    Cosm.update(self, datapoints)
+                    continue
+                at = latest._at
+                if at is None:
+                    at = points[-1][1]
+                Cosm.update(self, eeml.Data(
+                    id_, latest._value, latest._tags, latest._minValue,
+                    latest._maxValue, latest._unit, at,
+                    datapoints if len(points) > 1 else None))
+            try:
+                Cosm.put(self, full)
+            finally:
+                # the readings are either sent or queued again
+                env._dropDatapoints(streams)
+
+    def put(self, full=False):
+        """
+        Put the pending readings now, see `flush`.
+        """
+        self.flush(full)
+
+    def flush(self, full=False):
+        """
+        Put the pending readings and wait for the put to finish.
+
+        :raise CosmError: if there was problem with the communication, the
+            readings are kept for the next put
+
+        :param full: send the whole document, see `Cosm.put`
+        :type full: `bool`
+        """
+        with self._cond:
+            entries = self._take()
+        try:
+            self._send(entries, full)
+        except:
+            with self._cond:
+                self._pending.extendleft(reversed(entries))
+                self._since = time.time()
+            raise
+
+    def close(self):
+        """
+        Stop the background thread and put the pending readings.
+
+        :raise CosmError: if the last put failed
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
+        self.flush()
+
 
 class Pachube(Cosm):
     """
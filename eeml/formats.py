@@ -0,0 +1,328 @@
+"""
+The formats EEML objects can be serialized to. Besides EEML the Cosm v2
+API accepts JSON, and CSV with only the values of the datastreams, both
+smaller and cheaper to generate for numeric streams.
+
+A format turns a document into byte chunks, like `EEML.iter_bytes`. More
+formats can be added with `register`, `Cosm` picks the format from the
+extension of its url.
+"""
+
+from json.encoder import encode_basestring_ascii as _quote
+
+import eeml
+from eeml import EEML, Environment, Data, DataPoints, Location
+from eeml.timestamp import default_formatter, isoformat
+from eeml.unit import Unit
+
+# the version of the JSON format of the Cosm v2 API
+JSON_VERSION = '1.0.0'
+
+
+class Format(object):
+    """
+    A serialization format of documents.
+    """
+
+    __slots__ = ('name', 'content_type', '_iter')
+
+    def __init__(self, name, content_type, iter_bytes):
+        """
+        :param name: the name, also the extension of the urls using it
+        :type name: `str`
+        :param content_type: the HTTP content type
+        :type content_type: `str`
+        :param iter_bytes: serializes an `EEML` document with the ids
+            argument of `EEML.iter_bytes`
+        :type iter_bytes: `callable` returning an iterable of `str`
+        """
+        self.name = name
+        self.content_type = content_type
+        self._iter = iter_bytes
+
+    def iter_bytes(self, doc, ids=None):
+        """
+        Serialize a document.
+
+        :param doc: the document
+        :type doc: `EEML`
+        :param ids: only include the data with these ids, see
+            `Environment.iter_bytes`
+        :type ids: `set`
+        :return: the byte chunks
+        :rtype: iterable of `str`
+        """
+        return self._iter(doc, ids)
+
+
+FORMATS = {}
+
+
+def register(fmt):
+    """
+    Add a format, replacing the one with the same name.
+
+    :param fmt: the format
+    :type fmt: `Format`
+    """
+    FORMATS[fmt.name] = fmt
+
+
+def _text(value):
+    """
+    The JSON string of a value, numbers are written as strings too
+    """
+    if not isinstance(value, basestring):
+        value = str(value)
+    return _quote(value)
+
+
+def _members(pairs):
+    """
+    Serialize the members of a JSON object, leaving out `None` values
+    """
+    return ','.join(['"%s":%s' % pair for pair in pairs
+                     if pair[1] is not None])
+
+
+def _opt(value, call=_text):
+    """
+    Convert value with call unless it is `None`
+    """
+    if value is None:
+        return None
+    return call(value)
+
+
+def _jsonUnit(unit):
+    return '{' + _members((('type', _opt(unit._type)),
+                           ('symbol', _opt(unit._symbol)),
+                           ('label', _opt(unit._name)))) + '}'
+
+
+def _jsonLocation(loc):
+    return '{' + _members((('disposition', _opt(loc._disposition)),
+                           ('domain', _opt(loc._domain)),
+                           ('exposure', _opt(loc._exposure)),
+                           ('name', _opt(loc._name)),
+                           ('lat', _opt(loc._lat)),
+                           ('lon', _opt(loc._lon)),
+                           ('ele', _opt(loc._ele)))) + '}'
+
+
+def _time(at):
+    """
+    The JSON string of a time
+    """
+    if isinstance(at, basestring):
+        return _quote(at)
+    return '"' + isoformat(at) + '"'
+
+
+def _jsonDatapoints(points, batch=1024):
+    yield '['
+    arrays = getattr(points, '_arrays', None)
+    if arrays is None:
+        chunk = []
+        separator = ''
+        for pair in points._values:
+            if len(pair) > 1 and pair[1] is not None:
+                chunk.append('{"at":%s,"value":%s}' % (_time(pair[1]),
+                                                        _text(pair[0])))
+            else:
+                chunk.append('{"value":%s}' % _text(pair[0]))
+            if len(chunk) == batch:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk)
+        yield ']'
+        return
+
+    values, timestamps = arrays()
+    for start in xrange(0, len(values), batch):
+        texts = map(str, values[start:start + batch])
+        if timestamps is None:
+            chunk = ['{"value":"%s"}' % value for value in texts]
+        else:
+            ats = default_formatter.format_epoch_us_many(
+                timestamps[start:start + batch])
+            chunk = ['{"at":"%s","value":"%s"}' % pair
+                     for pair in zip(ats, texts)]
+        yield (',' if start else '') + ','.join(chunk)
+    yield ']'
+
+
+def _jsonData(data):
+    head = _members((
+            ('id', _text(data._id)),
+            ('current_value', _opt(data._value)),
+            ('at', _opt(data._at, _time)),
+            ('min_value', _opt(data._minValue)),
+            ('max_value', _opt(data._maxValue)),
+            ('tags', '[' + ','.join(map(_text, data._tags)) + ']'
+             if data._tags else None),
+            ('unit', _opt(data._unit, _jsonUnit))))
+    if data._datapoints is None:
+        yield '{' + head + '}'
+        return
+    yield '{' + head + ',"datapoints":'
+    for chunk in _jsonDatapoints(data._datapoints):
+        yield chunk
+    yield '}'
+
+
+def _jsonEnvironment(env, ids=None, version=None):
+    pairs = [('version', _opt(version))]
+    if ids is None:
+        pairs.extend((
+                ('id', _opt(env._id)),
+                ('title', _opt(env._title)),
+                ('feed', _opt(env._feed)),
+                ('status', _opt(env._status)),
+                ('description', _opt(env._description)),
+                ('icon', _opt(env._icon)),
+                ('website', _opt(env._website)),
+                ('email', _opt(env._email)),
+                ('private', _opt(env._private,
+                                 lambda x: '"' + str(x).lower() + '"')),
+                ('creator', _opt(env._creator)),
+                ('updated', _opt(env._updated, _time)),
+                ('location', _opt(env._location, _jsonLocation))))
+        datas = env.snapshot().values()
+    else:
+        datas = [data for (dataId, data) in env.snapshot().iteritems()
+                 if dataId in ids]
+    head = _members(pairs)
+    yield '{' + head + (',' if head else '') + '"datastreams":['
+    for index, data in enumerate(datas):
+        if index:
+            yield ','
+        for chunk in _jsonData(data):
+            yield chunk
+    yield ']}'
+
+
+def iter_json(obj, ids=None):
+    """
+    Serialize an object in the JSON format of the Cosm v2 API, chunk by
+    chunk. Values are written as strings, like in EEML.
+
+    :param obj: the object
+    :type obj: `EEML`, `Environment`, `Data`, `DataPoints`, `Location` or
+        `Unit`
+    :param ids: only include the data with these ids and leave out the
+        metadata of the environment, everything if `None`
+    :type ids: `set`
+    :return: the byte chunks
+    :rtype: generator of `str`
+    """
+    if isinstance(obj, EEML):
+        if eeml.defer_validation:
+            obj.validate()
+        return _jsonEnvironment(obj._environment, ids, JSON_VERSION)
+    if isinstance(obj, Environment):
+        return _jsonEnvironment(obj, ids)
+    if isinstance(obj, Data):
+        return _jsonData(obj)
+    if isinstance(obj, DataPoints):
+        return _jsonDatapoints(obj)
+    if isinstance(obj, Location):
+        return iter([_jsonLocation(obj)])
+    if isinstance(obj, Unit):
+        return iter([_jsonUnit(obj)])
+    raise TypeError("cannot serialize {}".format(type(obj)))
+
+
+def _csvField(value):
+    """
+    Quote a CSV field if needed
+    """
+    if not isinstance(value, basestring):
+        return str(value)
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if any(char in value for char in ',"\r\n'):
+        return '"' + value.replace('"', '""') + '"'
+    return value
+
+
+def _csvDatapoints(id_, points, batch=1024):
+    arrays = getattr(points, '_arrays', None)
+    if arrays is None:
+        rows = []
+        for pair in points._values:
+            if len(pair) > 1 and pair[1] is not None:
+                rows.append('{},{},{}\r\n'.format(id_, isoformat(pair[1]),
+                                                  _csvField(pair[0])))
+            else:
+                rows.append('{},{}\r\n'.format(id_, _csvField(pair[0])))
+            if len(rows) == batch:
+                yield ''.join(rows)
+                rows = []
+        if rows:
+            yield ''.join(rows)
+        return
+
+    values, timestamps = arrays()
+    for start in xrange(0, len(values), batch):
+        texts = map(str, values[start:start + batch])
+        if timestamps is None:
+            yield ''.join(['%s,%s\r\n' % (id_, value) for value in texts])
+        else:
+            ats = default_formatter.format_epoch_us_many(
+                timestamps[start:start + batch])
+            yield ''.join(['%s,%s,%s\r\n' % (id_, at, value)
+                           for (at, value) in zip(ats, texts)])
+
+
+def _csvData(data):
+    if data._value is not None:
+        if data._at is not None:
+            yield '{},{},{}\r\n'.format(data._id, isoformat(data._at),
+                                        _csvField(data._value))
+        else:
+            yield '{},{}\r\n'.format(data._id, _csvField(data._value))
+    if data._datapoints is not None:
+        for chunk in _csvDatapoints(data._id, data._datapoints):
+            yield chunk
+
+
+def _csvEnvironment(env, ids=None):
+    for (dataId, data) in env.snapshot().iteritems():
+        if ids is None or dataId in ids:
+            for chunk in _csvData(data):
+                yield chunk
+
+
+def iter_csv(obj, ids=None):
+    """
+    Serialize the values of an object in the CSV format of the Cosm v2 API,
+    chunk by chunk: a ``id,value`` or ``id,time,value`` row for each value.
+    The metadata, locations, tags and units are not included.
+
+    :param obj: the object
+    :type obj: `EEML`, `Environment`, `Data` or `DataPoints`
+    :param ids: only include the data with these ids, everything if `None`
+    :type ids: `set`
+    :return: the byte chunks
+    :rtype: generator of `str`
+    """
+    if isinstance(obj, EEML):
+        if eeml.defer_validation:
+            obj.validate()
+        return _csvEnvironment(obj._environment, ids)
+    if isinstance(obj, Environment):
+        return _csvEnvironment(obj, ids)
+    if isinstance(obj, Data):
+        return _csvData(obj)
+    if isinstance(obj, DataPoints):
+        return _csvDatapoints(obj._id, obj)
+    raise TypeError("cannot serialize {}".format(type(obj)))
+
+
+register(Format('xml', 'application/xml', lambda doc, ids:
+                    doc.iter_bytes(ids)))
+register(Format('json', 'application/json', iter_json))
+register(Format('csv', 'text/csv', iter_csv))
@@ -0,0 +1,275 @@
+"""
+Read readings from line sources, like a serial port, a pipe or a file, and
+feed them to a `BufferedCosm` or anything else with an ``update`` method.
+
+A `LineReader` reads on its own thread and only parses the lines, the
+uploads are done by the background thread of the `BufferedCosm`, so a slow
+server does not keep the reader from draining the source::
+
+    cosm = BufferedCosm(API_URL, API_KEY, policy=BufferedCosm.DROP_OLDEST)
+    fmt = SplitFormat([Field(0, Celsius()), Field(1, RH())])
+    LineReader(serial.Serial('/dev/ttyUSB0', 9600), fmt, cosm).start()
+"""
+
+import re
+import threading
+from datetime import datetime
+
+from eeml import Data
+from eeml.util import _utc
+
+
+class Field(object):
+    """
+    A value in a line, mapped to a datastream.
+    """
+
+    __slots__ = ('_id', '_unit', '_tags', '_type')
+
+    def __init__(self, id_, unit=None, tags=(), type_=float):
+        """
+        :param id_: the id of the datastream
+        :type id_: positive `int`
+        :param unit: the unit of the datastream
+        :type unit: `Unit`
+        :param tags: the tags of the datastream
+        :type tags: `list`
+        :param type_: converts the text of the value, raises ValueError if
+            it is not valid
+        :type type_: `callable`
+        """
+        self._id = id_
+        self._unit = unit
+        self._tags = list(tags)
+        self._type = type_
+
+    def data(self, text, at):
+        """
+        Convert the text of a value.
+
+        :raise ValueError: if the text is not valid
+
+        :param text: the text of the value
+        :type text: `str`
+        :param at: the time of the value
+        :type at: `datetime`
+        :return: the reading
+        :rtype: `Data`
+        """
+        return Data(self._id, self._type(text), self._tags, unit=self._unit,
+                    at=at)
+
+
+class SplitFormat(object):
+    """
+    Values separated by whitespace or a separator, like ``21.5 40``,
+    mapped to datastreams by their position.
+    """
+
+    __slots__ = ('_fields', '_separator')
+
+    def __init__(self, fields, separator=None):
+        """
+        :param fields: the field of each value, `None` for ignored values
+        :type fields: `list` of `Field`
+        :param separator: the separator, whitespace if not given
+        :type separator: `str`
+        """
+        self._fields = list(fields)
+        self._separator = separator
+
+    def parse(self, line, at):
+        """
+        Parse a line.
+
+        :raise ValueError: if the line is not valid
+
+        :param line: the line, without the line end
+        :type line: `str`
+        :param at: the time of the values
+        :type at: `datetime`
+        :return: the readings
+        :rtype: `list` of `Data`
+        """
+        values = line.split(self._separator)
+        if len(values) != len(self._fields):
+            raise ValueError("expected {} values, got {}: {!r}".format(
+                    len(self._fields), len(values), line))
+        return [field.data(value.strip(), at)
+                for (field, value) in zip(self._fields, values)
+                if field is not None]
+
+
+class KeyValueFormat(object):
+    """
+    Named values, like ``T=21.5 H=40``, mapped to datastreams by their
+    names. Values with other names are ignored.
+    """
+
+    __slots__ = ('_fields', '_separator', '_assign')
+
+    def __init__(self, fields, separator=None, assign='='):
+        """
+        :param fields: the field of each name
+        :type fields: `dict` of `Field`
+        :param separator: the separator of the pairs, whitespace if not given
+        :type separator: `str`
+        :param assign: the separator of the names and the values
+        :type assign: `str`
+        """
+        self._fields = dict(fields)
+        self._separator = separator
+        self._assign = assign
+
+    def parse(self, line, at):
+        """
+        Parse a line, see `SplitFormat.parse`.
+        """
+        result = []
+        for pair in line.split(self._separator):
+            name, assign, value = pair.partition(self._assign)
+            if not assign:
+                raise ValueError("expected name{}value, got {!r}".format(
+                        self._assign, pair))
+            field = self._fields.get(name.strip())
+            if field is not None:
+                result.append(field.data(value.strip(), at))
+        return result
+
+
+class RegexFormat(object):
+    """
+    Lines matched by a regular expression, its named groups mapped to
+    datastreams. Groups that did not match are left out.
+    """
+
+    __slots__ = ('_pattern', '_fields')
+
+    def __init__(self, pattern, fields):
+        """
+        :param pattern: the regular expression
+        :type pattern: `str` or compiled pattern
+        :param fields: the field of each group name
+        :type fields: `dict` of `Field`
+        """
+        self._pattern = re.compile(pattern)
+        self._fields = dict(fields)
+
+    def parse(self, line, at):
+        """
+        Parse a line, see `SplitFormat.parse`.
+        """
+        match = self._pattern.match(line)
+        if match is None:
+            raise ValueError("line does not match: {!r}".format(line))
+        return [field.data(value, at)
+                for (name, value) in match.groupdict().iteritems()
+                for field in (self._fields.get(name),)
+                if field is not None and value is not None]
+
+
+class LineReader(object):
+    """
+    Read lines from a source on a background thread, parse them and update
+    a sink with the readings, stamped with the time they were read.
+
+    Empty lines are skipped, lines that cannot be parsed are counted in
+    `errors` and the last error is kept in `last_error`. A line is parsed
+    once its line ending is read, or at the end of the source. Reading
+    stops at the end of the source, or after `stop` once the current line
+    is read, so serial ports should be opened with a timeout.
+    """
+
+    def __init__(self, source, fmt, sink):
+        """
+        :param source: the lines, anything with a ``readline`` method
+            returning an empty string at the end, or an iterable of lines
+        :type source: `file`
+        :param fmt: parses the lines, like `SplitFormat`
+        :param sink: receives the readings, anything with an ``update``
+            method like `BufferedCosm`, whose ``update`` should not block
+        """
+        self._source = source
+        self._fmt = fmt
+        self._sink = sink
+        self._stopped = False
+        self._thread = None
+        self.lines = 0
+        self.errors = 0
+        self.last_error = None
+
+    def _lines(self):
+        """
+        Iterate the lines of the source until it ends or `stop` is called.
+        The text read before a line ending is kept until the rest of the
+        line arrives, a serial port with a timeout returns partial lines.
+        """
+        readline = getattr(self._source, 'readline', None)
+        if readline is None:
+            lines = iter(self._source)
+            readline = lambda: next(lines, '')
+        partial = ''
+        while not self._stopped:
+            line = readline()
+            if not line:
+                # a serial port with a timeout returns an empty string too
+                if getattr(self._source, 'timeout', None) is not None:
+                    continue
+                if partial:
+                    yield partial
+                return
+            if not line.endswith('\n'):
+                partial += line
+                continue
+            yield partial + line
+            partial = ''
+
+    def run(self):
+        """
+        Read the source in the calling thread until it ends.
+
+        :raise Exception: what the sink raises
+        """
+        for line in self._lines():
+            line = line.strip()
+            if not line:
+                continue
+            self.lines += 1
+            try:
+                readings = self._fmt.parse(line, datetime.now(_utc))
+            except ValueError, e:
+                self.errors += 1
+                self.last_error = e
+                continue
+            if readings:
+                self._sink.update(readings)
+
+    def _run(self):
+        try:
+            self.run()
+        except Exception, e:
+            self.last_error = e
+
+    def start(self):
+        """
+        Start reading on a background thread.
+        """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop reading after the current line.
+        """
+        self._stopped = True
+
+    def join(self, timeout=None):
+        """
+        Wait for the background thread to finish.
+
+        :param timeout: the most seconds to wait
+        :type timeout: `float`
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -20,4 +20,10 @@ class Invalidator(object):
     def datapoints(self, datapoints):
         pass
 
+    def data_batch(self, ids, units, ats):
+        pass
+
+    def validate_many(self, datas):
+        pass
+
 Validator = Invalidator
@@ -0,0 +1,260 @@
+"""
+Upload many Cosm feeds concurrently
+"""
+
+import threading
+import time
+
+from eeml.datastream import Cosm, ConnectionPool
+
+
+class FeedStats(object):
+    """
+    Upload statistics of a feed
+    """
+
+    __slots__ = ('puts', 'failures', 'last_latency', 'max_latency',
+                 'total_latency', 'last_error')
+
+    def __init__(self):
+        self.puts = 0
+        self.failures = 0
+        self.last_latency = None
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+        self.last_error = None
+
+    @property
+    def mean_latency(self):
+        """
+        The average duration of the puts in seconds
+        """
+        if not self.puts:
+            return None
+        return self.total_latency / self.puts
+
+    def copy(self):
+        stats = FeedStats()
+        for name in self.__slots__:
+            setattr(stats, name, getattr(self, name))
+        return stats
+
+
+class _Feed(object):
+    """
+    The scheduling state of a managed `Cosm`
+    """
+
+    __slots__ = ('cosm', 'min_interval', 'due', 'queued', 'running',
+                 'last_start', 'stats', 'counted')
+
+    def __init__(self, cosm, min_interval):
+        self.cosm = cosm
+        self.min_interval = min_interval
+        self.due = 0
+        self.queued = False
+        self.running = False
+        self.last_start = None
+        self.stats = FeedStats()
+        # the host the running put is counted for, the host of the cosm
+        # may change meanwhile
+        self.counted = None
+
+    @property
+    def host(self):
+        return (self.cosm.host, self.cosm._use_https)
+
+
+class FeedManager(object):
+    """
+    Own many `Cosm` objects and put them from a pool of threads. All the
+    feeds share one `ConnectionPool`. A feed is put at most once every
+    `min_interval` seconds and never concurrently with itself, and at most
+    `per_host` puts run at the same time against a host.
+    """
+
+    def __init__(self, workers=8, per_host=4, min_interval=0):
+        """
+        :param workers: the number of threads doing puts
+        :type workers: `int`
+        :param per_host: the maximal number of concurrent puts per host
+        :type per_host: `int`
+        :param min_interval: the default shortest time between two puts of
+            a feed in seconds
+        :type min_interval: `float`
+        """
+        self.pool = ConnectionPool(maxsize=per_host)
+        self._per_host = per_host
+        self._min_interval = min_interval
+        self._feeds = dict()
+        self._queue = []
+        self._active = dict()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._workers = [threading.Thread(target=self._run)
+                         for i in xrange(workers)]
+        for worker in self._workers:
+            worker.daemon = True
+            worker.start()
+
+    def add(self, cosm, min_interval=None):
+        """
+        Manage a feed, it will use the connections of this manager.
+
+        :param cosm: the feed
+        :type cosm: `Cosm`
+        :param min_interval: the shortest time between two puts of this
+            feed, the default of the manager if `None`
+        :type min_interval: `float`
+        :return: cosm
+        :rtype: `Cosm`
+        """
+        if min_interval is None:
+            min_interval = self._min_interval
+        cosm._pool = self.pool
+        with self._cond:
+            self._feeds[cosm] = _Feed(cosm, min_interval)
+        return cosm
+
+    def create(self, url, key, min_interval=None, **kwargs):
+        """
+        Create and add a feed.
+
+        :param min_interval: see `add`
+        :type min_interval: `float`
+        :return: the new feed, the other parameters are passed to `Cosm`
+        :rtype: `Cosm`
+        """
+        return self.add(Cosm(url, key, pool=self.pool, **kwargs),
+                        min_interval)
+
+    def remove(self, cosm):
+        """
+        Stop managing a feed, queued puts of it are dropped.
+        """
+        with self._cond:
+            feed = self._feeds.pop(cosm)
+            if feed.queued:
+                self._queue.remove(feed)
+                feed.queued = False
+            self._cond.notify_all()
+
+    def put(self, cosm):
+        """
+        Queue a put of a feed, unless one is queued already.
+
+        :param cosm: a managed feed
+        :type cosm: `Cosm`
+        """
+        with self._cond:
+            self._schedule(self._feeds[cosm])
+
+    def put_all(self):
+        """
+        Queue a put of every feed.
+        """
+        with self._cond:
+            for feed in self._feeds.itervalues():
+                self._schedule(feed)
+
+    def _schedule(self, feed):
+        """
+        Queue feed, the condition must be held.
+        """
+        if self._closed:
+            raise ValueError("put on closed FeedManager")
+        if feed.queued:
+            return
+        feed.queued = True
+        feed.due = time.time()
+        if feed.last_start is not None:
+            feed.due = max(feed.due, feed.last_start + feed.min_interval)
+        self._queue.append(feed)
+        self._cond.notify_all()
+
+    def _next(self):
+        """
+        Remove and return the feed to put next, or return the time to wait
+        for one. The condition must be held.
+        """
+        now = time.time()
+        best = None
+        wait = None
+        for feed in self._queue:
+            if (feed.running or
+                self._active.get(feed.host, 0) >= self._per_host):
+                continue
+            if feed.due > now:
+                wait = feed.due - now if wait is None else \
+                    min(wait, feed.due - now)
+            elif best is None or feed.due < best.due:
+                best = feed
+        if best is None:
+            return wait
+        self._queue.remove(best)
+        return best
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    feed = self._next()
+                    if isinstance(feed, _Feed):
+                        break
+                    if self._closed and not self._queue:
+                        return
+                    self._cond.wait(feed)
+                feed.queued = False
+                feed.running = True
+                feed.last_start = time.time()
+                feed.counted = feed.host
+                self._active[feed.counted] = \
+                    self._active.get(feed.counted, 0) + 1
+            start = time.time()
+            error = None
+            try:
+                feed.cosm.put()
+            except Exception, e:
+                error = e
+            latency = time.time() - start
+            with self._cond:
+                stats = feed.stats
+                stats.puts += 1
+                stats.last_latency = latency
+                stats.max_latency = max(stats.max_latency, latency)
+                stats.total_latency += latency
+                if error is not None:
+                    stats.failures += 1
+                    stats.last_error = error
+                feed.running = False
+                self._active[feed.counted] -= 1
+                feed.counted = None
+                self._cond.notify_all()
+
+    def wait(self):
+        """
+        Wait until every queued put is done.
+        """
+        with self._cond:
+            while self._queue or any(self._active.itervalues()):
+                self._cond.wait()
+
+    def stats(self):
+        """
+        :return: a snapshot of the statistics of the feeds
+        :rtype: `dict` of `Cosm` to `FeedStats`
+        """
+        with self._cond:
+            return dict((cosm, feed.stats.copy())
+                        for cosm, feed in self._feeds.iteritems())
+
+    def close(self):
+        """
+        Finish the queued puts and stop the threads.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for worker in self._workers:
+            worker.join()
+        self.pool.close()
@@ -0,0 +1,340 @@
+"""
+Instrumentation of validation, serialization and uploads.
+
+The instrumented code reports measurements to the hooks added with
+`add_hook`. While there are none it only checks `enabled`, so the
+measurements cost nothing when they are not used. A hook has an
+``increment`` and an ``observe`` method, see `Hook`; `Registry` keeps
+counters and histograms in memory and writes them in the Prometheus text
+format, `StatsdHook` sends them to a StatsD daemon::
+
+    registry = metrics.Registry()
+    metrics.add_hook(registry)
+    ...
+    registry.write_textfile('/var/lib/node_exporter/eeml.prom')
+
+The measurements, times are in seconds:
+
+``eeml_validation_seconds{type}``
+    validation of an object by the validator method ``type``
+``eeml_serialize_seconds{element,method}``
+    ``toeeml`` of an element, ``iter_bytes`` of a datastream, ``tostring``
+    of a document
+``eeml_put_serialize_seconds{format}``, ``eeml_payload_bytes{format}``
+    serialization and compression of the body of a put, its size
+``eeml_http_connect_seconds{scheme}``, ``eeml_http_tls_seconds``
+    opening a new connection, the TLS handshake of HTTPS connections
+``eeml_http_response_seconds``, ``eeml_http_responses_total{status}``
+    sending a request until its response is read, the responses by status
+``eeml_put_seconds``, ``eeml_put_retries_total``, ``eeml_put_failures_total``
+    a put with all its attempts, the retries and the failed puts
+"""
+
+import os
+import threading
+import time
+from functools import wraps
+
+# there is at least one hook, checked by the instrumented code
+enabled = False
+
+_hooks = ()
+_lock = threading.Lock()
+
+clock = time.time
+
+
+class Hook(object):
+    """
+    Receiver of measurements, the methods of this class do nothing.
+
+    Labels are given as a tuple of (name, value) pairs. Hooks are called on
+    the thread doing the measured work, they should be fast and must not
+    raise.
+    """
+
+    def increment(self, name, value, labels):
+        """
+        Add value to a counter.
+
+        :param name: the name of the counter
+        :type name: `str`
+        :param value: the amount
+        :type value: `int`
+        :param labels: the labels of the counter
+        :type labels: `tuple`
+        """
+
+    def observe(self, name, value, labels):
+        """
+        Record a sample of a histogram, a duration or a size.
+
+        :param name: the name of the histogram, ending in ``_seconds`` or
+            ``_bytes``
+        :type name: `str`
+        :param value: the sample
+        :type value: `float`
+        :param labels: the labels of the histogram
+        :type labels: `tuple`
+        """
+
+
+def add_hook(hook):
+    """
+    Start sending measurements to a hook.
+
+    :param hook: the hook
+    :type hook: `Hook`
+    """
+    global _hooks, enabled
+    with _lock:
+        _hooks = _hooks + (hook,)
+        enabled = True
+
+
+def remove_hook(hook):
+    """
+    Stop sending measurements to a hook.
+
+    :param hook: a hook added with `add_hook`
+    :type hook: `Hook`
+    """
+    global _hooks, enabled
+    with _lock:
+        _hooks = tuple(added for added in _hooks if added is not hook)
+        enabled = bool(_hooks)
+
+
+def increment(name, labels=(), value=1):
+    """
+    Add value to a counter of every hook.
+    """
+    for hook in _hooks:
+        hook.increment(name, value, labels)
+
+
+def observe(name, value, labels=()):
+    """
+    Record a sample of a histogram of every hook.
+    """
+    for hook in _hooks:
+        hook.observe(name, value, labels)
+
+
+def timed(name, **labels):
+    """
+    Decorate a function to observe its duration while measurements are
+    enabled.
+
+    :param name: the name of the histogram
+    :type name: `str`
+    :param labels: the labels of the histogram
+    """
+    labels = tuple(sorted(labels.iteritems()))
+
+    def decorate(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, clock() - start, labels)
+        return wrapper
+    return decorate
+
+
+def timed_chunks(chunks, name, labels=()):
+    """
+    Observe the time spent producing byte chunks, excluding the time the
+    consumer spends between them.
+
+    :param chunks: the chunks
+    :type chunks: iterable of `str`
+    :return: the same chunks
+    :rtype: generator of `str`
+    """
+    chunks = iter(chunks)
+    total = 0.0
+    while True:
+        start = clock()
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            break
+        finally:
+            total += clock() - start
+        yield chunk
+    observe(name, total, labels)
+
+
+# the upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0,
+                   5.0, 10.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Registry(Hook):
+    """
+    A hook keeping counters and cumulative histograms in memory, a registry
+    may be shared between threads.
+    """
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, labels):
+        key = (name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                bounds = BYTES_BUCKETS if name.endswith('_bytes') else \
+                    SECONDS_BUCKETS
+                histogram = self._histograms[key] = [
+                    bounds, [0] * len(bounds), 0, 0.0]
+            bounds, counts = histogram[:2]
+            for index, bound in enumerate(bounds):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            histogram[2] += 1
+            histogram[3] += value
+
+    def counter(self, name, **labels):
+        """
+        :return: the value of a counter, 0 if it was never incremented
+        :rtype: `int`
+        """
+        with self._lock:
+            return self._counters.get(
+                (name, tuple(sorted(labels.iteritems()))), 0)
+
+    def histogram(self, name, **labels):
+        """
+        :return: the number and the sum of the samples of a histogram
+        :rtype: `tuple`
+        """
+        with self._lock:
+            histogram = self._histograms.get(
+                (name, tuple(sorted(labels.iteritems()))))
+            if histogram is None:
+                return (0, 0.0)
+            return (histogram[2], histogram[3])
+
+    def prometheus(self):
+        """
+        Format the measurements in the Prometheus text format.
+
+        :return: the text
+        :rtype: `str`
+        """
+        with self._lock:
+            counters = sorted(self._counters.iteritems())
+            histograms = sorted((key, (bounds, list(counts), count, total))
+                                for key, (bounds, counts, count, total)
+                                in self._histograms.iteritems())
+        lines = []
+        last = None
+        for (name, labels), value in counters:
+            if name != last:
+                lines.append('# TYPE {} counter'.format(name))
+                last = name
+            lines.append('{}{} {}'.format(name, _labels(labels), value))
+        for (name, labels), (bounds, counts, count, total) in histograms:
+            if name != last:
+                lines.append('# TYPE {} histogram'.format(name))
+                last = name
+            cumulative = 0
+            for bound, bucket in zip(bounds, counts):
+                cumulative += bucket
+                lines.append('{}_bucket{} {}'.format(
+                        name, _labels(labels + (('le', repr(bound)),)),
+                        cumulative))
+            lines.append('{}_bucket{} {}'.format(
+                    name, _labels(labels + (('le', '+Inf'),)), count))
+            lines.append('{}_sum{} {!r}'.format(name, _labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, _labels(labels), count))
+        return ''.join(line + '\n' for line in lines)
+
+    def write_textfile(self, path):
+        """
+        Write `prometheus` into a file atomically, for the textfile
+        collector of the node exporter.
+
+        :param path: the file
+        :type path: `str`
+        """
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'w') as f:
+            f.write(self.prometheus())
+        os.rename(temp, path)
+
+
+def _labels(labels):
+    """
+    Format labels for Prometheus
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+            name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                          for name, value in labels) + '}'
+
+
+class StatsdHook(Hook):
+    """
+    A hook sending the measurements to a StatsD daemon over UDP. Labels are
+    appended to the metric names, durations are sent as timers in
+    milliseconds and sizes as histograms.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix=''):
+        """
+        :param host: the host of the daemon
+        :type host: `str`
+        :param port: the port of the daemon
+        :type port: `int`
+        :param prefix: prepended to the metric names
+        :type prefix: `str`
+        """
+        import socket
+        self._address = (host, port)
+        self._prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._error = socket.error
+
+    def _name(self, name, labels):
+        return self._prefix + '.'.join(
+            [name] + ['{}_{}'.format(key, value) for key, value in labels])
+
+    def _send(self, line):
+        try:
+            self._socket.sendto(line, self._address)
+        except self._error:
+            # measurements are not worth failing for
+            pass
+
+    def increment(self, name, value, labels):
+        self._send('{}:{}|c'.format(self._name(name, labels), value))
+
+    def observe(self, name, value, labels):
+        if name.endswith('_seconds'):
+            self._send('{}:{!r}|ms'.format(self._name(name, labels),
+                                           value * 1000))
+        else:
+            self._send('{}:{}|h'.format(self._name(name, labels), value))
+
+    def close(self):
+        """
+        Close the socket.
+        """
+        self._socket.close()
@@ -0,0 +1,229 @@
+"""
+Build `EEML` objects from EEML documents
+"""
+
+from io import BytesIO
+
+from eeml import EEML, Environment, Location, Data, DataPoints, validate
+from eeml.unit import Unit
+from eeml import backend
+from eeml.util import _parseDatetime, _tostring
+
+
+def _localname(tag):
+    """
+    Strip the namespace from an element tag
+    """
+    return tag.rsplit('}', 1)[-1]
+
+
+def _number(text):
+    """
+    Convert text into an `int` or `float`, return it unchanged if it is
+    neither
+    """
+    if text is None:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            return text
+
+
+def _datetime(text):
+    """
+    Convert text into a `datetime`, return it unchanged if it is not ISO 8601
+    """
+    if text is None:
+        return None
+    try:
+        return _parseDatetime(text)
+    except ValueError:
+        return text
+
+
+def _bool(text):
+    """
+    Convert an xsd:boolean into `bool`
+    """
+    if text is None:
+        return None
+    return text.strip() in ('true', '1')
+
+
+def _value(elem):
+    """
+    Convert a value element into a datapoint pair
+    """
+    at = elem.get('at')
+    if at is None:
+        return (_number(elem.text),)
+    return (_number(elem.text), _parseDatetime(at))
+
+
+class LazyDataPoints(DataPoints):
+    """
+    A DataPoints keeping its values as the serialized datapoints element,
+    they are only parsed when iterated.
+    """
+
+    __slots__ = ('_source',)
+
+    # the source is never changed, fragments may be cached
+    _version = 0
+
+    @validate('datapoints')
+    def __init__(self, id_, source):
+        """
+        :param id_: the id of the Data object this DataPoints belongs to
+        :type id_: positive `int`
+        :param source: a serialized datapoints element
+        :type source: `str`
+        """
+        self._id = id_
+        self._source = source
+
+    def __iter__(self):
+        for event, elem in backend.etree().iterparse(BytesIO(self._source)):
+            if _localname(elem.tag) == 'value':
+                yield _value(elem)
+                elem.clear()
+
+    @property
+    def _values(self):
+        """
+        The datapoints as (value, date) pairs, like in `DataPoints`
+        """
+        return list(self)
+
+
+def _build(events, lazy):
+    """
+    Build the object model from iterparse events. Every element is removed
+    from its parent once it is processed, so the memory used is proportional
+    to the largest element, not to the document.
+    """
+    stack = []
+    document = None
+    env = loc = location = data = unit = current = points = None
+    for event, elem in events:
+        name = _localname(elem.tag)
+        if event == 'start':
+            stack.append(elem)
+            if name == 'environment':
+                env = {}
+                location = None
+                data = []
+            elif name == 'location':
+                loc = {}
+            elif name == 'data':
+                current = {'id_': elem.get('id'), 'tags': []}
+                unit = points = None
+            elif name == 'datapoints':
+                points = []
+            continue
+
+        stack.pop()
+        parent = _localname(stack[-1].tag) if stack else None
+        if name == 'value' and parent == 'datapoints':
+            if lazy:
+                continue
+            points.append(_value(elem))
+        elif name == 'datapoints':
+            id_ = int(current['id_'])
+            if lazy:
+                points = LazyDataPoints(id_, _tostring(elem))
+            else:
+                points = DataPoints(id_, points)
+        elif name == 'unit':
+            unit = Unit(elem.text, elem.get('type'), elem.get('symbol'))
+        elif name == 'current_value':
+            current['value'] = _number(elem.text)
+            current['minValue'] = _number(elem.get('minValue'))
+            current['maxValue'] = _number(elem.get('maxValue'))
+            current['at'] = _datetime(elem.get('at'))
+        elif name == 'tag' and parent == 'data':
+            current['tags'].append(elem.text)
+        elif name == 'data':
+            data.append(Data(int(current['id_']), current.get('value'),
+                             current['tags'], current.get('minValue'),
+                             current.get('maxValue'), unit,
+                             current.get('at'), points))
+            current = unit = points = None
+        elif name in ('name', 'lat', 'lon', 'ele') and parent == 'location':
+            loc[name] = elem.text if name == 'name' else _number(elem.text)
+        elif name == 'location':
+            location = Location(elem.get('domain'),
+                                exposure=elem.get('exposure'),
+                                disposition=elem.get('disposition'), **loc)
+            loc = None
+        elif parent == 'environment' and name in (
+                'title', 'feed', 'status', 'description', 'icon', 'website',
+                'email'):
+            env[name] = elem.text
+        elif name == 'private' and parent == 'environment':
+            env['private'] = _bool(elem.text)
+        elif name == 'environment':
+            id_ = elem.get('id')
+            environment = Environment(updated=_datetime(elem.get('updated')),
+                                      creator=elem.get('creator'),
+                                      id_=None if id_ is None else int(id_),
+                                      **env)
+            if location is not None:
+                environment.setLocation(location)
+            environment.updateData(data)
+            document = EEML(environment)
+            env = location = data = None
+        elif name == 'eeml' and document is None:
+            document = EEML(Environment())
+
+        if stack:
+            stack[-1].remove(elem)
+
+    if document is None:
+        raise ValueError("No eeml element found")
+    return document
+
+
+def parse(source, lazy=False):
+    """
+    Parse an EEML document incrementally.
+
+    :raise ValueError: if the document is not well formed XML or not valid
+        EEML
+    :raise IOError: if source cannot be read
+
+    :param source: a file name or a file like object
+    :type source: `str` or `file`
+    :param lazy: keep the datapoints serialized until they are iterated
+    :type lazy: `bool`
+    :return: the document
+    :rtype: `EEML`
+    """
+    try:
+        return _build(backend.etree().iterparse(
+                source, events=('start', 'end')), lazy)
+    except (SyntaxError, TypeError), e:
+        # the syntax errors of both backends and ids missing from data
+        raise ValueError("Not a valid EEML document: {}".format(e))
+
+
+def fromstring(text, lazy=False):
+    """
+    Parse an EEML document from a string.
+
+    :raise ValueError: if the document is not well formed XML or not valid
+        EEML
+    :raise TypeError: if text is not a byte string
+
+    :param text: the document
+    :type text: `str`
+    :param lazy: keep the datapoints serialized until they are iterated
+    :type lazy: `bool`
+    :return: the document
+    :rtype: `EEML`
+    """
+    return parse(BytesIO(text), lazy)
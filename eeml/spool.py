@@ -0,0 +1,133 @@
+"""
+Keep the documents of failed puts on disk until they can be sent
+"""
+
+import random
+import sqlite3
+import threading
+
+
+class Backoff(object):
+    """
+    Exponential backoff with full jitter: the n-th retry waits a random time
+    between 0 and ``min(maximum, base * 2 ** n)`` seconds.
+    """
+
+    def __init__(self, retries=3, base=0.5, maximum=30.0):
+        """
+        :param retries: the number of retries after the first attempt
+        :type retries: `int`
+        :param base: the upper limit of the first delay in seconds
+        :type base: `float`
+        :param maximum: the upper limit of any delay in seconds
+        :type maximum: `float`
+        """
+        self.retries = retries
+        self.base = base
+        self.maximum = maximum
+
+    def delays(self):
+        """
+        :return: the time to wait before each retry
+        :rtype: generator of `float`
+        """
+        for attempt in xrange(self.retries):
+            yield random.uniform(0, min(self.maximum,
+                                        self.base * 2 ** attempt))
+
+
+class Spool(object):
+    """
+    An SQLite backed queue of EEML documents waiting to be put, oldest
+    first. When the documents exceed `max_bytes` the oldest ones are
+    dropped.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024):
+        """
+        :param path: the database file
+        :type path: `str`
+        :param max_bytes: the maximal total size of the kept documents
+        :type max_bytes: `int`
+        """
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS spool ('
+                         'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                         'url TEXT NOT NULL, body BLOB NOT NULL, '
+                         'size INTEGER NOT NULL)')
+        self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def size(self):
+        """
+        :return: the total size of the kept documents
+        :rtype: `int`
+        """
+        with self._lock:
+            return self._db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM spool').fetchone()[0]
+
+    def append(self, url, body):
+        """
+        Keep a document.
+
+        :param url: the feed url the document is put to
+        :type url: `str`
+        :param body: the document
+        :type body: `str`
+        """
+        with self._lock:
+            self._db.execute('INSERT INTO spool (url, body, size) '
+                             'VALUES (?, ?, ?)',
+                             (url, sqlite3.Binary(body), len(body)))
+            total = self._db.execute(
+                'SELECT SUM(size) FROM spool').fetchone()[0]
+            if total > self.max_bytes:
+                for id_, size in self._db.execute(
+                        'SELECT id, size FROM spool ORDER BY id').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    self._db.execute('DELETE FROM spool WHERE id = ?', (id_,))
+                    total -= size
+                    self.dropped += 1
+            self._db.commit()
+
+    def peek(self, url, limit):
+        """
+        Return the oldest documents of a feed.
+
+        :param url: the feed url
+        :type url: `str`
+        :param limit: the maximal number of documents
+        :type limit: `int`
+        :return: pairs of an identifier and a document
+        :rtype: `list`
+        """
+        with self._lock:
+            return [(id_, str(body)) for id_, body in self._db.execute(
+                    'SELECT id, body FROM spool WHERE url = ? '
+                    'ORDER BY id LIMIT ?', (url, limit))]
+
+    def remove(self, id_):
+        """
+        Forget a sent document.
+
+        :param id_: the identifier returned by `peek`
+        :type id_: `int`
+        """
+        with self._lock:
+            self._db.execute('DELETE FROM spool WHERE id = ?', (id_,))
+            self._db.commit()
+
+    def close(self):
+        """
+        Close the database.
+        """
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,483 @@
+"""
+Save the state of documents to a compact binary file and restore it, so a
+collector can restart without losing its environments and the datapoints
+it has not sent yet. Restoring is much faster than parsing EEML: values and
+times are packed with `struct`, tags and units are stored once however
+many datastreams share them, and the arrays of `ArrayDataPoints` are
+stored as raw doubles, copied straight from a memory map by `load`.
+
+Restored objects are not validated again.
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from cStringIO import StringIO
+from datetime import date, datetime
+
+import eeml
+from eeml import EEML, Environment, Location, Data, DataPoints, \
+     ArrayDataPoints, RingDataPoints
+from eeml.unit import Unit
+from eeml.util import _FixedOffset, _epochUs, _fromEpochUs
+
+MAGIC = 'EEMLSTAT'
+VERSION = 1
+
+# magic, version, length of the records, offset of the arrays
+_HEADER = struct.Struct('<8sIQQ')
+_COUNT = struct.Struct('<I')
+_INDEX = struct.Struct('<i')
+_INT = struct.Struct('<q')
+_FLOAT = struct.Struct('<d')
+_AWARE = struct.Struct('<qh')
+# tags, unit and kind of the datapoints of a `Data`
+_DATA = struct.Struct('<iiB')
+# length, capacity, window, offsets of the values and the times
+_ARRAYS = struct.Struct('<QQdqq')
+
+_NONE, _LIST, _ARRAY, _RING = range(4)
+
+# the attributes of the objects, in the order they are stored
+_ENVIRONMENT = ('_title', '_feed', '_status', '_description', '_icon',
+                '_website', '_email', '_updated', '_creator', '_id',
+                '_private')
+_LOCATION = ('_domain', '_name', '_lat', '_lon', '_ele', '_exposure',
+             '_disposition')
+
+_SWAP = sys.byteorder != 'little'
+
+
+class _Writer(object):
+    """
+    Collect the records of the objects and intern their strings, tags and
+    units
+    """
+
+    __slots__ = ('_records', '_strings', '_tags', '_units', '_blobs',
+                 '_offset')
+
+    def __init__(self):
+        self._records = []
+        self._strings = {}
+        self._tags = {}
+        self._units = {}
+        self._blobs = []
+        self._offset = 0
+
+    def _string(self, text):
+        key = (type(text), text)
+        index = self._strings.get(key)
+        if index is None:
+            index = self._strings[key] = len(self._strings)
+        return _INDEX.pack(index)
+
+    def value(self, value):
+        """
+        Pack a value of an attribute
+        """
+        if value is None:
+            return 'N'
+        if value is True:
+            return 'T'
+        if value is False:
+            return 'F'
+        if isinstance(value, basestring):
+            return ('s' if isinstance(value, str) else 'u') + \
+                self._string(value)
+        if isinstance(value, float):
+            return 'f' + _FLOAT.pack(value)
+        if isinstance(value, (int, long)):
+            if -2 ** 63 <= value < 2 ** 63:
+                return 'i' + _INT.pack(value)
+            return 'l' + self._string(str(value))
+        if isinstance(value, datetime):
+            offset = value.utcoffset()
+            if offset is None:
+                return 'n' + _INT.pack(_epochUs(value))
+            return 'a' + _AWARE.pack(_epochUs(value),
+                                     offset.days * 1440 + offset.seconds // 60)
+        if isinstance(value, date):
+            return 'd' + _INDEX.pack(value.toordinal())
+        raise TypeError("cannot save a value of {}".format(type(value)))
+
+    def _intern(self, table, key, pack):
+        index = table.get(key)
+        if index is None:
+            index = table[key] = (len(table), pack())
+        return index[0]
+
+    def _unitIndex(self, unit):
+        if unit is None:
+            return -1
+        stock = type(unit).__module__ == 'eeml.unit' and type(unit) is not Unit
+        return self._intern(self._units, unit, lambda: ''.join((
+                    self.value(type(unit).__name__ if stock else None),
+                    self.value(unit._name), self.value(unit._type),
+                    self.value(unit._symbol))))
+
+    def _tagsIndex(self, tags):
+        tags = tuple(tags)
+        return self._intern(self._tags, tags, lambda: _COUNT.pack(
+                len(tags)) + ''.join(map(self.value, tags)))
+
+    def _blob(self, values):
+        """
+        Store an array of doubles, return its offset
+        """
+        if _SWAP:
+            values = array('d', values)
+            values.byteswap()
+        offset = self._offset
+        self._blobs.append(values.tostring())
+        self._offset += len(self._blobs[-1])
+        return offset
+
+    def environment(self, env):
+        """
+        Add the record of an `Environment`
+        """
+        value = self.value
+        append = self._records.append
+        append(''.join([value(getattr(env, name)) for name in _ENVIRONMENT]))
+        location = env._location
+        if location is None:
+            append('N')
+        else:
+            append('L' + ''.join([value(getattr(location, name))
+                                  for name in _LOCATION]))
+        datas = env.snapshot().values()
+        append(_COUNT.pack(len(datas)))
+        for data in datas:
+            self.data(data)
+
+    def data(self, data):
+        """
+        Add the record of a `Data`
+        """
+        value = self.value
+        points = data._datapoints
+        if points is None:
+            kind = _NONE
+        elif isinstance(points, RingDataPoints):
+            kind = _RING
+        elif isinstance(points, ArrayDataPoints):
+            kind = _ARRAY
+        else:
+            kind = _LIST
+        self._records.append(_DATA.pack(
+                self._tagsIndex(data._tags), self._unitIndex(data._unit),
+                kind) + value(data._id) + value(data._value) +
+                value(data._minValue) + value(data._maxValue) +
+                value(data._at))
+        if kind == _NONE:
+            return
+        self._records.append(value(points._id))
+        if kind == _LIST:
+            pairs = points._values
+            self._records.append(_COUNT.pack(len(pairs)) + ''.join([
+                        value(pair[0]) + (value(pair[1]) if len(pair) > 1
+                                          else 'N') for pair in pairs]))
+            return
+        values, timestamps = points._arrays()
+        capacity = window = 0
+        if kind == _RING:
+            capacity = len(points._array)
+            window = points._window
+            if window is None:
+                window = float('nan')
+        self._records.append(_ARRAYS.pack(
+                len(values), capacity, window, self._blob(values),
+                -1 if timestamps is None else self._blob(timestamps)))
+
+    def write(self, fileobj):
+        """
+        Write the tables, the records and the arrays
+        """
+        tables = [_COUNT.pack(len(self._strings))]
+        for (kind, text), index in sorted(self._strings.iteritems(),
+                                          key=lambda item: item[1]):
+            if kind is unicode:
+                text = text.encode('utf-8')
+            tables.append(_COUNT.pack(len(text)) + text)
+        for table in (self._tags, self._units):
+            tables.append(_COUNT.pack(len(table)))
+            tables.extend(packed for (index, packed)
+                          in sorted(table.itervalues()))
+        records = ''.join(tables) + ''.join(self._records)
+        start = _HEADER.size + len(records)
+        # the arrays start on a multiple of 8 bytes
+        padding = -start % 8
+        fileobj.write(_HEADER.pack(MAGIC, VERSION, len(records),
+                                   start + padding))
+        fileobj.write(records)
+        fileobj.write('\0' * padding)
+        for blob in self._blobs:
+            fileobj.write(blob)
+
+
+def _documents(obj):
+    """
+    The documents to save and whether a list was given
+    """
+    if isinstance(obj, (EEML, Environment)):
+        return [obj], False
+    obj = list(obj)
+    for doc in obj:
+        if not isinstance(doc, (EEML, Environment)):
+            raise TypeError("cannot save {}".format(type(doc)))
+    return obj, True
+
+
+def dump(obj, fileobj):
+    """
+    Save documents into a file.
+
+    :raise TypeError: if a value is not a string, a number, a `date` or a
+        `datetime`
+
+    :param obj: the documents
+    :type obj: `EEML`, `Environment` or a `list` of them
+    :param fileobj: the binary file written, anything with a ``write``
+        method
+    :type fileobj: `file`
+    """
+    docs, many = _documents(obj)
+    writer = _Writer()
+    writer._records.append(_COUNT.pack(len(docs)))
+    for doc in docs:
+        if isinstance(doc, EEML):
+            writer._records.append('E')
+            doc = doc._environment
+        else:
+            writer._records.append('V')
+        writer.environment(doc)
+    writer._records.insert(0, 'M' if many else 'S')
+    writer.write(fileobj)
+
+
+def dumps(obj):
+    """
+    Save documents into a string, see `dump`.
+
+    :return: the saved state
+    :rtype: `str`
+    """
+    out = StringIO()
+    dump(obj, out)
+    return out.getvalue()
+
+
+class _Reader(object):
+    """
+    Unpack the records written by `_Writer`
+    """
+
+    __slots__ = ('_buf', '_pos', '_strings', '_tags', '_units', '_blobs')
+
+    def __init__(self, buf, blobs):
+        self._buf = buf
+        self._pos = _HEADER.size
+        self._blobs = blobs
+        self._strings = []
+        for i in xrange(self._count()):
+            size = self._count()
+            self._strings.append(buf[self._pos:self._pos + size])
+            self._pos += size
+        self._tags = [[self.value() for j in xrange(self._count())]
+                      for i in xrange(self._count())]
+        self._units = [self._unit() for i in xrange(self._count())]
+
+    def _unpack(self, fmt):
+        values = fmt.unpack_from(self._buf, self._pos)
+        self._pos += fmt.size
+        return values
+
+    def _count(self):
+        return self._unpack(_COUNT)[0]
+
+    def value(self):
+        """
+        Unpack a value of an attribute
+        """
+        tag = self._buf[self._pos]
+        self._pos += 1
+        if tag == 'N':
+            return None
+        if tag == 's':
+            return self._strings[self._unpack(_INDEX)[0]]
+        if tag == 'f':
+            return self._unpack(_FLOAT)[0]
+        if tag == 'i':
+            return self._unpack(_INT)[0]
+        if tag == 'u':
+            return self._strings[self._unpack(_INDEX)[0]].decode('utf-8')
+        if tag == 'a':
+            us, offset = self._unpack(_AWARE)
+            at = _fromEpochUs(us)
+            if offset:
+                return at.astimezone(_FixedOffset(offset))
+            return at
+        if tag == 'n':
+            return _fromEpochUs(self._unpack(_INT)[0]).replace(tzinfo=None)
+        if tag == 'T':
+            return True
+        if tag == 'F':
+            return False
+        if tag == 'l':
+            return long(self._strings[self._unpack(_INDEX)[0]])
+        if tag == 'd':
+            return date.fromordinal(self._unpack(_INDEX)[0])
+        raise ValueError("corrupt state, unknown value type {!r}".format(tag))
+
+    def _unit(self):
+        stock, name, type_, symbol = [self.value() for i in range(4)]
+        if stock is not None:
+            return getattr(eeml.unit, stock)()
+        return Unit(name, type_, symbol)
+
+    def _array(self, offset, length):
+        values = array('d')
+        if length:
+            values.fromstring(buffer(self._buf, self._blobs + offset,
+                                     length * 8))
+            if _SWAP:
+                values.byteswap()
+        return values
+
+    def environment(self):
+        """
+        Unpack the record of an `Environment`
+        """
+        env = Environment()
+        for name in _ENVIRONMENT:
+            setattr(env, name, self.value())
+        if self._buf[self._pos] == 'L':
+            self._pos += 1
+            location = Location.__new__(Location)
+            for name in _LOCATION:
+                setattr(location, name, self.value())
+            location._cache = None
+            env._location = location
+        else:
+            self._pos += 1
+        datas = env._data
+        for i in xrange(self._count()):
+            data = self.data()
+            datas[data._id] = data
+        return env
+
+    def data(self):
+        """
+        Unpack the record of a `Data`
+        """
+        tags, unit, kind = self._unpack(_DATA)
+        value = self.value
+        data = Data.__new__(Data)
+        data._id = value()
+        data._value = value()
+        data._minValue = value()
+        data._maxValue = value()
+        data._at = value()
+        data._tags = list(self._tags[tags])
+        data._unit = None if unit < 0 else self._units[unit]
+        data._cache = None
+        data._datapoints = None
+        if kind == _NONE:
+            return data
+        id_ = value()
+        if kind == _LIST:
+            points = DataPoints.__new__(DataPoints)
+            points._id = id_
+            points._values = [pair if pair[1] is not None else pair[:1]
+                              for pair in [(value(), value()) for i in
+                                           xrange(self._count())]]
+            data._datapoints = points
+            return data
+        length, capacity, window, values, timestamps = self._unpack(_ARRAYS)
+        values = self._array(values, length)
+        timestamps = None if timestamps < 0 else \
+            self._array(timestamps, length)
+        if kind == _RING:
+            points = RingDataPoints(id_, capacity)
+            points._window = None if window != window else window
+            points._array[:length] = values
+            points._timestamps[:length] = timestamps
+            points._count = points._appended = length
+        else:
+            points = ArrayDataPoints.__new__(ArrayDataPoints)
+            points._id = id_
+            points._array = values
+            points._timestamps = timestamps
+            points._version = 0
+        data._datapoints = points
+        return data
+
+
+def _restore(buf):
+    """
+    Restore the documents saved in a buffer
+    """
+    if len(buf) < _HEADER.size:
+        raise ValueError("not a saved state")
+    magic, version, size, blobs = _HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise ValueError("not a saved state")
+    if version != VERSION:
+        raise ValueError("unsupported state version {}".format(version))
+    reader = _Reader(buf, blobs)
+    shape = reader._buf[reader._pos]
+    reader._pos += 1
+    docs = []
+    for i in xrange(reader._count()):
+        wrapped = reader._buf[reader._pos] == 'E'
+        reader._pos += 1
+        env = reader.environment()
+        docs.append(EEML(env) if wrapped else env)
+    return docs if shape == 'M' else docs[0]
+
+
+def load(fileobj, use_mmap=True):
+    """
+    Restore the documents saved by `dump`.
+
+    :raise ValueError: if the file was not written by `dump`
+
+    :param fileobj: the binary file, read from the current position to the
+        end. If it is a real file at its start it is memory mapped unless
+        use_mmap is false, otherwise it is read
+    :type fileobj: `file`
+    :param use_mmap: map the file into memory instead of reading it, so
+        the arrays are copied from the page cache into the restored
+        `ArrayDataPoints` without reading them into a string first
+    :type use_mmap: `bool`
+    :return: the documents, in the shape they were saved
+    :rtype: `EEML`, `Environment` or a `list` of them
+    """
+    fileno = getattr(fileobj, 'fileno', None)
+    # the map always starts at the beginning of the file
+    if use_mmap and fileno is not None and fileobj.tell() == 0:
+        try:
+            buf = mmap.mmap(fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            buf = None
+        if buf is not None:
+            try:
+                return _restore(buf)
+            finally:
+                buf.close()
+                # leave the file where read() would
+                fileobj.seek(0, os.SEEK_END)
+    return _restore(fileobj.read())
+
+
+def loads(text):
+    """
+    Restore the documents saved by `dumps`, see `load`.
+
+    :param text: the saved state
+    :type text: `str`
+    """
+    return _restore(text)
@@ -0,0 +1,118 @@
+"""
+Formatting of times as ISO 8601, used by all the serializers
+"""
+
+import time
+from datetime import date
+
+_SECONDS = ['%02d' % second for second in range(60)]
+
+
+class TimestampFormatter(object):
+    """
+    Format times exactly the way `datetime.isoformat` does.
+
+    `date` and `datetime` objects are formatted by their own `isoformat`,
+    which is implemented in C and is faster than anything assembled from
+    cached pieces in python. Naive datetimes are written without an offset
+    and aware ones with their own offset, as before.
+
+    Numbers are taken as seconds since the epoch and written as UTC with a
+    ``+00:00`` offset, the same text an aware UTC datetime gives. For these
+    the date and time up to the minute is computed once and reused by the
+    following values in the same minute.
+
+    A formatter may be shared between threads.
+    """
+
+    __slots__ = ('_last',)
+
+    def __init__(self):
+        self._last = (None, None)
+
+    def format(self, at):
+        """
+        Format a single time.
+
+        :param at: the time
+        :type at: `datetime`, `date` or seconds since the epoch
+        :return: the ISO 8601 text
+        :rtype: `str`
+        """
+        if isinstance(at, date):
+            return at.isoformat()
+        return self.format_epoch_us(int(round(at * 1000000)))
+
+    def format_epoch_us(self, us):
+        """
+        Format a time given in microseconds since the epoch.
+
+        :param us: the microseconds since the epoch
+        :type us: `int`
+        :return: the ISO 8601 text, in UTC
+        :rtype: `str`
+        """
+        us = int(us)
+        minute = us // 60000000
+        last, prefix = self._last
+        if minute != last:
+            prefix = time.strftime('%Y-%m-%dT%H:%M:',
+                                   time.gmtime(minute * 60))
+            self._last = (minute, prefix)
+        us -= minute * 60000000
+        second = us // 1000000
+        us -= second * 1000000
+        if us:
+            return '%s%s.%06d+00:00' % (prefix, _SECONDS[second], us)
+        return prefix + _SECONDS[second] + '+00:00'
+
+    def format_many(self, values):
+        """
+        Format a sequence of times.
+
+        :param values: the times
+        :type values: sequence of `datetime`, `date` or seconds since the epoch
+        :return: the ISO 8601 texts
+        :rtype: `list` of `str`
+        """
+        try:
+            return [at.isoformat() for at in values]
+        except AttributeError:
+            pass
+        fmt = self.format
+        return [fmt(at) for at in values]
+
+    def format_epoch_us_many(self, values):
+        """
+        Format a sequence of times given in microseconds since the epoch,
+        like an `ArrayDataPoints` stores them.
+
+        :param values: the microseconds since the epoch
+        :type values: sequence of numbers
+        :return: the ISO 8601 texts, in UTC
+        :rtype: `list` of `str`
+        """
+        result = []
+        append = result.append
+        last, prefix = self._last
+        for us in values:
+            us = int(us)
+            minute = us // 60000000
+            if minute != last:
+                last = minute
+                prefix = time.strftime('%Y-%m-%dT%H:%M:',
+                                       time.gmtime(minute * 60))
+            us -= minute * 60000000
+            second = us // 1000000
+            us -= second * 1000000
+            if us:
+                append('%s%s.%06d+00:00' % (prefix, _SECONDS[second], us))
+            else:
+                append(prefix + _SECONDS[second] + '+00:00')
+        self._last = (last, prefix)
+        return result
+
+
+default_formatter = TimestampFormatter()
+
+isoformat = default_formatter.format
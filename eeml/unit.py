@@ -2,13 +2,17 @@
 This package stores all the available implementations of Unit
 """
 
-from eeml.util import _elem, _addA
+from eeml.util import _elem, _addA, _strA, _leaf, _Slotted
 
-class Unit(object):
+class Unit(_Slotted):
     """
     This class represents a unit element in the EEML document.
     """
 
+    __slots__ = ('_name', '_type', '_symbol', '_cache')
+
+    _transient = {'_cache': lambda: None}
+
     __valid_types = ['basicSI', 'derivedSI', 'conversionBasedUnits',
                      'derivedUnits', 'contextDependentUnits']
 
@@ -30,6 +34,7 @@ class Unit(object):
                     ", ".join(['%s'%s for s in self.__valid_types]), type_))
         self._type = type_
         self._symbol = symbol
+        self._cache = None
 
     def toeeml(self):
         """
@@ -48,86 +53,106 @@ class Unit(object):
 
         return unit
 
+    def iter_bytes(self):
+        """
+        Serialize this object without building a DOM element.
+
+        :return: the byte chunks of the unit element
+        :rtype: generator of `str`
+        """
+
+        if self._cache is None:
+            self._cache = _leaf('unit', self._name,
+                                _strA(self._type, 'type') +
+                                _strA(self._symbol, 'symbol'))
+        yield self._cache
+
 
-class Celsius(Unit):
+class _StockUnit(Unit):
     """
-    Degree Celsius unit class.
+    Base of the predefined units. They are immutable, so constructing one
+    always returns the same shared instance.
     """
 
+    __slots__ = ()
+
+    # the arguments of Unit.__init__
+    _args = ()
+
+    def __new__(cls):
+        instance = cls.__dict__.get('_instance')
+        if instance is None:
+            instance = Unit.__new__(cls)
+            Unit.__init__(instance, *cls._args)
+            cls._instance = instance
+        return instance
+
     def __init__(self):
-        """
-        Initialize the `Unit` parameters with Celsius.
-        """
-        Unit.__init__(self, 'Celsius', 'derivedSI', u'\xb0C')
+        pass
+
+    def __reduce__(self):
+        # unpickled as the shared instance
+        return (type(self), ())
+
+
+class Celsius(_StockUnit):
+    """
+    Degree Celsius unit class.
+    """
+
+    __slots__ = ()
+    _args = ('Celsius', 'derivedSI', u'\xb0C')
 
-class Degree(Unit):
+
+class Degree(_StockUnit):
     """
     Degree of arc unit class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with Degree.
-        """
-        Unit.__init__(self, 'Degree', 'basicSI', u'\xb0')
+    __slots__ = ()
+    _args = ('Degree', 'basicSI', u'\xb0')
 
 
-class Fahrenheit(Unit):
+class Fahrenheit(_StockUnit):
     """
     Degree Fahrenheit unit class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with Fahrenheit.
-        """
-        Unit.__init__(self, 'Fahrenheit', 'derivedSI', u'\xb0F')
+    __slots__ = ()
+    _args = ('Fahrenheit', 'derivedSI', u'\xb0F')
 
 
-class hPa(Unit):
+class hPa(_StockUnit):
     """
     hPa unit class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with hPa.
-        """
-        Unit.__init__(self, 'hPa', 'derivedSI', 'hPa')
+    __slots__ = ()
+    _args = ('hPa', 'derivedSI', 'hPa')
 
 
-class Knots(Unit):
+class Knots(_StockUnit):
     """
     Knots class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with Knots.
-        """
-        Unit.__init__(self, 'Knots', 'conversionBasedUnits', u'kts')
+    __slots__ = ()
+    _args = ('Knots', 'conversionBasedUnits', u'kts')
 
 
-class RH(Unit):
+class RH(_StockUnit):
     """
     Relative Humidity unit class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with Relative Humidity.
-        """
-        Unit.__init__(self, 'Relative Humidity', 'derivedUnits', '%RH')
+    __slots__ = ()
+    _args = ('Relative Humidity', 'derivedUnits', '%RH')
 
 
-class Watt(Unit):
+class Watt(_StockUnit):
     """
     Watt unit class.
     """
 
-    def __init__(self):
-        """
-        Initialize the `Unit` parameters with Watt.
-        """
-        Unit.__init__(self, 'Watt', 'derivedSI', 'W')
-
+    __slots__ = ()
+    _args = ('Watt', 'derivedSI', 'W')
@@ -2,18 +2,78 @@
 Some utility functions, not for public use
 """
 
-try:
-    from lxml import etree
-except ImportError: # If lxml is not there try python standard lib
-    from xml.etree import ElementTree as etree
+import calendar
+import re
+import sys
+import zlib
+from array import array
+from datetime import date, datetime, timedelta, tzinfo
+
+from eeml import backend
+from eeml.metrics import timed
+from eeml.namespace import EEML_NAMESPACE, NSMAP, XSI_NAMESPACE
+
+_TEXT_ESCAPES = (('&', '&amp;'), ('<', '&lt;'), ('>', '&gt;'), ('\r', '&#13;'))
+_ATTR_ESCAPES = _TEXT_ESCAPES + (('"', '&quot;'), ('\n', '&#10;'),
+                                 ('\t', '&#9;'))
+_ROOT_NSDECL = ' xmlns:xsi="{}" xmlns="{}"'.format(XSI_NAMESPACE,
+                                                   EEML_NAMESPACE)
+# the attributes in the order toeeml adds them, lxml keeps it but the
+# standard library keeps attributes in a dict
+_ATTR_ORDER = dict((name, index) for (index, name) in enumerate((
+            '{{{}}}schemaLocation'.format(XSI_NAMESPACE), 'version',
+            'updated', 'creator', 'id', 'exposure', 'domain', 'disposition',
+            'minValue', 'maxValue', 'at', 'type', 'symbol')))
+
+def _slots(cls):
+    """
+    The names and descriptors of the slots of a class and its bases
+    """
+    for klass in cls.__mro__:
+        for name in klass.__dict__.get('__slots__', ()):
+            yield name, klass.__dict__[name]
+
+
+class _Slotted(object):
+    """
+    Pickling of classes with ``__slots__``, which have no ``__dict__`` to
+    pickle. The slots are pickled as a dict, except the ones in
+    `_transient`, like locks and caches, which are created again.
+    """
+
+    __slots__ = ()
+
+    # the slots not pickled, and the functions creating their values
+    _transient = {}
+
+    def __getstate__(self):
+        state = {}
+        for name, slot in _slots(type(self)):
+            if name not in self._transient:
+                try:
+                    state[name] = slot.__get__(self)
+                except AttributeError:
+                    # never set
+                    pass
+        return state
+
+    def __setstate__(self, state):
+        transient = self._transient
+        for name, slot in _slots(type(self)):
+            if name in state:
+                slot.__set__(self, state[name])
+            elif name in transient:
+                slot.__set__(self, transient[name]())
 
-from eeml.namespace import EEML_NAMESPACE, NSMAP
 
 def _elem(name):
     """
     Create an element in the EEML namespace
     """
-    return etree.Element("{{{}}}{}".format(EEML_NAMESPACE, name), nsmap=NSMAP)
+    tag = "{{{}}}{}".format(EEML_NAMESPACE, name)
+    if backend.name() == backend.LXML:
+        return backend.etree().Element(tag, nsmap=NSMAP)
+    return backend.etree().Element(tag)
 
 
 def _addE(env, attr, name, call=lambda x: x):
@@ -34,6 +94,259 @@ def _addA(env, attr, name, call=lambda x: x):
         env.attrib[name] = call(attr)
 
 
+def _utf8(text):
+    """
+    Return text as an UTF-8 encoded byte string
+    """
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+def _escape(text, escapes=_TEXT_ESCAPES):
+    """
+    Escape text the same way lxml does when serializing
+    """
+    text = _utf8(text)
+    for char, entity in escapes:
+        if char in text:
+            text = text.replace(char, entity)
+    return text
+
+
+def _strE(attr, name, call=lambda x: x):
+    """
+    Byte string counterpart of `_addE`, empty string if attr is None
+    """
+    if attr is None:
+        return ''
+    return _leaf(name, call(attr))
+
+
+def _strA(attr, name, call=lambda x: x):
+    """
+    Byte string counterpart of `_addA`, empty string if attr is None
+    """
+    if attr is None:
+        return ''
+    return ' {}="{}"'.format(name, _escape(call(attr), _ATTR_ESCAPES))
+
+
+def _leaf(name, text, attrs=''):
+    """
+    Serialize an element without children
+    """
+    if text is None:
+        return '<{}{}/>'.format(name, attrs)
+    return '<{0}{1}>{2}</{0}>'.format(name, attrs, _escape(text))
+
+
+def _qname(tag):
+    """
+    The serialized name of an element or attribute, EEML is the default
+    namespace
+    """
+    if tag[:1] == '{':
+        namespace, name = tag[1:].split('}', 1)
+        if namespace == EEML_NAMESPACE:
+            return name
+        if namespace == XSI_NAMESPACE:
+            return 'xsi:' + name
+    return tag
+
+
+def _attrKey(item):
+    """
+    Sort attributes in the order of `_ATTR_ORDER`, unknown ones last
+    """
+    return (_ATTR_ORDER.get(item[0], len(_ATTR_ORDER)), item[0])
+
+
+def _serialize(append, elem, attrs, level):
+    """
+    Serialize an element of any ElementTree implementation, indented if
+    level is not None
+    """
+    name = _qname(elem.tag)
+    attrs += ''.join(' {}="{}"'.format(_qname(key),
+                                       _escape(value, _ATTR_ESCAPES))
+                     for key, value in sorted(elem.items(), key=_attrKey))
+    children = list(elem)
+    text = elem.text
+    if level is not None and children and text is not None and \
+            not text.strip():
+        text = None
+    if not children and text is None:
+        append('<{}{}/>'.format(name, attrs))
+        return
+    append('<{}{}>'.format(name, attrs))
+    if text is not None:
+        append(_escape(text))
+    for child in children:
+        if level is None:
+            _serialize(append, child, '', None)
+            if child.tail:
+                append(_escape(child.tail))
+        else:
+            append('\n' + '  ' * (level + 1))
+            _serialize(append, child, '', level + 1)
+    if level is not None and children:
+        append('\n' + '  ' * level)
+    append('</{}>'.format(name))
+
+
+@timed('eeml_serialize_seconds', element='document', method='tostring')
+def _tostring(elem, pretty_print=False):
+    """
+    Serialize an element of the backend in use as UTF-8, without an XML
+    declaration. Both backends give the same bytes, the standard library is
+    not used for this because it cannot write EEML as the default namespace.
+    """
+    if backend.name() == backend.LXML:
+        return backend.etree().tostring(elem, encoding='UTF-8',
+                                        xml_declaration=False,
+                                        pretty_print=pretty_print)
+    chunks = []
+    _serialize(chunks.append, elem, _ROOT_NSDECL, 0 if pretty_print else None)
+    if pretty_print:
+        chunks.append('\n')
+    return ''.join(chunks)
+
+
+def _write(chunks, fileobj, bufsize=65536):
+    """
+    Write byte chunks into fileobj, joining them into writes of about
+    bufsize bytes
+    """
+    buf = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= bufsize:
+            fileobj.write(''.join(buf))
+            buf = []
+            size = 0
+    if buf:
+        fileobj.write(''.join(buf))
+
+
+class _FixedOffset(tzinfo):
+    """
+    A timezone with a fixed offset from UTC, python 2 has no builtin one
+    """
+
+    def __init__(self, minutes):
+        self._offset = timedelta(minutes=minutes)
+
+    def utcoffset(self, dt):
+        return self._offset
+
+    def tzname(self, dt):
+        return None
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def __repr__(self):
+        return '_FixedOffset({})'.format(
+            self._offset.days * 1440 + self._offset.seconds // 60)
+
+_utc = _FixedOffset(0)
+_EPOCH = datetime(1970, 1, 1, tzinfo=_utc)
+
+
+def _epochUs(at):
+    """
+    Convert a `datetime` or a number of seconds since the epoch to integer
+    microseconds since the epoch. Naive datetimes are taken as UTC.
+    """
+    if isinstance(at, datetime):
+        return (calendar.timegm(at.utctimetuple()) * 1000000 +
+                at.microsecond)
+    return int(round(at * 1000000))
+
+
+_ISO8601 = re.compile(r'(\d{4})-(\d\d)-(\d\d)'
+                      r'(?:T(\d\d):(\d\d)(?::(\d\d)(?:\.(\d+))?)?'
+                      r'(Z|([+-])(\d\d):?(\d\d))?)?$')
+
+
+def _parseDatetime(text):
+    """
+    Parse an ISO 8601 date or date and time, as written by `isoformat`.
+    Raise ValueError if text is not in this format.
+    """
+    match = _ISO8601.match(text.strip())
+    if match is None:
+        raise ValueError("Invalid ISO 8601 time: {}".format(text))
+    (year, month, day, hour, minute, second, fraction, zone, sign, tzh,
+     tzm) = match.groups()
+    if hour is None:
+        return date(int(year), int(month), int(day))
+    tz = None
+    if zone == 'Z':
+        tz = _utc
+    elif zone is not None:
+        offset = int(tzh) * 60 + int(tzm)
+        tz = _utc if offset == 0 else \
+            _FixedOffset(-offset if sign == '-' else offset)
+    return datetime(int(year), int(month), int(day), int(hour), int(minute),
+                    int(second or 0), int((fraction or '0')[:6].ljust(6, '0')),
+                    tz)
+
+
+def _fromEpochUs(us):
+    """
+    Convert microseconds since the epoch to an UTC `datetime`
+    """
+    return _EPOCH + timedelta(microseconds=us)
+
+
+def _ndarray(values):
+    """
+    Check if values is a NumPy array, NumPy is not imported for this
+    """
+    numpy = sys.modules.get('numpy')
+    return numpy is not None and isinstance(values, numpy.ndarray)
+
+
+def _doubles(values):
+    """
+    Convert a sequence of numbers into an `array` of doubles, NumPy arrays
+    are copied without going through python floats
+    """
+    if _ndarray(values):
+        return array('d', values.astype('d').tostring())
+    return array('d', values)
+
+
+def _epochUsArray(timestamps):
+    """
+    Convert a sequence of `datetime` objects or seconds since the epoch into
+    an `array` of microseconds since the epoch. The microseconds are stored
+    as doubles, which hold them exactly, because 64 bit integer arrays are
+    not available everywhere.
+    """
+    if _ndarray(timestamps):
+        if timestamps.dtype.kind == 'M':
+            timestamps = timestamps.astype('datetime64[us]').astype('int64')
+        else:
+            timestamps = (timestamps * 1000000.0).round()
+        return _doubles(timestamps)
+    return array('d', (_epochUs(at) for at in timestamps))
+
+
+def _gzip(chunks, level=6):
+    """
+    Compress byte chunks into a gzip stream, chunk by chunk
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    parts = [compressor.compress(chunk) for chunk in chunks]
+    parts.append(compressor.flush())
+    return ''.join(parts)
+
+
 def _assertPosInt(val, name, required=False):
     """
     Check if val is positive integer. If val is None ValueError is raised
@@ -9,6 +9,13 @@ from eeml.util import _assertPosInt
 
 import logging
 
+_STATUSES = frozenset(['frozen', 'live'])
+_EXPOSURES = frozenset(['indoor', 'outdoor'])
+_DOMAINS = frozenset(['physical', 'virtual'])
+_DISPOSITIONS = frozenset(['fixed', 'mobile'])
+_INTS = frozenset([int])
+
+
 class Version051(object):
     """
     Validate constructors by version 0.5.1 specification
@@ -19,10 +26,11 @@ class Version051(object):
         id_ = env._id
         private = env._private
         
-        if status is not None and status not in ['frozen', 'live']:
+        if status is not None and status not in _STATUSES:
             raise ValueError("status must be either 'frozen' or 'live', "
                              "got {}".format(status))
-        _assertPosInt(id_, 'id', False)
+        if type(id_) is not int or id_ < 0:
+            _assertPosInt(id_, 'id', False)
         if private is not None and not isinstance(private, bool):
             raise ValueError("private is expected to be bool, got {}"
                              .format(type(private)))
@@ -33,15 +41,15 @@ class Version051(object):
         disposition = loc._disposition
         # TODO validate lat and lon
 
-        if exposure is not None and exposure not in ['indoor', 'outdoor']:
+        if exposure is not None and exposure not in _EXPOSURES:
             raise ValueError("exposure must be 'indoor' or 'outdoor', got '{}'"
                              .format(exposure))
 
-        if domain not in ['physical', 'virtual']:
+        if domain not in _DOMAINS:
             raise ValueError("domain is required, must be 'physical' or 'virtual', got '{}'"
                              .format(domain))
 
-        if disposition is not None and disposition not in ['fixed', 'mobile']:
+        if disposition is not None and disposition not in _DISPOSITIONS:
             raise ValueError("disposition must be 'fixed' or 'mobile', got '{}'"
                              .format(disposition))
 
@@ -50,7 +58,8 @@ class Version051(object):
         at = data._at
         id_ = data._id
 
-        _assertPosInt(id_, 'id', True)
+        if type(id_) is not int or id_ < 0:
+            _assertPosInt(id_, 'id', True)
         if unit is not None and not isinstance(unit, Unit):
             raise ValueError("unit must be an instance of Unit, got {}"
                              .format(type(unit)))
@@ -61,6 +70,44 @@ class Version051(object):
     def datapoints(self, datapoints):
         id_ = datapoints._id
 
-        _assertPosInt(id_, 'id', True)
+        if type(id_) is not int or id_ < 0:
+            _assertPosInt(id_, 'id', True)
+
+    def data_batch(self, ids, units, ats):
+        """
+        Validate the attributes of many `Data` at once, same as calling
+        `data` on each, in a few passes over the lists instead of a call
+        per object.
+
+        :param ids: the ids
+        :type ids: `list`
+        :param units: the units, a unit shared by many may be given once
+        :type units: `list`
+        :param ats: the times, a time shared by many may be given once
+        :type ats: `list`
+        """
+        if ids and (set(map(type, ids)) != _INTS or min(ids) < 0):
+            for id_ in ids:
+                _assertPosInt(id_, 'id', True)
+        for kind in set(map(type, units)):
+            if kind is not type(None) and not issubclass(kind, Unit):
+                raise ValueError("unit must be an instance of Unit, got {}"
+                                 .format(kind))
+        for kind in set(map(type, ats)):
+            if kind is not type(None) and not issubclass(kind, datetime):
+                raise ValueError("at must be an instance of "
+                                 "datetime.datetime, got {}".format(kind))
+
+    def validate_many(self, datas):
+        """
+        Validate a list of `Data` and their datapoints, same as calling
+        `data` and `datapoints` on each.
+        """
+        check = self.data
+        checkPoints = self.datapoints
+        for data in datas:
+            check(data)
+            if data._datapoints is not None:
+                checkPoints(data._datapoints)
 
 Validator = Version051
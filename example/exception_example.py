@@ -1,6 +1,10 @@
+import sys
+
 import eeml
 import eeml.datastream
+import eeml.ingest
 import eeml.unit
+import eeml.spool
 import serial
 from eeml.datastream import CosmError
 
@@ -9,17 +13,26 @@ API_KEY = 'YOUR PERSONAL API KEY'
 FEED = 'YOUR PERSONAL FEED ID'
 API_URL = '/v2/feeds/{feednum}.xml' .format(feednum = FEED)
 
+# the readings are separated by spaces, a temperature and a humidity
+fmt = eeml.ingest.SplitFormat([
+        eeml.ingest.Field(0, eeml.unit.Celsius()),
+        eeml.ingest.Field(1, eeml.unit.RH())])
+
 serial = serial.Serial('/dev/ttyUSB0', 9600)
-readings = serial.readline().strip().split(' ') # the readings are separated by spaces
 
-# open up your cosm feed
-pac = eeml.datastream.Cosm(API_URL, API_KEY)
+# open up your cosm feed, retry failed puts and keep what could not be sent
+# in a local file until the next put
+pac = eeml.datastream.Cosm(API_URL, API_KEY, retry=eeml.spool.Backoff(),
+                           spool=eeml.spool.Spool('cosm-spool.db'))
 
-# prepare the emml payload
-pac.update([eeml.Data(0, readings[0], unit=eeml.unit.Celsius()), eeml.Data(1, readings[1], unit=eeml.unit.RH())])
+# prepare the emml payload, the server sets the time of the readings
+try:
+	pac.update(fmt.parse(serial.readline().strip(), None))
+except ValueError, e:
+	print('ERROR: cannot parse the readings: {}'.format(e))
+	sys.exit(1)
 
 # attempt to send the data to Cosm.  Attempt to handle exceptions, such that the script continues running.
-# You could optionally place some retry logic around the pac.put() command.
 try:
 	pac.put()
 except CosmError, e:
@@ -1,5 +1,8 @@
-import eeml
+import time
+
 import eeml.datastream
+import eeml.ingest
+import eeml.spool
 import eeml.unit
 import serial
 
@@ -7,10 +10,30 @@ import serial
 API_KEY = 'YOUR PERSONAL API KEY'
 API_URL = 'YOUR PERSONAL API URL, LIKE /api/1275.xml'
 
-serial = serial.Serial('/dev/ttyUSB0', 9600)
-readings = serial.readline().strip().split(' ') # the readings are separated by spaces
-pac = eeml.datastream.Cosm(API_URL, API_KEY)
-pac.update([eeml.Data(0, readings[0], unit=eeml.unit.Celsius()), eeml.Data(1, readings[1], unit=eeml.unit.RH())])
-print(pac.geteeml())
-pac.put()
+# the readings are separated by spaces, a temperature and a humidity
+fmt = eeml.ingest.SplitFormat([
+        eeml.ingest.Field(0, eeml.unit.Celsius()),
+        eeml.ingest.Field(1, eeml.unit.RH())])
+
+# put the readings from a background thread every minute, keep what could
+# not be sent in a local file
+pac = eeml.datastream.BufferedCosm(
+    API_URL, API_KEY, interval=60, retry=eeml.spool.Backoff(),
+    spool=eeml.spool.Spool('cosm-spool.db'),
+    policy=eeml.datastream.BufferedCosm.DROP_OLDEST)
+
+# read the serial port on another thread, so slow uploads do not make it
+# lose input
+port = serial.Serial('/dev/ttyUSB0', 9600, timeout=1)
+reader = eeml.ingest.LineReader(port, fmt, pac)
+reader.start()
 
+try:
+    while True:
+        time.sleep(60)
+        print('{} lines, {} errors, last upload error: {}'.format(
+                reader.lines, reader.errors, pac.last_error))
+except KeyboardInterrupt:
+    reader.stop()
+    reader.join()
+    pac.close()
@@ -14,14 +14,21 @@ setup(
     download_url="https://github.com/petervizi/python-eeml/zipball/{}".format(VERSION),
     description="Python support for the Extended Environments Markup Language",
     license="GPLv3",
-    install_requires = [
-        'lxml',
-    ],
+    extras_require = {
+        'lxml': ['lxml'],
+        'aio': [
+            'futures; python_version < "3"',
+            'trollius; python_version < "3"',
+        ],
+    },
     test_suite = 'nose.collector',
     tests_require = [
+        'lxml',
         'nose',
         'formencode',
-        'pytz'
+        'pytz',
+        'futures; python_version < "3"',
+        'trollius; python_version < "3"',
     ],
     zip_safe = False,
     include_package_data = True,
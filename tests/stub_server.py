@@ -0,0 +1,81 @@
+"""
+A local HTTP server standing in for the Cosm API in the tests
+"""
+
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Record the requests and answer with the next queued response
+    """
+
+    protocol_version = 'HTTP/1.1'
+    # send each response at once, without waiting for delayed ACKs
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active,
+                                         self.server.active)
+        time.sleep(self.server.delay)
+        with self.server.lock:
+            self.server.active -= 1
+            self.server.requests.append((self.command, self.path,
+                                         dict(self.headers), body))
+            if self.server.responses:
+                status, payload = self.server.responses.pop(0)
+            else:
+                status, payload = 200, ''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.server.drop_connections:
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Serve on a free local port from a background thread
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), StubHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = []
+        self.responses = []
+        # seconds to wait before answering, and the number of requests
+        # being answered
+        self.delay = 0
+        self.active = 0
+        self.max_active = 0
+        # close connections without telling the client, like a server
+        # dropping idle keep-alive connections
+        self.drop_connections = False
+        self.host = '127.0.0.1:{}'.format(self.server_address[1])
+        thread = threading.Thread(target=self.serve_forever,
+                                  args=(0.05,))
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
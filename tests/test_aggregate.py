@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from functools import wraps
+from unittest import TestCase
+
+from eeml import aggregate
+from eeml.aggregate import Aggregator, buckets, lttb
+from eeml.unit import Celsius
+
+
+def both(test):
+    """
+    Run a test with and without NumPy
+    """
+    @wraps(test)
+    def wrapper(self):
+        test(self)
+        numpy = aggregate._numpy
+        aggregate._numpy = lambda: None
+        try:
+            test(self)
+        finally:
+            aggregate._numpy = numpy
+    return wrapper
+
+
+class TestAggregate(TestCase):
+
+    @both
+    def test_buckets(self):
+        stamps = [0, 0.5, 1, 1.2, 1.9, 5]
+        values = [1, 3, 2, 8, 5, 7]
+        self.assertEqual(map(list, buckets(values, stamps, 1)),
+                         [[2, 5, 7], [0, 1000000, 5000000]])
+        self.assertEqual(list(buckets(values, stamps, 1, 'min')[0]),
+                         [1, 2, 7])
+        self.assertEqual(list(buckets(values, stamps, 1, 'max')[0]),
+                         [3, 8, 7])
+        self.assertEqual(list(buckets(values[::-1], stamps[::-1],
+                                      timedelta(seconds=2), 'last')[0]),
+                         [5, 7])
+        self.assertEqual(map(list, buckets([], [], 1)), [[], []])
+        with self.assertRaises(ValueError):
+            buckets(values, stamps, 1, 'median')
+        with self.assertRaises(ValueError):
+            buckets(values, stamps[1:], 1)
+
+    @both
+    def test_lttb(self):
+        values = [0, 1, 0, 0, 9, 0, 0, 1, 0, 2]
+        kept, times = lttb(values, range(10), 4)
+        self.assertEqual(list(kept), [0, 9, 0, 2])
+        self.assertEqual(list(times), [0, 4000000, 5000000, 9000000])
+        self.assertEqual(list(lttb(values, range(10), 20)[0]), values)
+
+    @both
+    def test_aggregator(self):
+        agg = Aggregator(10)
+        agg.describe(1, ['temperature'], Celsius())
+        start = datetime(2012, 9, 12, 11)
+        for i in range(30):
+            agg.add(1, i, start + timedelta(seconds=i))
+        agg.extend(2, [5, 1], [1347447600, 1347447599])
+        first, second = agg.flush()
+        self.assertEqual(agg.flush(), [])
+
+        self.assertEqual((first._value, first._minValue, first._maxValue),
+                         (29, 0, 29))
+        self.assertEqual(first._tags, ['temperature'])
+        self.assertIs(first._unit, Celsius())
+        self.assertEqual(first._at.replace(tzinfo=None),
+                         start + timedelta(seconds=29))
+        self.assertEqual(list(first._datapoints._array), [4.5, 14.5, 24.5])
+        self.assertEqual(second._value, 5)
+
+        agg.extend(1, [], [])
+        self.assertEqual(agg.flush(), [])
+        agg.extend(1, [], [])
+        agg.extend(1, [3], [1347447600])
+        self.assertEqual(agg.flush()[0]._value, 3)
+
+        agg = Aggregator(how='lttb', threshold=3)
+        agg.extend(1, range(10), range(10))
+        self.assertEqual(len(agg.flush()[0]._datapoints), 3)
+        with self.assertRaises(ValueError):
+            Aggregator(how='lttb')
+        with self.assertRaises(ValueError):
+            Aggregator()
@@ -0,0 +1,338 @@
+from unittest import TestCase, skipIf
+
+from eeml import Data
+from eeml.datastream import Cosm, CosmError, ConnectionPool
+
+from stub_server import StubServer
+
+try:
+    from eeml.aio import AsyncCosm, asyncio, update_many
+except ImportError:
+    asyncio = None
+
+
+class TestCosm(TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+
+    def cosm(self, feed=1, cls=Cosm, **kwargs):
+        cosm = cls(feed, 'ASDF', use_https=False, pool=self.pool, **kwargs)
+        cosm.host = self.server.host
+        return cosm
+
+    def test_put(self):
+        cosm = self.cosm()
+        cosm.update(Data(1, 10))
+        cosm.put()
+        method, path, headers, body = self.server.requests[0]
+        self.assertEqual((method, path), ('PUT', '/v2/feeds/1.xml'))
+        self.assertEqual(headers['x-apikey'], 'ASDF')
+        self.assertEqual(body, cosm.geteeml(False))
+
+    def test_error(self):
+        self.server.responses.append((401, """<?xml version="1.0"?>
+<errors><title>Unauthorized</title><error>Bad key</error></errors>"""))
+        with self.assertRaises(CosmError) as cm:
+            self.cosm().put(full=True)
+        self.assertEqual(str(cm.exception), 'Unauthorized: Bad key')
+
+    def test_connection_reuse(self):
+        first, second = self.cosm(1), self.cosm(2)
+        for i in range(3):
+            first.put(full=True)
+            second.put(full=True)
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_stale_connection(self):
+        cosm = self.cosm()
+        self.server.drop_connections = True
+        cosm.put(full=True)
+        cosm.put(full=True)
+        self.server.drop_connections = False
+        self.pool.idle_timeout = 0
+        cosm.put(full=True)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(self.server.connections, 3)
+
+    @skipIf(asyncio is None, 'asyncio is not available')
+    def test_async_put(self):
+        self.server.responses.append((500, ''))
+        feeds = [self.cosm(i, cls=AsyncCosm) for i in range(1, 5)]
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            results = loop.run_until_complete(update_many(
+                    [(cosm, Data(1, 10)) for cosm in feeds]))
+        finally:
+            loop.close()
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertEqual(len([r for r in results if r is None]), 3)
+        self.assertEqual([type(r) for r in results if r is not None],
+                         [CosmError])
+
+    @skipIf(asyncio is None, 'asyncio is not available')
+    def test_async_put_full(self):
+        from concurrent.futures import ThreadPoolExecutor
+        executor = ThreadPoolExecutor(max_workers=1)
+        cosm = self.cosm(cls=AsyncCosm, executor=executor,
+                         dat=[Data(i, i) for i in range(3)])
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(cosm.put())
+            cosm.update(Data(1, 10))
+            loop.run_until_complete(cosm.put())
+            loop.run_until_complete(cosm.put(full=True))
+        finally:
+            loop.close()
+            executor.shutdown()
+
+        bodies = [request[3] for request in self.server.requests]
+        self.assertEqual(len(bodies), 3)
+        self.assertTrue(bodies[1].endswith(
+                '<environment><data id="1"><current_value>10'
+                '</current_value></data></environment></eeml>'))
+        self.assertEqual(bodies[0].count('<data '), 3)
+        self.assertEqual(bodies[2], cosm.geteeml(False))
+
+    def test_buffered(self):
+        from datetime import datetime
+        from eeml import DataPoints, fromstring
+        from eeml.datastream import BufferedCosm
+        at = datetime(2012, 9, 12, 11, 0, 0)
+        cosm = self.cosm(cls=BufferedCosm, batch_size=4, interval=60)
+        cosm.update([Data(1, 10, at=at), Data(2, 20, at=at)])
+        cosm.update(Data(1, 11, at=at))
+        self.assertEqual(self.server.requests, [])
+        cosm.update(DataPoints(2, [(21, at)]))
+        cosm.close()
+
+        self.assertEqual(len(self.server.requests), 1)
+        env = fromstring(self.server.requests[0][3])._environment
+        self.assertEqual(env._data[1]._value, 11)
+        self.assertEqual([p[0] for p in env._data[1]._datapoints._values],
+                         [10, 11])
+        self.assertEqual([p[0] for p in env._data[2]._datapoints._values],
+                         [20, 21])
+        self.assertEqual(cosm._eeml._environment._data[1]._datapoints, None)
+        with self.assertRaises(ValueError):
+            cosm.update(Data(1, 12))
+
+    def test_buffered_without_time(self):
+        from eeml import DataPoints, fromstring
+        from eeml.datastream import BufferedCosm
+        cosm = self.cosm(cls=BufferedCosm, interval=60)
+        cosm.update(Data(1, 5))
+        cosm.update(DataPoints(1, [(6,), (7, None)]))
+        cosm.flush()
+        cosm.close()
+
+        self.assertEqual(len(self.server.requests), 1)
+        data = fromstring(self.server.requests[0][3])._environment._data[1]
+        self.assertEqual([pair[0] for pair in data._datapoints._values],
+                         [5, 6, 7])
+        self.assertTrue(all(len(pair) == 2
+                            for pair in data._datapoints._values))
+        self.assertEqual(data._at, data._datapoints._values[-1][1])
+
+    def test_buffered_drop_oldest(self):
+        from eeml.datastream import BufferedCosm
+        self.server.responses.append((500, ''))
+        cosm = self.cosm(cls=BufferedCosm, maxsize=2, interval=60,
+                         policy=BufferedCosm.DROP_OLDEST)
+        cosm.update([Data(1, 1), Data(1, 2), Data(1, 3)])
+        self.assertEqual(cosm.dropped, 1)
+        with self.assertRaises(CosmError):
+            cosm.flush()
+        self.assertEqual(len(cosm._pending), 2)
+        cosm.close()
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(len(cosm._pending), 0)
+
+    def test_retry(self):
+        from eeml.spool import Backoff
+        delays = []
+        cosm = self.cosm(retry=Backoff(retries=3, base=1, maximum=3))
+        cosm._sleep = delays.append
+        self.server.responses.extend([(500, ''), (503, '')])
+        cosm.put(full=True)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0 <= delays[0] <= 1 and 0 <= delays[1] <= 2)
+
+        self.server.responses.append((401, ''))
+        with self.assertRaises(CosmError) as cm:
+            cosm.put(full=True)
+        self.assertEqual(cm.exception.status, 401)
+        self.assertEqual(len(self.server.requests), 4)
+
+    def test_spool(self):
+        from eeml.spool import Backoff, Spool
+        spool = Spool(':memory:')
+        cosm = self.cosm(retry=Backoff(retries=1), spool=spool)
+        cosm._sleep = lambda delay: None
+        self.server.responses.extend([(500, '')] * 3)
+        for value in (1, 2):
+            cosm.update(Data(1, value))
+            cosm.put()
+        # the second document is spooled behind the first without sending
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(len(self.server.requests), 3)
+
+        cosm.replay_batch = 1
+        cosm.update(Data(1, 3))
+        cosm.put()
+        cosm.put(full=True)
+        self.assertEqual(len(spool), 2)
+        cosm.replay_batch = 10
+        cosm.put(full=True)
+        self.assertEqual(len(spool), 0)
+        bodies = [request[3] for request in self.server.requests[3:]]
+        self.assertEqual([b.count('<current_value>{}<'.format(v))
+                          for b, v in zip(bodies, (1, 2, 3, 3, 3))],
+                         [1, 1, 1, 1, 1])
+        self.assertEqual(len(bodies), 5)
+
+    def test_spool_idle(self):
+        from eeml.spool import Spool
+        spool = Spool(':memory:')
+        cosm = self.cosm(spool=spool)
+        self.server.responses.append((500, ''))
+        cosm.update(Data(1, 1))
+        cosm.put()
+        self.assertEqual(len(spool), 1)
+        cosm.put()
+        cosm.put()
+        self.assertEqual(len(spool), 0)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.server.requests[1][3],
+                         self.server.requests[0][3])
+
+    def test_spool_order(self):
+        from eeml import fromstring
+        from eeml.spool import Spool
+        spool = Spool(':memory:')
+        cosm = self.cosm(spool=spool)
+        statuses = [500, 500, 200, 200, 500]
+        self.server.responses.extend((status, '') for status in statuses)
+        for value in (1, 2, 3):
+            cosm.update(Data(1, value))
+            cosm.put()
+        self.assertEqual(len(spool), 1)
+        cosm.update(Data(1, 4))
+        cosm.put()
+        self.assertEqual(len(spool), 0)
+
+        # the values the server accepted, the feed ends on the newest
+        statuses += [200] * (len(self.server.requests) - len(statuses))
+        accepted = [fromstring(request[3])._environment._data[1]._value
+                    for request, status in zip(self.server.requests,
+                                               statuses) if status == 200]
+        self.assertEqual(accepted, sorted(accepted))
+        self.assertEqual(accepted[-1], 4)
+
+    def test_spool_limit(self):
+        from eeml.spool import Spool
+        spool = Spool(':memory:', max_bytes=10)
+        for body in ('aaaa', 'bbbb', 'cccc'):
+            spool.append('/v2/feeds/1.xml', body)
+        self.assertEqual(spool.dropped, 1)
+        self.assertEqual(spool.size(), 8)
+        self.assertEqual([body for id_, body in
+                          spool.peek('/v2/feeds/1.xml', 5)], ['bbbb', 'cccc'])
+        self.assertEqual(spool.peek('/v2/feeds/2.xml', 5), [])
+
+    def test_delta(self):
+        from eeml import Environment
+        cosm = self.cosm(env=Environment('title', id_=7),
+                         dat=[Data(i, i) for i in range(3)])
+        first = cosm.geteeml(False)
+        cosm.put()
+        cosm.put()
+        cosm.update([Data(1, 10), Data(2, 20)])
+        self.server.responses.append((500, ''))
+        with self.assertRaises(CosmError):
+            cosm.put()
+        cosm.put()
+        cosm.put(full=True)
+
+        bodies = [request[3] for request in self.server.requests]
+        self.assertEqual(len(bodies), 4)
+        self.assertEqual(bodies[0], first)
+        self.assertEqual(bodies[2], bodies[1])
+        self.assertTrue(bodies[1].endswith(
+                '<environment id="7"><data id="1"><current_value>10'
+                '</current_value></data><data id="2"><current_value>20'
+                '</current_value></data></environment></eeml>'))
+        self.assertEqual(bodies[3], cosm.geteeml(False))
+
+    def test_delta_environment_changes(self):
+        from eeml import Environment, Location
+        env = Environment('title', id_=7)
+        cosm = self.cosm(env=env, dat=[Data(i, i) for i in range(3)])
+        cosm.put()
+        env.updateData(Data(2, 20))
+        cosm.put()
+        env.setLocation(Location('physical', 'here'))
+        cosm.put()
+        cosm.put()
+        env.setMetadata(status='frozen')
+        cosm.put()
+
+        bodies = [request[3] for request in self.server.requests]
+        self.assertEqual(len(bodies), 4)
+        self.assertTrue(bodies[1].endswith(
+                '<environment id="7"><data id="2"><current_value>20'
+                '</current_value></data></environment></eeml>'))
+        self.assertIn('<name>here</name>', bodies[2])
+        self.assertIn('<data id="0">', bodies[2])
+        self.assertEqual(bodies[3], cosm.geteeml(False))
+        self.assertIn('<status>frozen</status>', bodies[3])
+
+    def test_ring_acknowledge(self):
+        from eeml import RingDataPoints
+        points = RingDataPoints(1, 10)
+        cosm = self.cosm(dat=[Data(1, None, datapoints=points), Data(2, 2)])
+        points.extend([1, 2], [10, 11])
+        cosm.put()
+        self.assertEqual(len(points), 0)
+        cosm.put()
+        points.append(3, 12)
+        self.server.responses.append((500, ''))
+        with self.assertRaises(CosmError):
+            cosm.put()
+        self.assertEqual(len(points), 1)
+        cosm.put()
+        self.assertEqual(len(points), 0)
+
+        bodies = [request[3] for request in self.server.requests]
+        self.assertEqual(len(bodies), 3)
+        self.assertIn('<value at="1970-01-01T00:00:11+00:00">2.0</value>',
+                      bodies[0])
+        self.assertEqual(bodies[1], bodies[2])
+        self.assertTrue(bodies[2].endswith(
+                '<environment><data id="1"><datapoints><value at="1970-01-01'
+                'T00:00:12+00:00">3.0</value></datapoints></data>'
+                '</environment></eeml>'))
+
+    def test_gzip(self):
+        import zlib
+        from eeml.spool import Spool
+        cosm = self.cosm(compresslevel=9, spool=Spool(':memory:'),
+                         dat=[Data(i, i) for i in range(100)])
+        self.server.responses.append((500, ''))
+        cosm.put()
+        cosm.put(full=True)
+        for method, path, headers, body in self.server.requests:
+            self.assertEqual(headers['content-encoding'], 'gzip')
+            self.assertEqual(zlib.decompress(body, 31), cosm.geteeml(False))
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertTrue(len(self.server.requests[0][3]) <
+                        len(cosm.geteeml(False)) / 4)
@@ -1,3 +1,6 @@
+import os
+import subprocess
+import sys
 from datetime import datetime
 import pytz
 
@@ -9,10 +12,34 @@ from nose.tools import assert_true
 
 from eeml import Location, EEML, Environment, Data, DataPoints, create_eeml
 from eeml.datastream import Cosm, Pachube
+from eeml.timestamp import TimestampFormatter
 from eeml.unit import Celsius, Unit, RH
 
 from unittest import TestCase
 
+class Checks(object):
+    """
+    A validator without data_batch and validate_many
+    """
+
+    def __init__(self):
+        self.checked = []
+
+    def environment(self, env):
+        pass
+
+    def location(self, loc):
+        pass
+
+    def data(self, data):
+        self.checked.append(data._id)
+        if data._value < 0:
+            raise ValueError("negative")
+
+    def datapoints(self, datapoints):
+        self.checked.append(('points', datapoints._id))
+
+
 class TestEEML(TestCase):
 
     def test_good_location(self):
@@ -347,3 +374,495 @@ class TestEEML(TestCase):
         eeml.validator = Invalidator()
         env = Environment(status='foobar')
         eeml.validator = oldvalidator
+
+    def test_iter_bytes(self):
+        env = Environment('A Room & Somewhere', private=True, id_=1,
+                          updated=datetime(2007, 5, 4, 18, 13, 51, 0, pytz.utc))
+        env.setLocation(Location('physical', u'<R\xf6om "1">', 32.4, 22.7,
+                                 exposure='indoor'))
+        doc = create_eeml(env, None, [
+                Data(0, 36.2, tags=['a\tb'], minValue=0, unit=Celsius(),
+                     at=datetime(2012, 9, 12, 11, 0, 0)),
+                Data(1, None),
+                Data(2, 'x', unit=Unit(None, 'basicSI')),
+                DataPoints(2, [(0,), (1, datetime(2012, 9, 12, 11, 0, 0, 5))]),
+                DataPoints(3, [])])
+
+        self.assertEqual(etree.tostring(doc.toeeml(), encoding='UTF-8'),
+                         ''.join(doc.iter_bytes()))
+        self.assertEqual(etree.tostring(EEML(Environment()).toeeml(),
+                                        encoding='UTF-8'),
+                         ''.join(EEML(Environment()).iter_bytes()))
+
+    def test_write_to(self):
+        from StringIO import StringIO
+        pac = Cosm(1, 'ASDF')
+        pac.update(DataPoints(1, [(i,) for i in range(5000)]))
+        out = StringIO()
+        pac.write_eeml(out)
+        self.assertEqual(out.getvalue(), etree.tostring(
+                pac._eeml.toeeml(), encoding='UTF-8'))
+        self.assertEqual(out.getvalue(), pac.geteeml(False))
+
+    def test_array_datapoints(self):
+        at = datetime(2012, 9, 12, 11, 0, 0, tzinfo=pytz.utc)
+        stamps = [at, datetime(2012, 9, 12, 11, 0, 59, 250), 1347447660.5]
+        points = DataPoints.from_arrays(1, [1, 2.5, -3], stamps)
+        expected = DataPoints(1, points._values)
+        self.assertEqual(
+            ''.join(expected.iter_bytes()),
+            '<datapoints><value at="2012-09-12T11:00:00+00:00">1.0</value>'
+            '<value at="2012-09-12T11:00:59.000250+00:00">2.5</value>'
+            '<value at="2012-09-12T11:01:00.500000+00:00">-3.0</value>'
+            '</datapoints>')
+        self.assertEqual(''.join(points.iter_bytes(batch=2)),
+                         ''.join(expected.iter_bytes()))
+        self.assertEqual(etree.tostring(points.toeeml()),
+                         etree.tostring(expected.toeeml()))
+
+        points.append(4, at)
+        points.extend([5, 6], [at, at])
+        self.assertEqual(len(points), 6)
+        with self.assertRaises(ValueError):
+            points.extend([7])
+        with self.assertRaises(ValueError):
+            DataPoints.from_arrays(1, [1, 2], [at])
+        with self.assertRaises(ValueError):
+            DataPoints.from_arrays('foobar', [1])
+
+        env = Environment()
+        env.updateData(DataPoints.from_arrays(2, [1, 2]))
+        self.assertEqual(''.join(env.iter_bytes()),
+                         '<environment><data id="2"><datapoints>'
+                         '<value>1.0</value><value>2.0</value>'
+                         '</datapoints></data></environment>')
+
+    def test_parse(self):
+        from eeml import fromstring
+        env = Environment('A Room & Somewhere', status='live', private=False,
+                          id_=1, updated=datetime(2007, 5, 4, 18, 13, 51, 0,
+                                                  pytz.utc))
+        env.setLocation(Location('physical', 'My Room', 32.4, 22.7,
+                                 exposure='indoor'))
+        doc = create_eeml(env, None, [
+                Data(0, 36.2, tags=['temperature', 'inside'], minValue=0,
+                     unit=Celsius(), at=datetime(2012, 9, 12, 11, 0, 0)),
+                Data(1, 10, unit=Unit('Count')),
+                DataPoints(1, [(0,), (1.5, datetime(2012, 9, 12, 11, 0, 0, 5,
+                                                    pytz.utc))])])
+        text = ''.join(doc.iter_bytes())
+
+        parsed = fromstring(text)
+        self.assertEqual(''.join(parsed.iter_bytes()), text)
+        self.assertEqual(parsed._environment._data[0]._value, 36.2)
+        self.assertEqual(parsed._environment._private, False)
+
+        lazy = fromstring(text, lazy=True)
+        points = lazy._environment._data[1]._datapoints
+        self.assertEqual(list(points), [(0,), (1.5, datetime(
+                        2012, 9, 12, 11, 0, 0, 5, pytz.utc))])
+        self.assertEqual(''.join(lazy.iter_bytes()), text)
+
+        for text in ('<eeml><environment><data id="x"/></environment></eeml>',
+                     '<eeml><environment><data/></environment></eeml>',
+                     '<eeml><environment>', '', 'not xml'):
+            with self.assertRaises(ValueError):
+                fromstring(text)
+
+    def test_iter_bytes_without_data(self):
+        for env in (Environment(title='Room'), Environment()):
+            self.assertEqual(''.join(env.iter_bytes()),
+                             etree.tostring(env.toeeml()).replace(
+                    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                    ' xmlns="http://www.eeml.org/xsd/0.5.1"', ''))
+        env = Environment(title='Room')
+        env.setLocation(Location('physical', 'My Room'))
+        doc = EEML(env)
+        self.assertEqual(''.join(doc.iter_bytes()),
+                         etree.tostring(doc.toeeml()))
+        cosm = Cosm(1, 'ASDF', env=Environment(title='Room'))
+        self.assertIn('<title>Room</title></environment>',
+                      cosm.geteeml(False))
+
+    def test_fragment_cache(self):
+        env = Environment()
+        env.updateData([Data(i, i, unit=RH()) for i in range(200)])
+        points = DataPoints.from_arrays(1, [1])
+        env.updateData(points)
+        first = ''.join(env.iter_bytes())
+        cached = dict((i, env._data[i]._cache) for i in range(200))
+
+        env.updateData([Data(0, 'changed'), DataPoints(2, [(5,)])])
+        points.append(2)
+        second = ''.join(env.iter_bytes())
+
+        self.assertEqual(second, etree.tostring(env.toeeml()).replace(
+                ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+                ' xmlns="http://www.eeml.org/xsd/0.5.1"', ''))
+        self.assertNotEqual(first, second)
+        for i in range(3, 200):
+            self.assertIs(env._data[i]._cache, cached[i])
+        for i in range(3):
+            self.assertIsNot(env._data[i]._cache, cached[i])
+
+    def test_fragment_cache_list(self):
+        # a list given to DataPoints may be changed in place
+        values = [(1,)]
+        cosm = Cosm(1, 'ASDF', dat=[Data(1, None, datapoints=DataPoints(
+                        1, values))])
+        first = cosm.geteeml(False)
+        values.append((2,))
+        second = cosm.geteeml(False)
+        self.assertNotEqual(first, second)
+        self.assertIn('<value>2</value>', second)
+        self.assertEqual(cosm.geteeml(True).count('<value>'), 2)
+
+    def test_pickle(self):
+        import pickle
+        from eeml import RingDataPoints
+        env = Environment('Room', status='live', id_=1)
+        env.setLocation(Location('physical', 'My Room'))
+        points = RingDataPoints(2, 10)
+        points.extend([1, 2], [10, 11])
+        env.updateData([Data(0, 36.2, tags=['a'], unit=Celsius()),
+                        Data(1, None, datapoints=DataPoints(1, [(1,)])),
+                        Data(2, None, datapoints=points),
+                        Data(3, None,
+                             datapoints=DataPoints.from_arrays(3, [1.5]))])
+        doc = EEML(env)
+        text = ''.join(doc.iter_bytes())
+        for protocol in (0, pickle.HIGHEST_PROTOCOL):
+            copy = pickle.loads(pickle.dumps(doc, protocol))
+            self.assertEqual(''.join(copy.iter_bytes()), text)
+            self.assertIs(copy._environment._data[0]._unit, Celsius())
+            # the locks are created again
+            copy._environment.updateData(Data(4, 4))
+            copy._environment._data[2]._datapoints.append(3, 12)
+            self.assertEqual(len(points), 2)
+            self.assertEqual(pickle.loads(pickle.dumps(Data(1, 2), protocol))
+                             ._value, 2)
+
+    def test_deferred_validation(self):
+        import eeml
+        eeml.defer_validation = True
+        try:
+            data = Data('foobar', 1)
+            doc = EEML(Environment(status='live'))
+            doc.updateData(Data(1, 2))
+            ''.join(doc.iter_bytes())
+            doc.updateData(data)
+            with self.assertRaises(ValueError):
+                ''.join(doc.iter_bytes())
+            with self.assertRaises(ValueError):
+                doc.toeeml()
+        finally:
+            eeml.defer_validation = False
+        with self.assertRaises(ValueError):
+            Data('foobar', 1)
+
+    def test_deferred_validation_each(self):
+        import eeml
+        doc = EEML(Environment())
+        doc.updateData([Data(1, 1, datapoints=DataPoints(1, [(2,)])),
+                        Data(2, 2)])
+        oldvalidator = eeml.validator
+        eeml.validator = checks = Checks()
+        eeml.defer_validation = True
+        try:
+            ''.join(doc.iter_bytes())
+            doc.updateData(Data(3, -3))
+            with self.assertRaises(ValueError):
+                ''.join(doc.iter_bytes())
+        finally:
+            eeml.defer_validation = False
+            eeml.validator = oldvalidator
+        self.assertEqual(sorted(checks.checked[:3]),
+                         [1, 2, ('points', 1)])
+
+    def test_validate_many(self):
+        import eeml
+        eeml.validator.validate_many([Data(1, 2), Data(2, 3, datapoints=
+                                                          DataPoints(2, []))])
+        bad = Data(1, 2)
+        bad._datapoints = DataPoints(1, [])
+        bad._datapoints._id = -1
+        with self.assertRaises(ValueError):
+            eeml.validator.validate_many([Data(2, 3), bad])
+
+    def test_slots(self):
+        for obj in (Environment(), EEML(Environment()), Location('virtual'),
+                    Data(1, 2), DataPoints(1, []), Unit('foo'), Celsius(),
+                    DataPoints.from_arrays(1, [1])):
+            self.assertFalse(hasattr(obj, '__dict__'), type(obj))
+
+    def test_shared_units(self):
+        self.assertIs(Celsius(), Celsius())
+        self.assertIs(RH(), RH())
+        self.assertIsNot(Celsius(), RH())
+        self.assertEqual(Celsius()._name, 'Celsius')
+        self.assertEqual(RH()._symbol, '%RH')
+
+    def test_timestamp_formatter(self):
+        formatter = TimestampFormatter()
+        stamps = [1347447600, 1347447659.75, 1347447660.000001, -0.5,
+                  951782399, 951782400]
+        self.assertEqual(
+            formatter.format_many(stamps),
+            [datetime.fromtimestamp(at, pytz.utc).isoformat()
+             for at in stamps])
+        at = datetime(2012, 9, 12, 11, 0, 0, 250)
+        aware = pytz.timezone('Europe/Budapest').localize(at)
+        self.assertEqual(formatter.format_many([at, aware, 1347447600]),
+                         ['2012-09-12T11:00:00.000250',
+                          '2012-09-12T11:00:00.000250+02:00',
+                          '2012-09-12T11:00:00+00:00'])
+        self.assertEqual(formatter.format(at.date()), '2012-09-12')
+
+        points = DataPoints(1, [(1, 1347447600.5)])
+        self.assertEqual(''.join(points.iter_bytes()),
+                         '<datapoints><value at="2012-09-12T11:00:00.500000'
+                         '+00:00">1</value></datapoints>')
+
+    def test_stdlib_backend(self):
+        from eeml import backend, fromstring
+        from eeml.util import _tostring
+        env = Environment('A Room & Somewhere', status='live', id_=1)
+        env.setLocation(Location('physical', 'My Room', exposure='indoor'))
+        doc = create_eeml(env, None, [
+                Data(0, 36.2, tags=['a "tag"'], unit=Celsius()),
+                DataPoints(1, [(0,), (1.5, datetime(2012, 9, 12, 11))])])
+        expected = etree.tostring(doc.toeeml(), pretty_print=True)
+        try:
+            backend.use(backend.STDLIB)
+            self.assertEqual(backend.name(), backend.STDLIB)
+            tree = doc.toeeml()
+            self.assertNotIn('nsmap', tree.attrib)
+            assert_true(xml_compare(etree.fromstring(_tostring(tree)),
+                                    etree.fromstring(expected),
+                                    reporter=self.fail))
+            self.assertEqual(_tostring(env._location.toeeml(),
+                                       pretty_print=True),
+                             '<location xmlns:xsi="http://www.w3.org/2001/'
+                             'XMLSchema-instance" xmlns="http://www.eeml.org/'
+                             'xsd/0.5.1" exposure="indoor" domain="physical">'
+                             '\n  <name>My Room</name>\n</location>\n')
+            text = ''.join(doc.iter_bytes())
+            self.assertEqual(''.join(fromstring(text).iter_bytes()), text)
+            self.assertEqual(
+                ''.join(fromstring(text, lazy=True).iter_bytes()), text)
+        finally:
+            backend.use()
+        with self.assertRaises(ValueError):
+            backend.use('libxml')
+
+    def test_backends_identical(self):
+        from eeml import backend
+        from eeml.util import _tostring
+        env = Environment(u'Caf\xe9 & <Room>', status='live', id_=1,
+                          creator='me', updated=datetime(2012, 9, 12, 11))
+        env.setLocation(Location('physical', 'My Room', exposure='indoor',
+                                 disposition='fixed'))
+        doc = create_eeml(env, None, [
+                Data(0, 36.2, tags=['a "tag"'], unit=Celsius(), minValue=0,
+                     maxValue=100, at=datetime(2012, 9, 12, 11)),
+                DataPoints(1, [(0,), (1.5, datetime(2012, 9, 12, 11))])])
+
+        def serialize():
+            return [_tostring(doc.toeeml()),
+                    _tostring(doc.toeeml(), pretty_print=True),
+                    _tostring(env._location.toeeml())]
+
+        try:
+            backend.use(backend.LXML)
+            expected = serialize()
+            backend.use(backend.STDLIB)
+            self.assertEqual(serialize(), expected)
+        finally:
+            backend.use()
+        self.assertEqual(expected[0], ''.join(doc.iter_bytes()))
+        self.assertNotIn('<?xml', expected[1])
+
+    def test_lazy_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.check_call([
+                sys.executable, '-c', 'import sys, eeml.datastream; '
+                'assert not set(["lxml", "numpy"]) & set(sys.modules)'],
+                              cwd=root)
+
+    def test_template(self):
+        env = Environment('Room', status='live')
+        env.updateData([Data(0, 1, tags=['t'], unit=Celsius()), Data(1, 2)])
+        doc = EEML(env)
+
+        def expected():
+            return etree.tostring(doc.toeeml(), encoding='UTF-8',
+                                  xml_declaration=False)
+
+        self.assertEqual(''.join(doc.iter_bytes()), expected())
+        self.assertEqual(len(env._template), 2)
+        env.updateData([Data(0, 5, tags=['t'], unit=Celsius()),
+                        Data(2, 7, tags=['t'], unit=Celsius())])
+        self.assertEqual(''.join(doc.iter_bytes()), expected())
+        self.assertEqual(len(env._template), 2)
+        env.updateData(Data(0, 6, tags=['u'], unit=Celsius()))
+        self.assertEqual(''.join(doc.iter_bytes()), expected())
+        self.assertEqual(len(env._template), 3)
+
+        env.setMetadata(title='Kitchen', status='frozen')
+        env.setLocation(Location('virtual', 'Somewhere'))
+        text = ''.join(doc.iter_bytes())
+        self.assertEqual(text, expected())
+        self.assertIn('<title>Kitchen</title><status>frozen</status>', text)
+        self.assertIn('<name>Somewhere</name>', text)
+        with self.assertRaises(ValueError):
+            env.setMetadata(title='Hall', status='foobar')
+        with self.assertRaises(TypeError):
+            env.setMetadata(foobar=1)
+        self.assertEqual((env._title, env._status), ('Kitchen', 'frozen'))
+        self.assertEqual(''.join(doc.iter_bytes()), text)
+
+    def test_ring_datapoints(self):
+        from datetime import timedelta
+        from eeml import RingDataPoints
+        points = RingDataPoints(1, 3)
+        points.extend([1, 2, 3, 4], [10, 11, 12, 13])
+        self.assertEqual(len(points), 3)
+        self.assertEqual(''.join(points.iter_bytes()),
+                         '<datapoints>'
+                         '<value at="1970-01-01T00:00:11+00:00">2.0</value>'
+                         '<value at="1970-01-01T00:00:12+00:00">3.0</value>'
+                         '<value at="1970-01-01T00:00:13+00:00">4.0</value>'
+                         '</datapoints>')
+        self.assertEqual(etree.tostring(points.toeeml()),
+                         etree.tostring(DataPoints(1, points._values)
+                                        .toeeml()))
+        mark = points.mark()
+        points.append(5, 14)
+        points.acknowledge(mark)
+        self.assertEqual([value for (value, at) in points._values], [5])
+        points.acknowledge(points.mark())
+        self.assertEqual(''.join(points.iter_bytes()), '<datapoints/>')
+
+        points = RingDataPoints(1, 100, window=timedelta(seconds=2))
+        points.extend(range(5), range(5))
+        self.assertEqual([value for (value, at) in points._values],
+                         [2, 3, 4])
+        points.append(6)
+        self.assertEqual(len(points), 1)
+        for capacity, window in ((0, None), (-1, None), (2.5, None),
+                                 ('10', None), (10, 0), (10, -5),
+                                 (10, timedelta(0)), (10, '2')):
+            with self.assertRaises(ValueError):
+                RingDataPoints(1, capacity, window)
+        self.assertEqual(RingDataPoints(1, 10, 0.5)._window, 500000)
+
+    def test_snapshot(self):
+        env = Environment()
+        env.updateData([Data(1, 1), Data(2, 2)])
+        snapshot = env.snapshot()
+        data = snapshot[1]
+        env.updateData([Data(2, 'changed'), DataPoints(1, [(3,)])])
+        env.removeData(1)
+        env.removeData(5)
+        self.assertEqual(sorted(snapshot), [1, 2])
+        self.assertIs(snapshot[1], data)
+        self.assertIsNone(data._datapoints)
+        self.assertEqual(snapshot[2]._value, 2)
+        self.assertEqual(env.snapshot().keys(), [2])
+
+        env.updateData(DataPoints(2, [(4,)]))
+        self.assertEqual(env.snapshot()[2]._value, 'changed')
+        self.assertEqual(env.snapshot()[2]._datapoints._values, [(4,)])
+
+    def test_concurrent_updates(self):
+        import threading
+        env = Environment()
+        doc = EEML(env)
+        stop = []
+
+        def produce(offset):
+            i = 0
+            while not stop:
+                env.updateData([Data(offset + i % 500, i),
+                                DataPoints(offset, [(i,)])])
+                i += 1
+        producers = [threading.Thread(target=produce, args=(offset,))
+                     for offset in (0, 1000)]
+        for thread in producers:
+            thread.start()
+        try:
+            for i in range(20):
+                etree.fromstring(''.join(doc.iter_bytes()))
+                doc.toeeml()
+                doc.to_json()
+        finally:
+            stop.append(True)
+            for thread in producers:
+                thread.join()
+        self.assertEqual(len(env.snapshot()), 1000)
+
+    def test_update_from_arrays(self):
+        at = datetime(2012, 9, 12, 11)
+        env = Environment()
+        env.update_from_arrays([1, 2], [21.5, '40'], Celsius(), ['a'], at)
+        env.update_from_arrays([3, 4], [1, 2], [None, RH()], [['b'], []],
+                               [1347447600, 1347447601])
+        expected = Environment()
+        expected.updateData([
+                Data(1, 21.5, ['a'], unit=Celsius(), at=at),
+                Data(2, '40', ['a'], unit=Celsius(), at=at),
+                Data(3, 1, ['b'],
+                     at=datetime(2012, 9, 12, 11, tzinfo=pytz.utc)),
+                Data(4, 2, [], unit=RH(),
+                     at=datetime(2012, 9, 12, 11, 0, 1, tzinfo=pytz.utc))])
+        self.assertEqual(''.join(env.iter_bytes()),
+                         ''.join(expected.iter_bytes()))
+
+        env.update_from_records({'id': [1], 'value': [5]})
+        self.assertEqual(env.snapshot()[1]._value, 5)
+        self.assertIsNone(env.snapshot()[1]._at)
+
+        for args in (([1, -1], [1, 2]), ([1, 'x'], [1, 2]), ([1, 2], [1]),
+                     ([1], [1], 'unit'), ([1], [1], None, (), ['now'])):
+            with self.assertRaises(ValueError):
+                env.update_from_arrays(*args)
+
+        env.update_from_arrays([1, 2], [1, 2], tags=['a'])
+        first, second = env.snapshot()[1]._tags, env.snapshot()[2]._tags
+        first.append('b')
+        self.assertEqual(second, ['a'])
+
+    def test_update_from_arrays_validator(self):
+        import eeml
+        env = Environment()
+        oldvalidator = eeml.validator
+        eeml.validator = checks = Checks()
+        try:
+            env.update_from_arrays([1, 2], [1, 2])
+            with self.assertRaises(ValueError):
+                env.update_from_arrays([3, 4], [3, -4])
+        finally:
+            eeml.validator = oldvalidator
+        self.assertEqual(checks.checked, [1, 2, 3, 4])
+        self.assertEqual(sorted(env.snapshot()), [1, 2])
+
+    def test_update_from_numpy(self):
+        try:
+            import numpy
+        except ImportError:
+            from nose import SkipTest
+            raise SkipTest("numpy is not installed")
+        records = numpy.zeros(3, [('id', 'i4'), ('value', 'f8'),
+                                  ('at', 'datetime64[s]')])
+        records['id'] = [1, 2, 3]
+        records['value'] = [1.5, 2, 3]
+        records['at'] = numpy.datetime64('2012-09-12T11:00:00')
+        env = Environment()
+        env.update_from_records(records, Celsius())
+        data = env.snapshot()[2]
+        self.assertEqual((data._id, data._value, data._unit),
+                         (2, 2.0, Celsius()))
+        self.assertIs(type(data._id), int)
+        self.assertEqual(data._at, datetime(2012, 9, 12, 11, tzinfo=pytz.utc))
+        with self.assertRaises(ValueError):
+            env.update_from_arrays(numpy.array([1.5]), numpy.array([1]))
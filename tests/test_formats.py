@@ -0,0 +1,81 @@
+import csv
+import json
+from datetime import datetime
+from StringIO import StringIO
+from unittest import TestCase
+
+from eeml import Data, DataPoints, Environment, Location, create_eeml
+from eeml.datastream import Cosm, ConnectionPool
+from eeml.unit import Celsius
+
+from stub_server import StubServer
+
+
+class TestFormats(TestCase):
+
+    def document(self):
+        env = Environment('Room "1"', status='live', id_=3, private=False,
+                          updated=datetime(2012, 9, 12, 11))
+        env.setLocation(Location('physical', 'My Room', 32.4, 22.7))
+        return create_eeml(env, None, [
+                Data(0, 21.5, tags=['temperature'], unit=Celsius(),
+                     minValue=-1, at=datetime(2012, 9, 12, 11)),
+                DataPoints(1, [(1,), (2, datetime(2012, 9, 12, 11))]),
+                DataPoints.from_arrays(2, range(3000),
+                                       range(1347447600, 1347450600))])
+
+    def test_json(self):
+        doc = self.document()
+        parsed = json.loads(doc.to_json())
+        self.assertEqual(parsed['version'], '1.0.0')
+        self.assertEqual(parsed['title'], 'Room "1"')
+        self.assertEqual(parsed['private'], 'false')
+        self.assertEqual(parsed['location'], {
+                'domain': 'physical', 'name': 'My Room', 'lat': '32.4',
+                'lon': '22.7'})
+        first, second, third = parsed['datastreams']
+        self.assertEqual(first, {
+                'id': '0', 'current_value': '21.5', 'min_value': '-1',
+                'at': '2012-09-12T11:00:00', 'tags': ['temperature'],
+                'unit': {'label': 'Celsius', 'symbol': u'\xb0C',
+                         'type': 'derivedSI'}})
+        self.assertEqual(second['datapoints'], [
+                {'value': '1'}, {'value': '2', 'at': '2012-09-12T11:00:00'}])
+        self.assertEqual(len(third['datapoints']), 3000)
+        self.assertEqual(third['datapoints'][-1], {
+                'value': '2999.0', 'at': '2012-09-12T11:49:59+00:00'})
+
+        self.assertEqual(json.loads(doc.to_json(set([1]))), {
+                'version': '1.0.0', 'datastreams': [second]})
+        self.assertEqual(json.loads(doc._environment._data[1].to_json()),
+                         second)
+
+    def test_csv(self):
+        doc = self.document()
+        rows = list(csv.reader(StringIO(doc.to_csv())))
+        self.assertEqual(rows[:3], [
+                ['0', '2012-09-12T11:00:00', '21.5'], ['1', '1'],
+                ['1', '2012-09-12T11:00:00', '2']])
+        self.assertEqual(len(rows), 3003)
+        self.assertEqual(Data(4, 'a, "b"').to_csv(), '4,"a, ""b"""\r\n')
+        self.assertEqual(doc.to_csv(set([0])), '0,2012-09-12T11:00:00,21.5\r\n')
+
+    def test_cosm(self):
+        server = StubServer()
+        pool = ConnectionPool()
+        try:
+            for extension, content_type in (('json', 'application/json'),
+                                            ('csv', 'text/csv')):
+                cosm = Cosm('/v2/feeds/1.' + extension, 'ASDF',
+                            use_https=False, pool=pool, dat=[Data(1, 2)])
+                cosm.host = server.host
+                cosm.put()
+                method, path, headers, body = server.requests[-1]
+                self.assertEqual(path, '/v2/feeds/1.' + extension)
+                self.assertEqual(headers['content-type'], content_type)
+            self.assertEqual(body, '1,2\r\n')
+        finally:
+            pool.close()
+            server.stop()
+        with self.assertRaises(ValueError):
+            Cosm('/v2/feeds/1.txt', 'ASDF')
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from unittest import TestCase, skipIf
+
+from eeml.datastream import BufferedCosm, ConnectionPool
+from eeml.ingest import Field, KeyValueFormat, LineReader, RegexFormat, \
+     SplitFormat
+from eeml.unit import Celsius, RH
+
+from stub_server import StubServer
+
+try:
+    from eeml.aio import asyncio, default_executor, read_lines
+except ImportError:
+    asyncio = None
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.readings = []
+
+    def update(self, data):
+        self.readings.extend(data)
+
+
+class TestIngest(TestCase):
+
+    def test_formats(self):
+        at = None
+        fmt = SplitFormat([Field(0, Celsius()), None, Field(1, type_=int)],
+                          ',')
+        first, second = fmt.parse('21.5, x, 40', at)
+        self.assertEqual((first._id, first._value, first._unit),
+                         (0, 21.5, Celsius()))
+        self.assertEqual((second._id, second._value), (1, 40))
+        with self.assertRaises(ValueError):
+            fmt.parse('21.5,x', at)
+        with self.assertRaises(ValueError):
+            fmt.parse('a,b,c', at)
+
+        fmt = KeyValueFormat({'T': Field(0), 'H': Field(1, RH())})
+        self.assertEqual([(data._id, data._value)
+                          for data in fmt.parse('T=21.5 X=3 H=40', at)],
+                         [(0, 21.5), (1, 40)])
+        with self.assertRaises(ValueError):
+            fmt.parse('T 21.5', at)
+
+        fmt = RegexFormat(r'temp: (?P<t>\S+)(?: hum: (?P<h>\S+))?',
+                          {'t': Field(0), 'h': Field(1)})
+        self.assertEqual([data._id for data in fmt.parse('temp: 1', at)],
+                         [0])
+        with self.assertRaises(ValueError):
+            fmt.parse('pressure: 1', at)
+
+    def test_reader(self):
+        sink = Sink()
+        reader = LineReader(['1 2\n', '\n', 'garbage\n', '3 4\r\n'],
+                            SplitFormat([Field(0), Field(1)]), sink)
+        reader.run()
+        self.assertEqual([data._value for data in sink.readings],
+                         [1, 2, 3, 4])
+        self.assertEqual((reader.lines, reader.errors), (3, 1))
+        self.assertIsInstance(reader.last_error, ValueError)
+
+    def test_partial_lines(self):
+        # a serial port with a timeout returns what arrived so far
+        class Port(object):
+            timeout = 1
+
+            def __init__(self, reads):
+                self.reads = list(reads)
+
+            def readline(self):
+                if not self.reads:
+                    reader.stop()
+                    return ''
+                return self.reads.pop(0)
+
+        sink = Sink()
+        reader = LineReader(Port(['21.5 4', '', '0\n', '22', '.0 41\r\n',
+                                  '23 42']),
+                            SplitFormat([Field(0), Field(1)]), sink)
+        reader.run()
+        self.assertEqual([data._value for data in sink.readings],
+                         [21.5, 40, 22.0, 41])
+        self.assertEqual((reader.lines, reader.errors), (2, 0))
+
+        reader = LineReader(['1 2\n', '3 4'],
+                            SplitFormat([Field(0), Field(1)]), sink)
+        reader.run()
+        self.assertEqual([data._value for data in sink.readings[4:]],
+                         [1, 2, 3, 4])
+
+    def test_slow_upload(self):
+        # the reader keeps draining a pseudo terminal while puts are slow
+        server = StubServer()
+        server.delay = 0.2
+        pool = ConnectionPool()
+        cosm = BufferedCosm(1, 'ASDF', use_https=False, pool=pool,
+                            batch_size=10, interval=0.05)
+        cosm.host = server.host
+        master, slave = os.openpty()
+        source = os.fdopen(slave, 'r')
+        reader = LineReader(source, SplitFormat([Field(0), Field(1)]), cosm)
+        try:
+            reader.start()
+            started = time.time()
+            for i in range(200):
+                os.write(master, '{} {}\n'.format(i, -i))
+            while reader.lines < 200 and time.time() - started < 5:
+                time.sleep(0.01)
+            self.assertLess(time.time() - started, 1)
+            self.assertEqual(reader.lines, 200)
+            reader.stop()
+            os.close(master)
+            reader.join(5)
+            cosm.close()
+        finally:
+            pool.close()
+            server.stop()
+        body = ''.join(request[3] for request in server.requests)
+        self.assertEqual(body.count('<value'), 400)
+
+    @skipIf(asyncio is None, 'asyncio is not available')
+    def test_read_lines(self):
+        # the reader does not take a thread of the busy default executor
+        release = threading.Event()
+        for i in range(default_executor._max_workers):
+            default_executor.submit(release.wait, 5)
+        sink = Sink()
+        reader = LineReader(['1 2\n', '3 4\n'],
+                            SplitFormat([Field(0), Field(1)]), sink)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(
+                asyncio.wait_for(read_lines(reader), 2))
+        finally:
+            release.set()
+            loop.close()
+        self.assertEqual([data._value for data in sink.readings],
+                         [1, 2, 3, 4])
@@ -0,0 +1,70 @@
+import time
+from unittest import TestCase
+
+from eeml import Data
+from eeml.datastream import CosmError
+from eeml.manager import FeedManager
+
+from stub_server import StubServer
+
+
+class TestFeedManager(TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.manager = FeedManager(workers=4, per_host=2)
+
+    def tearDown(self):
+        self.manager.close()
+        self.server.stop()
+
+    def feed(self, id_, **kwargs):
+        cosm = self.manager.create(id_, 'ASDF', use_https=False,
+                                   dat=[Data(1, id_)], **kwargs)
+        cosm.host = self.server.host
+        return cosm
+
+    def test_put_all(self):
+        self.server.delay = 0.05
+        self.server.responses.append((500, ''))
+        feeds = [self.feed(i) for i in range(1, 7)]
+        self.manager.put_all()
+        self.manager.wait()
+
+        self.assertEqual(len(self.server.requests), 6)
+        self.assertEqual(self.server.max_active, 2)
+        self.assertEqual(sorted(request[1] for request in self.server.requests),
+                         ['/v2/feeds/{}.xml'.format(i) for i in range(1, 7)])
+        stats = self.manager.stats()
+        self.assertEqual(sum(s.puts for s in stats.values()), 6)
+        self.assertEqual(sum(s.failures for s in stats.values()), 1)
+        for feed in feeds:
+            self.assertTrue(stats[feed].mean_latency >= 0.05)
+        self.assertEqual([type(s.last_error) for s in stats.values()
+                          if s.failures], [CosmError])
+
+    def test_rate_limit(self):
+        cosm = self.feed(1, min_interval=0.2)
+        start = time.time()
+        self.manager.put(cosm)
+        self.manager.wait()
+        cosm.update(Data(1, 2))
+        self.manager.put(cosm)
+        self.manager.put(cosm)
+        self.manager.wait()
+        self.assertTrue(time.time() - start >= 0.2)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(self.manager.stats()[cosm].puts, 2)
+
+    def test_host_changed_during_put(self):
+        self.server.delay = 0.1
+        cosm = self.feed(1)
+        self.manager.put(cosm)
+        time.sleep(0.05)
+        cosm.host = 'example.invalid'
+        deadline = time.time() + 2
+        while any(self.manager._active.values()) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertFalse(any(self.manager._active.values()))
+        self.assertEqual(self.manager.stats()[cosm].puts, 1)
+        self.assertEqual(len(self.server.requests), 1)
@@ -0,0 +1,108 @@
+import socket
+from unittest import TestCase
+
+from eeml import Data, DataPoints, EEML, Environment, Location, metrics
+from eeml.datastream import Cosm, CosmError, ConnectionPool
+from eeml.spool import Backoff
+from eeml.util import _tostring
+
+from stub_server import StubServer
+
+
+class TestMetrics(TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+        metrics.add_hook(self.registry)
+
+    def tearDown(self):
+        metrics.remove_hook(self.registry)
+
+    def test_serialization(self):
+        doc = EEML(Environment(title='metrics'))
+        doc._environment.setLocation(Location('physical'))
+        doc.updateData([Data(1, 2), DataPoints(1, [(3,)])])
+        _tostring(doc.toeeml())
+        ''.join(doc.iter_bytes())
+
+        histogram = self.registry.histogram
+        self.assertEqual(histogram('eeml_validation_seconds',
+                                   type='data')[0], 1)
+        self.assertEqual(histogram('eeml_validation_seconds',
+                                   type='datapoints')[0], 1)
+        for element in ('document', 'environment', 'location', 'data',
+                        'datapoints'):
+            self.assertEqual(histogram('eeml_serialize_seconds',
+                                       element=element, method='toeeml')[0],
+                             1)
+        self.assertEqual(histogram('eeml_serialize_seconds',
+                                   element='document', method='tostring')[0],
+                         1)
+        self.assertEqual(histogram('eeml_serialize_seconds', element='data',
+                                   method='iter_bytes')[0], 1)
+
+        metrics.remove_hook(self.registry)
+        self.assertFalse(metrics.enabled)
+        Data(2, 3).toeeml()
+        self.assertEqual(histogram('eeml_validation_seconds',
+                                   type='data')[0], 1)
+        metrics.add_hook(self.registry)
+
+    def test_put(self):
+        server = StubServer()
+        pool = ConnectionPool()
+        try:
+            cosm = Cosm('/v2/feeds/1.json', 'ASDF', use_https=False,
+                        pool=pool, retry=Backoff(retries=1),
+                        dat=[Data(1, 2)])
+            cosm.host = server.host
+            cosm._sleep = lambda delay: None
+            server.responses.append((500, ''))
+            cosm.put()
+            server.responses.append((401, ''))
+            with self.assertRaises(CosmError):
+                cosm.put(full=True)
+        finally:
+            pool.close()
+            server.stop()
+
+        counter = self.registry.counter
+        histogram = self.registry.histogram
+        self.assertEqual(counter('eeml_http_responses_total', status=500), 1)
+        self.assertEqual(counter('eeml_http_responses_total', status=200), 1)
+        self.assertEqual(counter('eeml_http_responses_total', status=401), 1)
+        self.assertEqual(counter('eeml_put_retries_total'), 1)
+        self.assertEqual(counter('eeml_put_failures_total'), 1)
+        self.assertEqual(histogram('eeml_put_seconds')[0], 2)
+        self.assertEqual(histogram('eeml_http_connect_seconds',
+                                   scheme='http')[0], 1)
+        self.assertEqual(histogram('eeml_http_response_seconds')[0], 3)
+        self.assertEqual(histogram('eeml_payload_bytes', format='json'),
+                         (2, 2 * len(cosm._eeml.to_json())))
+
+        text = self.registry.prometheus()
+        self.assertIn('# TYPE eeml_put_retries_total counter\n'
+                      'eeml_put_retries_total 1\n', text)
+        self.assertIn('eeml_payload_bytes_bucket{format="json",le="256"} 2\n'
+                      'eeml_payload_bytes_bucket{format="json",le="1024"} 2\n',
+                      text)
+        self.assertIn('eeml_payload_bytes_count{format="json"} 2\n', text)
+        self.assertIn('eeml_http_responses_total{status="401"} 1\n', text)
+
+    def test_statsd(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        hook = metrics.StatsdHook(port=receiver.getsockname()[1],
+                                  prefix='test.')
+        try:
+            hook.increment('eeml_put_retries_total', 1, ())
+            hook.observe('eeml_put_seconds', 0.5, ())
+            hook.observe('eeml_payload_bytes', 100, (('format', 'xml'),))
+            self.assertEqual([receiver.recv(512) for i in range(3)], [
+                    'test.eeml_put_retries_total:1|c',
+                    'test.eeml_put_seconds:500.0|ms',
+                    'test.eeml_payload_bytes.format_xml:100|h'])
+        finally:
+            hook.close()
+            receiver.close()
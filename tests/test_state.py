@@ -0,0 +1,90 @@
+import os
+import tempfile
+from datetime import date, datetime
+from unittest import TestCase
+
+import pytz
+
+from eeml import Data, DataPoints, EEML, Environment, Location, \
+     RingDataPoints
+from eeml import state
+from eeml.unit import Celsius, Unit
+
+
+class TestState(TestCase):
+
+    def document(self):
+        env = Environment('Room', status='live', id_=3, private=False,
+                          updated=date(2012, 9, 12))
+        env.setLocation(Location('physical', u'R\xf6om', 32.4, 22.7))
+        ring = RingDataPoints(4, 5, window=60)
+        for i in range(8):
+            ring.append(i, 1347447600 + i)
+        env.updateData([
+                Data(0, 21.5, tags=['a', 'b'], unit=Celsius(), minValue=-1,
+                     at=datetime(2012, 9, 12, 11)),
+                Data(1, '3', tags=['a', 'b'], unit=Unit('x', symbol='y')),
+                DataPoints(1, [(1,), (2, datetime(2012, 9, 12, 11))]),
+                DataPoints.from_arrays(2, range(3000),
+                                       range(1347447600, 1347450600)),
+                Data(3, 2 ** 70, at=pytz.timezone('Europe/Budapest').localize(
+                        datetime(2012, 1, 1))),
+                Data(4, True, datapoints=ring)])
+        return EEML(env)
+
+    def test_roundtrip(self):
+        doc = self.document()
+        text = state.dumps(doc)
+        restored = state.loads(text)
+        self.assertIsInstance(restored, EEML)
+        self.assertEqual(''.join(restored.iter_bytes()),
+                         ''.join(doc.iter_bytes()))
+        self.assertLess(len(text), len(''.join(doc.iter_bytes())) / 2)
+
+        datas = restored._environment.snapshot()
+        self.assertIs(datas[0]._unit, Celsius())
+        self.assertIsNot(datas[0]._tags, datas[1]._tags)
+        self.assertEqual(datas[3]._value, 2 ** 70)
+        self.assertEqual(datas[3]._at.utcoffset().seconds, 3600)
+        ring = datas[4]._datapoints
+        self.assertEqual(list(ring._arrays()[0]), [3, 4, 5, 6, 7])
+        self.assertEqual(ring._window, 60000000)
+        ring.append(8, 1347447608)
+        self.assertEqual(list(ring._arrays()[0]), [4, 5, 6, 7, 8])
+
+    def test_file(self):
+        doc = self.document()
+        env = Environment(title='second')
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                state.dump([doc, env], f)
+            for use_mmap in (True, False):
+                with open(path, 'rb') as f:
+                    first, second = state.load(f, use_mmap)
+                self.assertEqual(''.join(first.iter_bytes()),
+                                 ''.join(doc.iter_bytes()))
+                self.assertIsInstance(second, Environment)
+                self.assertEqual(second._title, 'second')
+
+            # a state after a header is read from the current position
+            with open(path, 'rb') as f:
+                text = f.read()
+            with open(path, 'wb') as f:
+                f.write('header\n' + text)
+            for use_mmap in (True, False):
+                with open(path, 'rb') as f:
+                    f.readline()
+                    first, second = state.load(f, use_mmap)
+                    self.assertEqual(f.tell(), len(text) + 7)
+                self.assertEqual(second._title, 'second')
+            with open(path, 'rb') as f:
+                with self.assertRaises(ValueError):
+                    state.load(f)
+        finally:
+            os.remove(path)
+
+        with self.assertRaises(ValueError):
+            state.loads('<eeml/>')
+        with self.assertRaises(TypeError):
+            state.dumps(EEML(Environment(title=object())))